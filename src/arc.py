@@ -3,10 +3,11 @@
 # http://code.activestate.com/recipes/576532-adaptive-replacement-cache-in-python/
 
 from collections import deque
-import csv
+from metadata import container_bytes
+from telemetry import BufferedCSVSink
 
 class ARCPolicy(object):
-    def __init__(self, size, csv_suffix=".csv"):
+    def __init__(self, size, csv_suffix=".csv", telemetry=None):
         self.c = size
         self.p = 0
         self.t1 = deque()
@@ -21,13 +22,25 @@ class ARCPolicy(object):
                 'len_t1', 'len_b1', 'len_t2', 'len_b2']
         self.ts_datapoint = {key: None for key in self.ts_order}
         self.ts_datapoint['row'] = 0
-        self.ts_file = open("csv/arc" + csv_suffix, "w")
-        self.ts_writer = csv.writer(self.ts_file)
-        self.ts_writer.writerow(self.ts_order)
+        if telemetry is None:
+            telemetry = BufferedCSVSink()
+        self.telemetry = telemetry
+        self.ts_writer = self.telemetry.open("arc" + csv_suffix, self.ts_order)
+
+    def close(self):
+        """Close the policy's time series, flushing what is buffered."""
+        self.ts_writer.close()
 
     def hit_rate(self):
         return float(self.hits) / self.requests
 
+    def metadata_bytes(self):
+        return {
+                'entries': container_bytes(self.t1) + container_bytes(self.t2),
+                'ghosts': container_bytes(self.b1) + container_bytes(self.b2),
+                'trace': 0,
+                'indexes': 0}
+
     def replace(self, page):
         if (
           self.t1 and
@@ -54,15 +67,15 @@ class ARCPolicy(object):
                 self.ts_datapoint['b1'], self.ts_datapoint['b2'])
         if self.ts_datapoint['hit']:
             self.hits += 1
-        self.ts_datapoint['hit_rate'] = self.hit_rate()
-        self.ts_datapoint['p'] = self.p
-        self.ts_datapoint['len_t1'] = len(self.t1)
-        self.ts_datapoint['len_b1'] = len(self.b1)
-        self.ts_datapoint['len_t2'] = len(self.t2)
-        self.ts_datapoint['len_b2'] = len(self.b2)
-        self.ts_writer.writerow(
-                [self.ts_datapoint[key] for key in self.ts_order])
-        self.ts_file.flush()
+        if self.ts_writer.offer_row():
+            self.ts_datapoint['hit_rate'] = self.hit_rate()
+            self.ts_datapoint['p'] = self.p
+            self.ts_datapoint['len_t1'] = len(self.t1)
+            self.ts_datapoint['len_b1'] = len(self.b1)
+            self.ts_datapoint['len_t2'] = len(self.t2)
+            self.ts_datapoint['len_b2'] = len(self.b2)
+            self.ts_writer.writerow(
+                    [self.ts_datapoint[key] for key in self.ts_order])
 
     def _request(self, page):
         if page in self.t1:
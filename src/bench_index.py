@@ -0,0 +1,231 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+"""Benchmark the index backends on the stack and ranker operations of an MMC
+run, and check how they scale.
+
+The run is recorded once through RBTree subclasses that log every insert,
+discard, lookup, rekey and bulk load; the logs are then replayed on each
+backend that can hold them and on bintrees' FastRBTree. FastRBTree has no
+index(), so its replay skips the lookups and its rate is an upper bound.
+The recorded run is a synthetic trace, or the first requests of an SPC
+trace when one is named.
+
+The scaling runs fill each stack backend with n keys and then move random
+keys to the front, the way MMCPolicy restacks a page, for n from 10^3 up to
+max_keys. They report operations per second and metadata bytes per entry.
+Finally the whole policy is timed with each backend.
+
+    python bench_index.py [requests] [entries] [max_keys] [spc_file]
+"""
+
+import sys
+import time
+import mmc
+from bintrees import FastRBTree
+from index_rbtree import RANKER_INDEXES, STACK_INDEXES
+from index_rbtree.rbtree import RBTree
+from metadata import tree_bytes
+from numpy import random
+from simulate import spc_trace, synthetic_trace
+from telemetry import NullSink
+
+INSERT, DISCARD, INDEX, FINGER, INDEX_MANY, BISECT, REKEY, LOAD = range(8)
+
+
+def recording_tree(log):
+    class RecordingRBTree(RBTree):
+        def __setitem__(self, key, value):
+            log.append((INSERT, key, None))
+            RBTree.insert(self, key, value)
+
+        def discard(self, key):
+            log.append((DISCARD, key, None))
+            RBTree.discard(self, key)
+
+        def index(self, key):
+            log.append((INDEX, key, None))
+            return RBTree.index(self, key)
+
+        def finger_index(self, key, limit=None):
+            log.append((FINGER, key, limit))
+            return RBTree.finger_index(self, key, limit)
+
+        def index_many(self, keys):
+            keys = list(keys)
+            log.append((INDEX_MANY, keys, None))
+            return RBTree.index_many(self, keys)
+
+        def bisect_left(self, key):
+            log.append((BISECT, key, None))
+            return RBTree.bisect_left(self, key)
+
+        def rekey(self, old_key, new_key):
+            log.append((REKEY, old_key, new_key))
+            RBTree.rekey(self, old_key, new_key)
+
+        def _load_sorted(self, items):
+            log.append((LOAD, [key for key, _ in items], None))
+            RBTree._load_sorted(self, items)
+
+    return RecordingRBTree
+
+
+def record(pages, entries):
+    stack_log = []
+    ranker_log = []
+    STACK_INDEXES['record'] = recording_tree(stack_log)
+    RANKER_INDEXES['record'] = recording_tree(ranker_log)
+    policy = mmc.MMCPolicy(entries, entries, 4 * entries,
+                           telemetry=NullSink(), stack_index='record',
+                           ranker_index='record')
+    for page in pages:
+        policy.request(page)
+    del STACK_INDEXES['record']
+    del RANKER_INDEXES['record']
+    return stack_log, ranker_log
+
+
+def replay(tree_class, log):
+    has_index = hasattr(tree_class, 'index')
+    has_finger = hasattr(tree_class, 'finger_index')
+    has_many = hasattr(tree_class, 'index_many')
+    has_rekey = hasattr(tree_class, 'rekey')
+    has_bisect = hasattr(tree_class, 'bisect_left')
+    tree = tree_class()
+    start = time.time()
+    for op, key, arg in log:
+        if op == INSERT:
+            tree[key] = None
+        elif op == DISCARD:
+            tree.discard(key)
+        elif op == INDEX or op == FINGER:
+            # Purged nodes look themselves up with a key of None.
+            try:
+                if has_finger:
+                    tree.finger_index(key, arg)
+                elif has_index:
+                    tree.index(key)
+            except KeyError:
+                pass
+        elif op == INDEX_MANY:
+            if has_many:
+                tree.index_many(key)
+            elif has_index:
+                for many_key in key:
+                    tree.index(many_key)
+        elif op == BISECT:
+            if has_bisect:
+                tree.bisect_left(key)
+        elif op == REKEY:
+            if has_rekey:
+                tree.rekey(key, arg)
+            else:
+                tree.insert(arg, tree.pop(key))
+        else:
+            items = [(sorted_key, None) for sorted_key in key]
+            if hasattr(tree_class, 'from_sorted_items'):
+                tree = tree_class.from_sorted_items(items)
+            else:
+                tree = tree_class(items)
+    return time.time() - start
+
+
+def scale(tree_class, size, seed=0):
+    """Fill a tree with size keys, newest first, then restack size random
+    keys. Returns fill and restack operations per second and metadata bytes
+    per entry."""
+    rng = random.RandomState(seed)
+    tree = tree_class()
+    has_index = hasattr(tree_class, 'index')
+    start = time.time()
+    for key in xrange(-1, -size - 1, -1):
+        tree[key] = None
+    fill_rate = size / max(time.time() - start, 1e-9)
+    bytes_per_entry = float(tree_bytes(tree)) / size
+
+    keys = list(range(-1, -size - 1, -1))
+    newest = -size - 1
+    picks = rng.randint(0, size, size).tolist()
+    start = time.time()
+    for slot in picks:
+        key = keys[slot]
+        if has_index:
+            tree.index(key)
+        tree.discard(key)
+        tree[newest] = None
+        keys[slot] = newest
+        newest -= 1
+    restack_rate = size / max(time.time() - start, 1e-9)
+    return fill_rate, restack_rate, bytes_per_entry
+
+
+def time_policy(pages, entries, stack_index, ranker_index):
+    policy = mmc.MMCPolicy(entries, entries, 4 * entries,
+                           telemetry=NullSink(), stack_index=stack_index,
+                           ranker_index=ranker_index)
+    start = time.time()
+    for page in pages:
+        policy.request(page)
+    return time.time() - start, policy.num_hits
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    entries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    max_keys = int(sys.argv[3]) if len(sys.argv) > 3 else 10**5
+    if len(sys.argv) > 4:
+        pages = [page for page, _ in spc_trace(sys.argv[4], 0, count)]
+    else:
+        pages = list(synthetic_trace(count=count, tau=0.35,
+                                     theta=[0.01, 0.002]))
+
+    stack_log, ranker_log = record(pages, entries)
+    print "{0} requests, {1} entries".format(len(pages), entries)
+    for name, log, backends in (("stack", stack_log, STACK_INDEXES),
+                                ("ranker", ranker_log, RANKER_INDEXES)):
+        print "{0}: {1} operations".format(name, len(log))
+        backends = sorted(backends.items()) + [("FastRBTree", FastRBTree)]
+        for label, tree_class in backends:
+            elapsed = replay(tree_class, log)
+            print "  {0:<12} {1:8.3f} s {2:>10.0f} ops/s".format(
+                    label, elapsed, len(log) / max(elapsed, 1e-9))
+
+    print "scaling: fill ops/s, restack ops/s, bytes/entry"
+    size = 1000
+    while size <= max_keys:
+        print "  {0} keys".format(size)
+        backends = (sorted(STACK_INDEXES.items()) +
+                    [("FastRBTree", FastRBTree)])
+        for label, tree_class in backends:
+            print "    {0:<12} {1:>10.0f} {2:>10.0f} {3:8.1f}".format(
+                    label, *scale(tree_class, size))
+        size *= 10
+
+    for index in sorted(set(STACK_INDEXES) & set(RANKER_INDEXES)):
+        elapsed, hits = time_policy(pages, entries, index, index)
+        print "MMCPolicy {0:<10} {1:8.3f} s  {2} hits".format(
+                index, elapsed, hits)
@@ -0,0 +1,91 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+"""Time MMCPolicy and ArrayMMCPolicy requests on a full cache, where every
+request pages out, and on hits that never page out.
+
+Each policy is first filled with 2 * entries pages and paged out down to its
+limits once, then timed on uniformly random requests over 3 * entries pages.
+The filling is done with the limits raised, so that it does not pay for a
+pageout per request. The hits are timed on a second policy that keeps all
+2 * entries pages; there ArrayMMCPolicy still pays the O(capacity) NodeTable
+shifts of each restack and rerank.
+
+    python bench_pageout.py [entries] [requests]
+"""
+
+import sys
+import time
+from mmc import MMCPolicy
+from mmc_array import ArrayMMCPolicy
+from numpy import random
+from telemetry import NullSink
+
+
+def fill(policy, entries):
+    limits = policy.cache_entries_limit, policy.ghost_entries_limit
+    policy.cache_entries_limit = policy.ghost_entries_limit = 2 * entries
+    for page in xrange(2 * entries):
+        policy.request(page)
+    policy.cache_entries_limit, policy.ghost_entries_limit = limits
+    policy.pageout()
+
+
+def time_requests(policy, pages):
+    start = time.time()
+    for page in pages:
+        policy.request(page)
+    return time.time() - start
+
+
+def time_hits(policy_class, mode, entries, pages):
+    policy = policy_class(2 * entries, 2 * entries, 4 * entries,
+                          pageout_mode=mode, telemetry=NullSink())
+    for page in xrange(2 * entries):
+        policy.request(page)
+    return time_requests(policy, [page % (2 * entries) for page in pages])
+
+
+if __name__ == '__main__':
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 10**5
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    random.seed(0)
+    pages = random.randint(0, 3 * entries, count).tolist()
+    print "{0} entries, {1} requests".format(entries, count)
+    for label, policy_class, mode in (("MMCPolicy scan", MMCPolicy, 'scan'),
+                                      ("MMCPolicy frontier", MMCPolicy,
+                                       'frontier'),
+                                      ("ArrayMMCPolicy", ArrayMMCPolicy,
+                                       'vector')):
+        policy = policy_class(entries, entries, 4 * entries,
+                              pageout_mode=mode, telemetry=NullSink())
+        fill(policy, entries)
+        elapsed = time_requests(policy, pages)
+        hits_elapsed = time_hits(policy_class, mode, entries, pages)
+        print ("  {0:<18} {1:8.3f} ms/request  {2} hits  "
+               "{3:8.3f} ms/hit without pageout").format(
+                label, 1000 * elapsed / count, policy.num_hits,
+                1000 * hits_elapsed / count)
@@ -0,0 +1,121 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+from dump_full_cache_to_csv import dump_cache
+from index_rbtree.persistent import PersistentTree
+import Queue
+import threading
+
+
+class SnapshotNode(object):
+    """A node as it was when the snapshot was taken. Has the fields
+    dump_cache reads from a live node."""
+    __slots__ = ['snapshot', 'page_key', 'is_evicted', 'depth', 'rank',
+                 'expected_value']
+
+    def __init__(self, snapshot, page_key, is_evicted, depth, rank):
+        self.snapshot = snapshot
+        self.page_key = page_key
+        self.is_evicted = is_evicted
+        self.depth = depth
+        self.rank = rank
+        self.recompute_expected_value()
+
+    def recompute_expected_value(self):
+        tau = self.snapshot.tau
+        theta = self.snapshot.theta
+        value = tau[0] * theta[0] * (1.0 - theta[0])**self.depth
+        value += tau[1] * theta[1] * (1.0 - theta[1])**self.rank
+        self.expected_value = value
+
+
+class CacheSnapshot(object):
+    """Consistent read-only view of an MMCPolicy, safe to read from another
+    thread while the policy keeps serving requests.
+
+    Taking one is O(1): it keeps snapshots of the policy's 'persistent'
+    stack and ranker and of its evicted_pages tree, which holds the one
+    per-node field that can still change under a snapshot. Depths, ranks
+    and values are worked out from the frozen trees the first time
+    full_cache is read, which is meant to happen on the reader's side.
+    """
+    def __init__(self, policy):
+        self.num_requests = policy.num_requests
+        self.num_hits = policy.num_hits
+        self.tau = list(policy.tau)
+        self.theta = list(policy.theta)
+        self.stack = policy.stack.snapshot()
+        self.ranker = policy.ranker.snapshot()
+        self.evicted = policy.evicted_pages.snapshot()
+        self._full_cache = None
+
+    @property
+    def full_cache(self):
+        """page_key -> SnapshotNode for every page in the snapshot, in the
+        order of the policy's full_cache."""
+        if self._full_cache is None:
+            ranks = {}
+            for rank, node in enumerate(self.ranker.values()):
+                ranks[node] = rank
+            pages = []
+            for depth, node in enumerate(self.stack.values()):
+                page = node.page_key
+                pages.append((page, SnapshotNode(
+                        self, page, page in self.evicted, depth, ranks[node])))
+            pages.sort()
+            self._full_cache = PersistentTree.from_sorted_items(pages)
+        return self._full_cache
+
+
+class SnapshotDumper(threading.Thread):
+    """Runs dump_cache on the snapshots it is handed, off the request path.
+
+    submit() blocks once queue_size snapshots are waiting, so a dump that
+    cannot keep up slows the policy down instead of piling up memory.
+    """
+    def __init__(self, tag, queue_size=16):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.tag = tag
+        self.queue = Queue.Queue(queue_size)
+        self.dumps = 0
+
+    def submit(self, snapshot):
+        self.queue.put(snapshot)
+
+    def run(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                return
+            dump_cache(snapshot, self.tag)
+            self.dumps += 1
+
+    def close(self):
+        """Finish the dumps already submitted and stop."""
+        self.queue.put(None)
+        self.join()
@@ -37,8 +37,11 @@ import sys
 import time
 import bintrees
 import index_rbtree.rbtree
+from index_rbtree import STACK_INDEXES
 
 class LinkedNode(object):
+    __slots__ = ['value', 'prev_node', 'next_node', 'index_counter']
+
     def __init__(self, value, index_counter=None):
         self.value = value
         self.insert(None, None)
@@ -206,11 +209,11 @@ class LinkedList(object):
 
 
 class Cache(LinkedList):
-    def __init__(self):
+    def __init__(self, indexer_class=index_rbtree.rbtree.RBTree):
         LinkedList.__init__(self)
         self.lut = bintrees.FastRBTree()
         self.stack = LinkedList()
-        self.indexer = index_rbtree.rbtree.RBTree()
+        self.indexer = indexer_class()
         self.index_counter = 0
 
     def __len__(self):
@@ -244,7 +247,7 @@ class Cache(LinkedList):
     def index(self, value):
         try:
             node = self.lut[value]
-            return self.indexer.index(node.get_index_counter())
+            return self.indexer.finger_index(node.get_index_counter())
         except KeyError:
             return -1
 
@@ -395,11 +398,13 @@ class SDDTraceGrapher(PageoutPolicy, Grapher):
     """Finds the last time the page was requested and notes how long ago that
     was. This is not a real caching policy.
 
+    With stack_index='fenwick' the depths come from a FenwickIndex instead of
+    the rank-augmented red-black tree.
     """
-    def __init__(self, cache_size=None):
+    def __init__(self, cache_size=None, stack_index='rbtree'):
         PageoutPolicy.__init__(self, cache_size)
         Grapher.__init__(self)
-        self.cache = Cache()
+        self.cache = Cache(STACK_INDEXES[stack_index])
         self.num_requests = 0
 
     def request(self, val):
@@ -0,0 +1,19 @@
+from __future__ import absolute_import
+
+from .bplustree import BPlusTree
+from .fenwick import FenwickIndex
+from .persistent import PersistentTree
+from .rbtree import RBTree
+from .skiplist import SkipList
+
+# Indexes that can back MMCPolicy.stack. All answer stack.index(key) in
+# O(log N); the Fenwick index does it over flat arrays. The persistent tree
+# is the one with an O(1) snapshot(), which MMCPolicy.snapshot() needs.
+STACK_INDEXES = {'rbtree': RBTree, 'bplustree': BPlusTree,
+                 'fenwick': FenwickIndex, 'persistent': PersistentTree}
+
+# Indexes that can back MMCPolicy.ranker. All have index(key) and
+# rekey(old_key, new_key); the skiplist rekeys in place when the node keeps
+# its neighbours.
+RANKER_INDEXES = {'rbtree': RBTree, 'bplustree': BPlusTree,
+                  'skiplist': SkipList, 'persistent': PersistentTree}
@@ -11,11 +11,12 @@ from __future__ import absolute_import
 import sys
 PYPY = hasattr(sys, 'pypy_version_info')
 
+from .indexmixin import IndexMixin
 from .treeslice import TreeSlice
 from operator import attrgetter
 
 
-class _ABCTree(object):
+class _ABCTree(IndexMixin):
     """
     Abstract-Base-Class for ABCTree and Cython trees.
 
@@ -94,8 +95,10 @@ class _ABCTree(object):
     * keys([reverse]) -> generator for keys of T, O(n)
     * values([reverse]) -> generator for values of  T, O(n)
     * pop(k[,d]) -> v, remove specified key and return the corresponding value, O(log(n))
+    * rekey(k, k2) -> None, move the value of key k to key k2, O(log(n))
+    * index_many(S) -> NumPy array of the ranks of the sorted keys S
     * set_default(k[,d]) -> value, T.get(k, d), also set T[k]=d if k not in T, O(log(n))
-    * update(E) -> None.  Update T from dict/iterable E, O(E*log(n))
+    * update(E) -> None.  Update T from dict/iterable E, O(E*log(n)), O(E) if T is empty and E is sorted
 
     slicing by keys
 
@@ -157,6 +160,7 @@ class _ABCTree(object):
     Classmethods
 
     * from_keys(S[,v]) -> New tree with keys from S and values equal to v.
+    * from_sorted_items(S) -> New tree from (k, v) pairs sorted by key, O(n) if the tree supports bulk loading
 
     """
 
@@ -314,16 +318,44 @@ class _ABCTree(object):
     setdefault = set_default  # for compatibility to dict()
 
     def update(self, *args):
-        """T.update(E) -> None. Update T from E : for (k, v) in E: T[k] = v"""
+        """T.update(E) -> None. Update T from E : for (k, v) in E: T[k] = v
+
+        If T is empty and E is sorted by key, E is bulk loaded.
+        """
         for items in args:
             try:
                 generator = items.items()
             except AttributeError:
                 generator = iter(items)
 
+            if self.is_empty():
+                items = list(generator)
+                if _is_sorted(items):
+                    self._load_sorted(items)
+                    continue
+                generator = iter(items)
+
             for key, value in generator:
                 self.insert(key, value)
 
+    def _load_sorted(self, items):
+        """Fill the empty T from a list of (k, v) pairs sorted by key without
+        duplicates. Trees that can build themselves in O(n) override this."""
+        for key, value in items:
+            self.insert(key, value)
+
+    @classmethod
+    def from_sorted_items(cls, items):
+        """T.from_sorted_items(S) -> New tree from the (k, v) pairs of S, which
+        have to be sorted by key without duplicates, raises ValueError if not.
+        """
+        items = list(items)
+        if not _is_sorted(items):
+            raise ValueError("items are not sorted by key")
+        tree = cls()
+        tree._load_sorted(items)
+        return tree
+
     @classmethod
     def from_keys(cls, iterable, value=None):
         """T.from_keys(S[,v]) -> New tree with keys from S and values equal to v."""
@@ -356,6 +388,12 @@ class _ABCTree(object):
             else:
                 return args[0]
 
+    def rekey(self, old_key, new_key):
+        """T.rekey(k, k2) -> None, move the value of key k to key k2, raises
+        KeyError if k is not in T.
+        """
+        self.insert(new_key, self.pop(old_key))
+
     def prev_key(self, key):
         """Get predecessor to key, raises KeyError if key is min key
         or key does not exist.
@@ -477,6 +515,11 @@ class _ABCTree(object):
     isdisjoint = is_disjoint  # for compatibility to set()
 
 
+def _is_sorted(items):
+    return all(items[index][0] < items[index + 1][0]
+               for index in range(len(items) - 1))
+
+
 def _build_sets(trees):
     return [frozenset(tree.keys()) for tree in trees]
 
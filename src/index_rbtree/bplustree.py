@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+#coding:utf-8
+# Purpose: order-statistic B+-tree over preallocated node arrays
+# License: MIT License
+
+from __future__ import absolute_import
+
+import sys
+from bisect import bisect_left, bisect_right
+
+from .abctree import _ABCTree
+from .treeslice import RankSlice
+
+__all__ = ['BPlusTree']
+
+NO_NODE = -1
+
+
+class BPlusTree(_ABCTree):
+    """
+    BPlusTree implements a high-fanout B+-tree with a dict-like interface and
+    RBTree's index() and select().
+
+    Nodes are integer ids into parallel node arrays: _keys holds each node's
+    sorted key list, _items a leaf's values or an internal node's child ids,
+    and _counts an internal node's per-child subtree sizes (None for leaves).
+    Leaves are linked through _next and _prev. Freed ids go on a free list
+    and the arrays double when it runs dry, so a node costs a few small lists
+    instead of one Python object per key.
+
+    An internal node's keys are lower bounds of its children's keys; a key
+    goes to the last child whose bound is not above it. Nodes hold at most
+    order entries and, except for the root, at least max(2, order // 4).
+
+    BPlusTree() -> new empty tree.
+    BPlusTree(mapping) -> new tree initialized from a mapping
+    BPlusTree(seq) -> new tree initialized from seq [(k1, v1), (k2, v2), ... (kn, vn)]
+
+    see also abctree.ABCTree() class.
+    """
+    def __init__(self, items=None, order=64):
+        """T.__init__(...) initializes T; see T.__class__.__doc__ for signature"""
+        if order < 4:
+            raise ValueError("order has to be at least 4")
+        self._order = order
+        self._min_fill = max(2, order // 4)
+        self._keys = []
+        self._items = []
+        self._counts = []
+        self._next = []
+        self._prev = []
+        self._free = []
+        self._count = 0
+        self._root = self._new_node([], [], None)
+        if items is not None:
+            self.update(items)
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def _grow(self):
+        size = len(self._keys)
+        extra = max(16, size)
+        for pool in (self._keys, self._items, self._counts):
+            pool.extend([None] * extra)
+        for pool in (self._next, self._prev):
+            pool.extend([NO_NODE] * extra)
+        self._free.extend(range(size + extra - 1, size - 1, -1))
+
+    def _new_node(self, keys, items, counts):
+        if not self._free:
+            self._grow()
+        node = self._free.pop()
+        self._keys[node] = keys
+        self._items[node] = items
+        self._counts[node] = counts
+        self._next[node] = NO_NODE
+        self._prev[node] = NO_NODE
+        return node
+
+    def _free_node(self, node):
+        self._keys[node] = self._items[node] = self._counts[node] = None
+        self._free.append(node)
+
+    def clear(self):
+        """T.clear() -> None.  Remove all items from T."""
+        self.__init__(order=self._order)
+
+    @property
+    def count(self):
+        """Get items count."""
+        return self._count
+
+    def _descend(self, key):
+        """Return the path of (node, child index) pairs to key's leaf, and the
+        leaf."""
+        keys = self._keys
+        items = self._items
+        counts = self._counts
+        path = []
+        node = self._root
+        while counts[node] is not None:
+            index = bisect_right(keys[node], key) - 1
+            if index < 0:
+                index = 0
+            path.append((node, index))
+            node = items[node][index]
+        return path, node
+
+    def _leaf(self, key):
+        keys = self._keys
+        items = self._items
+        counts = self._counts
+        node = self._root
+        while counts[node] is not None:
+            index = bisect_right(keys[node], key) - 1
+            node = items[node][index if index > 0 else 0]
+        return node
+
+    def get_value(self, key):
+        leaf = self._leaf(key)
+        keys = self._keys[leaf]
+        index = bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+            raise KeyError(str(key))
+        return self._items[leaf][index]
+
+    def insert(self, key, value):
+        """T.insert(key, value) <==> T[key] = value, insert key, value into tree."""
+        path, leaf = self._descend(key)
+        keys = self._keys[leaf]
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            self._items[leaf][index] = value
+            return
+        keys.insert(index, key)
+        self._items[leaf].insert(index, value)
+        self._count += 1
+        for node, child in path:
+            self._counts[node][child] += 1
+            if child == 0 and key < self._keys[node][0]:
+                self._keys[node][0] = key
+        if len(keys) > self._order:
+            self._split(path, leaf)
+
+    def _split(self, path, node):
+        while len(self._keys[node]) > self._order:
+            keys = self._keys[node]
+            items = self._items[node]
+            counts = self._counts[node]
+            half = len(keys) // 2
+            if counts is None:
+                new = self._new_node(keys[half:], items[half:], None)
+                succ = self._next[node]
+                self._next[new] = succ
+                self._prev[new] = node
+                self._next[node] = new
+                if succ != NO_NODE:
+                    self._prev[succ] = new
+                new_count = len(keys) - half
+            else:
+                new = self._new_node(keys[half:], items[half:], counts[half:])
+                new_count = sum(counts[half:])
+                del counts[half:]
+            del keys[half:]
+            del items[half:]
+
+            if not path:
+                old_count = len(keys) if counts is None else sum(counts)
+                self._root = self._new_node(
+                        [keys[0], self._keys[new][0]], [node, new],
+                        [old_count, new_count])
+                return
+            parent, child = path.pop()
+            self._keys[parent].insert(child + 1, self._keys[new][0])
+            self._items[parent].insert(child + 1, new)
+            parent_counts = self._counts[parent]
+            parent_counts[child] -= new_count
+            parent_counts.insert(child + 1, new_count)
+            node = parent
+
+    def remove(self, key):
+        """T.remove(key) <==> del T[key], remove item <key> from tree."""
+        path, leaf = self._descend(key)
+        keys = self._keys[leaf]
+        index = bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+            raise KeyError(str(key))
+        del keys[index]
+        del self._items[leaf][index]
+        self._count -= 1
+        for node, child in path:
+            self._counts[node][child] -= 1
+        if len(keys) < self._min_fill:
+            self._rebalance(path, leaf)
+
+    def _rebalance(self, path, node):
+        """Merge or even out underfull nodes with a sibling, bottom up."""
+        pool_keys = self._keys
+        pool_items = self._items
+        pool_counts = self._counts
+        while path and len(pool_keys[node]) < self._min_fill:
+            parent, child = path.pop()
+            siblings = pool_items[parent]
+            if len(siblings) > 1:
+                left = child - 1 if child > 0 else 0
+                right = left + 1
+                a = siblings[left]
+                b = siblings[right]
+                parent_counts = pool_counts[parent]
+                is_leaf = pool_counts[a] is None
+                if len(pool_keys[a]) + len(pool_keys[b]) <= self._order:
+                    pool_keys[a].extend(pool_keys[b])
+                    pool_items[a].extend(pool_items[b])
+                    if is_leaf:
+                        succ = self._next[b]
+                        self._next[a] = succ
+                        if succ != NO_NODE:
+                            self._prev[succ] = a
+                    else:
+                        pool_counts[a].extend(pool_counts[b])
+                    parent_counts[left] += parent_counts[right]
+                    del parent_counts[right]
+                    del pool_keys[parent][right]
+                    del siblings[right]
+                    self._free_node(b)
+                else:
+                    keys = pool_keys[a] + pool_keys[b]
+                    items = pool_items[a] + pool_items[b]
+                    half = len(keys) // 2
+                    pool_keys[a] = keys[:half]
+                    pool_keys[b] = keys[half:]
+                    pool_items[a] = items[:half]
+                    pool_items[b] = items[half:]
+                    if is_leaf:
+                        parent_counts[left] = half
+                        parent_counts[right] = len(keys) - half
+                    else:
+                        counts = pool_counts[a] + pool_counts[b]
+                        pool_counts[a] = counts[:half]
+                        pool_counts[b] = counts[half:]
+                        parent_counts[left] = sum(pool_counts[a])
+                        parent_counts[right] = sum(pool_counts[b])
+                    pool_keys[parent][right] = pool_keys[b][0]
+            node = parent
+
+        root = self._root
+        while pool_counts[root] is not None and len(pool_items[root]) == 1:
+            child = pool_items[root][0]
+            self._free_node(root)
+            root = child
+        self._root = root
+
+    def _load_sorted(self, items):
+        """Build the tree bottom up from sorted items in O(n), with nodes
+        three quarters full."""
+        self.__init__(order=self._order)
+        self._free_node(self._root)
+        fill = max(self._min_fill, (3 * self._order) // 4)
+
+        def chunks(count):
+            parts = max(1, -(-count // fill))
+            return [(count * part // parts, count * (part + 1) // parts)
+                    for part in range(parts)]
+
+        keys = [key for key, _ in items]
+        values = [value for _, value in items]
+        level = []
+        sizes = []
+        prev = NO_NODE
+        for lo, hi in chunks(len(keys)):
+            node = self._new_node(keys[lo:hi], values[lo:hi], None)
+            self._prev[node] = prev
+            if prev != NO_NODE:
+                self._next[prev] = node
+            prev = node
+            level.append(node)
+            sizes.append(hi - lo)
+        while len(level) > 1:
+            upper = []
+            upper_sizes = []
+            for lo, hi in chunks(len(level)):
+                children = level[lo:hi]
+                counts = sizes[lo:hi]
+                upper.append(self._new_node(
+                        [self._keys[child][0] for child in children],
+                        children, counts))
+                upper_sizes.append(sum(counts))
+            level = upper
+            sizes = upper_sizes
+        self._root = level[0]
+        self._count = len(keys)
+
+    def _locate(self, key):
+        """Return the keys of key's leaf, key's bisect_left position in them
+        and the number of keys in the leaves before it."""
+        pool_keys = self._keys
+        pool_items = self._items
+        pool_counts = self._counts
+        node = self._root
+        rank = 0
+        while pool_counts[node] is not None:
+            child = bisect_right(pool_keys[node], key) - 1
+            if child > 0:
+                rank += sum(pool_counts[node][:child])
+            else:
+                child = 0
+            node = pool_items[node][child]
+        keys = pool_keys[node]
+        return keys, bisect_left(keys, key), rank
+
+    def index(self, key):
+        """T.index(k) -> number of keys smaller than k, raises KeyError if k
+        is not in T, O(log(n))."""
+        keys, index, rank = self._locate(key)
+        if index == len(keys) or keys[index] != key:
+            raise KeyError(str(key))
+        return rank + index
+
+    def bisect_left(self, key):
+        """T.bisect_left(k) -> number of keys smaller than k, which need not
+        be in T, O(log(n))."""
+        _, index, rank = self._locate(key)
+        return rank + index
+
+    def _select_position(self, rank):
+        if rank < 0:
+            rank += self._count
+        if not 0 <= rank < self._count:
+            raise IndexError("rank out of range")
+        node = self._root
+        pool_counts = self._counts
+        while pool_counts[node] is not None:
+            for child, count in enumerate(pool_counts[node]):
+                if rank < count:
+                    break
+                rank -= count
+            node = self._items[node][child]
+        return node, rank
+
+    def select(self, rank):
+        """T.select(k) -> (key, value) with k smaller keys in T, O(log(n)).
+        Negative k counts from the end, raises IndexError if k is out of
+        range."""
+        leaf, index = self._select_position(rank)
+        return self._keys[leaf][index], self._items[leaf][index]
+
+    def _iter_from(self, leaf, index, reverse):
+        """Iterate over the items from position index of leaf on."""
+        step = -1 if reverse else 1
+        links = self._prev if reverse else self._next
+        while leaf != NO_NODE:
+            keys = self._keys[leaf]
+            values = self._items[leaf]
+            while 0 <= index < len(keys):
+                yield keys[index], values[index]
+                index += step
+            leaf = links[leaf]
+            if leaf != NO_NODE and reverse:
+                index = len(self._keys[leaf]) - 1
+            else:
+                index = 0
+
+    def iter_rank_items(self, start, stop, reverse=False):
+        """Iterate over the items with ranks start <= k < stop."""
+        if start >= stop:
+            return
+        leaf, index = self._select_position(stop - 1 if reverse else start)
+        remaining = stop - start
+        for item in self._iter_from(leaf, index, reverse):
+            yield item
+            remaining -= 1
+            if not remaining:
+                return
+
+    @property
+    def by_rank(self):
+        """T.by_rank[i:j] -> RankSlice of the items with ranks i <= k < j."""
+        return RankSlice(self)
+
+    def _edge_leaf(self, last):
+        node = self._root
+        while self._counts[node] is not None:
+            node = self._items[node][-1 if last else 0]
+        return node
+
+    def iter_items(self, start_key=None, end_key=None, reverse=False):
+        """Iterates over the (key, value) items of the associated tree,
+        in ascending order if reverse is True, iterate in descending order,
+        reverse defaults to False"""
+        if reverse:
+            if end_key is None:
+                leaf = self._edge_leaf(True)
+                index = len(self._keys[leaf]) - 1
+            else:
+                leaf = self._leaf(end_key)
+                index = bisect_left(self._keys[leaf], end_key) - 1
+            for key, value in self._iter_from(leaf, index, True):
+                if start_key is not None and key < start_key:
+                    return
+                yield key, value
+        else:
+            if start_key is None:
+                leaf = self._edge_leaf(False)
+                index = 0
+            else:
+                leaf = self._leaf(start_key)
+                index = bisect_left(self._keys[leaf], start_key)
+            for key, value in self._iter_from(leaf, index, False):
+                if end_key is not None and not key < end_key:
+                    return
+                yield key, value
+
+    def foreach(self, func, order=0):
+        """Visit all items in key order and call func(key, value); order is
+        accepted for compatibility, leaves hold every item."""
+        for key, value in self.iter_items():
+            func(key, value)
+
+    def pop_item(self):
+        """T.pop_item() -> (k, v), remove and return some (key, value) pair as a
+        2-tuple; but raise KeyError if T is empty.
+        """
+        if self.is_empty():
+            raise KeyError("pop_item(): tree is empty")
+        item = self.max_item()
+        self.remove(item[0])
+        return item
+    popitem = pop_item  # for compatibility  to dict()
+
+    def min_item(self):
+        """Get item with min key of tree, raises ValueError if tree is empty."""
+        if self.is_empty():
+            raise ValueError("Tree is empty")
+        leaf = self._edge_leaf(False)
+        return self._keys[leaf][0], self._items[leaf][0]
+
+    def max_item(self):
+        """Get item with max key of tree, raises ValueError if tree is empty."""
+        if self.is_empty():
+            raise ValueError("Tree is empty")
+        leaf = self._edge_leaf(True)
+        return self._keys[leaf][-1], self._items[leaf][-1]
+
+    def _neighbour(self, key, reverse, inclusive):
+        """The first item from key on in the given direction, skipping key
+        itself unless inclusive; raises KeyError if there is none."""
+        leaf = self._leaf(key)
+        keys = self._keys[leaf]
+        index = bisect_left(keys, key)
+        found = index < len(keys) and keys[index] == key
+        if reverse:
+            index = index if inclusive and found else index - 1
+        elif found and not inclusive:
+            index += 1
+        for item in self._iter_from(leaf, index, reverse):
+            return item
+        raise KeyError(str(key))
+
+    def succ_item(self, key):
+        """Get successor (k,v) pair of key, raises KeyError if key is max key
+        or key does not exist."""
+        if key not in self:
+            raise KeyError(str(key))
+        return self._neighbour(key, False, False)
+
+    def prev_item(self, key):
+        """Get predecessor (k,v) pair of key, raises KeyError if key is min key
+        or key does not exist."""
+        if key not in self:
+            raise KeyError(str(key))
+        return self._neighbour(key, True, False)
+
+    def floor_item(self, key):
+        """Get the element (k,v) pair associated with the greatest key less
+        than or equal to the given key, raises KeyError if there is no such
+        key."""
+        return self._neighbour(key, True, True)
+
+    def ceiling_item(self, key):
+        """Get the element (k,v) pair associated with the smallest key greater
+        than or equal to the given key, raises KeyError if there is no such
+        key."""
+        return self._neighbour(key, False, True)
+
+    def metadata_bytes(self):
+        size = sys.getsizeof(self) + sys.getsizeof(self._free)
+        for pool in (self._keys, self._items, self._counts, self._next,
+                     self._prev):
+            size += sys.getsizeof(pool)
+        for node in range(len(self._keys)):
+            for pool in (self._keys, self._items, self._counts):
+                if pool[node] is not None:
+                    size += sys.getsizeof(pool[node])
+        return size
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#coding:utf-8
+# Purpose: recency index over a Fenwick (binary indexed) tree
+# License: MIT License
+
+from __future__ import absolute_import
+
+import sys
+from array import array
+
+from .indexmixin import IndexMixin
+from .treeslice import RankSlice
+
+__all__ = ['FenwickIndex']
+
+_EMPTY = object()
+
+
+class FenwickIndex(IndexMixin):
+    """Mapping for keys that arrive newest first, with O(log N) index().
+
+    Each key inserted has to be smaller than every key inserted before it,
+    like the decreasing generation counters MMCPolicy and Cache use for their
+    LRU stacks, so ascending key order is most recent first. Keys are given
+    the next slot of flat arrays in arrival order and a Fenwick tree counts
+    the live slots, so index(key), the number of keys still present that
+    arrived after key, is a prefix sum. When the slots run out the live ones
+    are packed to the front, and the arrays are doubled if more than half of
+    them are live.
+    """
+    def __init__(self, items=None, capacity=64):
+        self._capacity = capacity
+        self._tree = array('l', [0]) * (capacity + 1)
+        self._slot_keys = [_EMPTY] * capacity
+        self._slot_values = [None] * capacity
+        self._slots = {}
+        self._next = 0
+        self._newest = None
+        if items is not None:
+            self.update(items)
+
+    def __repr__(self):
+        return "%s({%s})" % (self.__class__.__name__, ", ".join(
+                "%r: %r" % item for item in self.items()))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, key):
+        return self._slot_values[self._slots[key]]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._slot_values[slot] = value
+            return
+        if self._newest is not None and not key < self._newest:
+            raise ValueError("keys have to arrive newest (smallest) first")
+        if self._next == self._capacity:
+            self._compact()
+        slot = self._next
+        self._next += 1
+        self._newest = key
+        self._slots[key] = slot
+        self._slot_keys[slot] = key
+        self._slot_values[slot] = value
+        self._add(slot, 1)
+
+    insert = __setitem__
+
+    def __delitem__(self, key):
+        slot = self._slots.pop(key)
+        self._slot_keys[slot] = _EMPTY
+        self._slot_values[slot] = None
+        self._add(slot, -1)
+
+    def discard(self, key):
+        if key in self._slots:
+            del self[key]
+
+    def pop(self, key, *args):
+        try:
+            value = self[key]
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        del self[key]
+        return value
+
+    def clear(self):
+        self.__init__(capacity=self._capacity)
+
+    def update(self, *args):
+        for items in args:
+            try:
+                items = items.items()
+            except AttributeError:
+                pass
+            for key, value in items:
+                self[key] = value
+
+    def index(self, key):
+        """Return how many keys present are smaller (newer) than key."""
+        slot = self._slots[key]
+        return len(self._slots) - self._prefix(slot + 1)
+
+    def _select_slot(self, rank):
+        """Return the live slot with rank newer live slots, by descending the
+        Fenwick tree to the first prefix holding len - rank live slots."""
+        count = len(self._slots)
+        if rank < 0:
+            rank += count
+        if not 0 <= rank < count:
+            raise IndexError("rank out of range")
+        tree = self._tree
+        remaining = count - rank
+        slot = 0
+        step = 1 << (self._capacity.bit_length() - 1)
+        while step:
+            if slot + step <= self._capacity and tree[slot + step] < remaining:
+                slot += step
+                remaining -= tree[slot]
+            step >>= 1
+        return slot
+
+    def select(self, rank):
+        """Return the (key, value) item with rank smaller keys. Negative
+        ranks count from the end, raises IndexError if out of range."""
+        slot = self._select_slot(rank)
+        return self._slot_keys[slot], self._slot_values[slot]
+
+    def iter_rank_items(self, start, stop, reverse=False):
+        """Iterate over the items with ranks start <= k < stop."""
+        if start >= stop:
+            return
+        slot_keys = self._slot_keys
+        slot = self._select_slot(stop - 1 if reverse else start)
+        step = 1 if reverse else -1
+        remaining = stop - start
+        while remaining:
+            if slot_keys[slot] is not _EMPTY:
+                yield slot_keys[slot], self._slot_values[slot]
+                remaining -= 1
+            slot += step
+
+    @property
+    def by_rank(self):
+        return RankSlice(self)
+
+    def _prefix(self, count):
+        """Number of live slots among the first count."""
+        tree = self._tree
+        total = 0
+        while count > 0:
+            total += tree[count]
+            count &= count - 1
+        return total
+
+    def _add(self, slot, delta):
+        tree = self._tree
+        capacity = self._capacity
+        i = slot + 1
+        while i <= capacity:
+            tree[i] += delta
+            i += i & -i
+
+    def _compact(self):
+        slot_keys = self._slot_keys
+        live = [slot for slot in range(self._next)
+                if slot_keys[slot] is not _EMPTY]
+        count = len(live)
+        if 2 * count > self._capacity:
+            self._capacity *= 2
+        capacity = self._capacity
+        keys = [_EMPTY] * capacity
+        values = [None] * capacity
+        for new, old in enumerate(live):
+            key = slot_keys[old]
+            keys[new] = key
+            values[new] = self._slot_values[old]
+            self._slots[key] = new
+        self._slot_keys = keys
+        self._slot_values = values
+        self._next = count
+
+        # Linear-time build: every slot below count holds a 1.
+        tree = array('l', [0]) * (capacity + 1)
+        for i in range(1, capacity + 1):
+            if i <= count:
+                tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _live_slots(self, reverse):
+        slot_keys = self._slot_keys
+        if reverse:
+            slots = range(self._next)
+        else:
+            slots = range(self._next - 1, -1, -1)
+        for slot in slots:
+            if slot_keys[slot] is not _EMPTY:
+                yield slot
+
+    def keys(self, reverse=False):
+        for slot in self._live_slots(reverse):
+            yield self._slot_keys[slot]
+
+    def values(self, reverse=False):
+        for slot in self._live_slots(reverse):
+            yield self._slot_values[slot]
+
+    def items(self, reverse=False):
+        for slot in self._live_slots(reverse):
+            yield self._slot_keys[slot], self._slot_values[slot]
+
+    def min_key(self):
+        for key in self.keys():
+            return key
+        raise ValueError("Tree is empty")
+
+    def max_key(self):
+        for key in self.keys(reverse=True):
+            return key
+        raise ValueError("Tree is empty")
+
+    def metadata_bytes(self):
+        return (sys.getsizeof(self) + sys.getsizeof(self._tree) +
+                sys.getsizeof(self._slot_keys) +
+                sys.getsizeof(self._slot_values) +
+                sys.getsizeof(self._slots))
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+#coding:utf-8
+# Purpose: generic rank lookups shared by the order-statistic indexes
+# License: MIT License
+
+from __future__ import absolute_import
+
+import numpy as np
+
+__all__ = ['IndexMixin']
+
+
+class IndexMixin(object):
+    """index_many() and finger_index() in terms of index(). Indexes that can
+    resolve a batch in one traversal, or search up from their min key,
+    override them."""
+
+    def index_many(self, keys):
+        """T.index_many(S) -> NumPy array of T.index(k) for the keys k of S,
+        which have to be sorted."""
+        return np.array([self.index(key) for key in keys], dtype=np.intp)
+
+    def finger_index(self, key, limit=None):
+        """T.finger_index(k[, limit]) -> T.index(k), or limit if that is
+        smaller."""
+        rank = self.index(key)
+        if limit is not None and rank > limit:
+            return limit
+        return rank
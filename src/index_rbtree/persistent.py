@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+#coding:utf-8
+# Purpose: persistent order-statistic tree with O(1) snapshots
+# License: MIT License
+
+from __future__ import absolute_import
+
+import sys
+
+from .indexmixin import IndexMixin
+from .treeslice import RankSlice
+
+__all__ = ['PersistentTree']
+
+# Nodes are immutable (key, value, left, right, size) tuples.
+KEY, VALUE, LEFT, RIGHT, SIZE = range(5)
+
+# Weight balance parameters of Adams' trees, as corrected by Straka: a
+# subtree may hold at most DELTA times as many nodes as its sibling, and a
+# double rotation is used when the inner grandchild holds at least GAMMA
+# times fewer than the outer one.
+DELTA = 3
+GAMMA = 2
+
+
+def _size(node):
+    return 0 if node is None else node[SIZE]
+
+
+def _node(key, value, left, right):
+    return (key, value, left, right, _size(left) + _size(right) + 1)
+
+
+def _balance(key, value, left, right):
+    size_left = _size(left)
+    size_right = _size(right)
+    if size_left + size_right <= 1:
+        pass
+    elif size_right > DELTA * size_left:
+        r_key, r_value, r_left, r_right, _ = right
+        if _size(r_left) < GAMMA * _size(r_right):
+            return _node(r_key, r_value, _node(key, value, left, r_left),
+                         r_right)
+        return _node(r_left[KEY], r_left[VALUE],
+                     _node(key, value, left, r_left[LEFT]),
+                     _node(r_key, r_value, r_left[RIGHT], r_right))
+    elif size_left > DELTA * size_right:
+        l_key, l_value, l_left, l_right, _ = left
+        if _size(l_right) < GAMMA * _size(l_left):
+            return _node(l_key, l_value, l_left,
+                         _node(key, value, l_right, right))
+        return _node(l_right[KEY], l_right[VALUE],
+                     _node(l_key, l_value, l_left, l_right[LEFT]),
+                     _node(key, value, l_right[RIGHT], right))
+    return (key, value, left, right, size_left + size_right + 1)
+
+
+def _insert(node, key, value):
+    if node is None:
+        return (key, value, None, None, 1)
+    node_key, node_value, left, right, size = node
+    if key < node_key:
+        return _balance(node_key, node_value, _insert(left, key, value),
+                        right)
+    if node_key < key:
+        return _balance(node_key, node_value, left,
+                        _insert(right, key, value))
+    return (key, value, left, right, size)
+
+
+def _pop_min(node):
+    """Return the smallest node of a non-empty tree and the tree without
+    it."""
+    key, value, left, right, _ = node
+    if left is None:
+        return node, right
+    smallest, left = _pop_min(left)
+    return smallest, _balance(key, value, left, right)
+
+
+def _remove(node, key):
+    if node is None:
+        raise KeyError(str(key))
+    node_key, node_value, left, right, _ = node
+    if key < node_key:
+        return _balance(node_key, node_value, _remove(left, key), right)
+    if node_key < key:
+        return _balance(node_key, node_value, left, _remove(right, key))
+    if left is None:
+        return right
+    if right is None:
+        return left
+    smallest, right = _pop_min(right)
+    return _balance(smallest[KEY], smallest[VALUE], left, right)
+
+
+def _build(items, start, stop):
+    if start >= stop:
+        return None
+    middle = (start + stop) // 2
+    key, value = items[middle]
+    return _node(key, value, _build(items, start, middle),
+                 _build(items, middle + 1, stop))
+
+
+class PersistentTree(IndexMixin):
+    """Sorted mapping with O(log n) index(key) whose snapshot() costs O(1).
+
+    The nodes are immutable tuples and every update copies the path from the
+    root down to the changed node, so a snapshot only has to keep the old
+    root. It shares all untouched subtrees with the tree and stays valid and
+    unchanged however the tree is updated afterwards, which makes it safe to
+    hand to another thread. Balance is kept by subtree weights, which are
+    also the counts that index() and select() need.
+
+    Snapshots are read-only; updating one raises TypeError.
+    """
+    def __init__(self, items=None):
+        self._root = None
+        self._frozen = False
+        if items is not None:
+            self.update(items)
+
+    def __repr__(self):
+        return "%s({%s})" % (self.__class__.__name__, ", ".join(
+                "%r: %r" % item for item in self.items()))
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        return self.keys()
+
+    def _find(self, key):
+        node = self._root
+        while node is not None:
+            node_key = node[KEY]
+            if key < node_key:
+                node = node[LEFT]
+            elif node_key < key:
+                node = node[RIGHT]
+            else:
+                return node
+        return None
+
+    def __getitem__(self, key):
+        node = self._find(key)
+        if node is None:
+            raise KeyError(str(key))
+        return node[VALUE]
+
+    def get(self, key, default=None):
+        node = self._find(key)
+        if node is None:
+            return default
+        return node[VALUE]
+
+    def snapshot(self):
+        """Return a read-only copy of the tree as it is now, in O(1)."""
+        tree = self.__class__()
+        tree._root = self._root
+        tree._frozen = True
+        return tree
+
+    def _check_writable(self):
+        if self._frozen:
+            raise TypeError("snapshot is read-only")
+
+    def __setitem__(self, key, value):
+        self._check_writable()
+        self._root = _insert(self._root, key, value)
+
+    insert = __setitem__
+
+    def __delitem__(self, key):
+        self._check_writable()
+        self._root = _remove(self._root, key)
+
+    remove = __delitem__
+
+    def discard(self, key):
+        if key in self:
+            del self[key]
+
+    def pop(self, key, *args):
+        node = self._find(key)
+        if node is None:
+            if args:
+                return args[0]
+            raise KeyError(str(key))
+        del self[key]
+        return node[VALUE]
+
+    def rekey(self, old_key, new_key):
+        """Move the value of old_key to new_key, raises KeyError if old_key is
+        not present."""
+        if new_key != old_key and new_key in self:
+            raise ValueError("rekey target %r is already present" % (new_key,))
+        value = self.pop(old_key)
+        self[new_key] = value
+
+    @classmethod
+    def from_sorted_items(cls, items):
+        """New tree from (key, value) pairs sorted by key without duplicates,
+        raises ValueError if not. Builds a perfectly balanced tree in O(n)."""
+        items = list(items)
+        for i in range(1, len(items)):
+            if not items[i - 1][0] < items[i][0]:
+                raise ValueError("items are not sorted by key")
+        tree = cls()
+        tree._root = _build(items, 0, len(items))
+        return tree
+
+    def clear(self):
+        self._check_writable()
+        self._root = None
+
+    def update(self, *args):
+        for items in args:
+            try:
+                items = items.items()
+            except AttributeError:
+                pass
+            for key, value in items:
+                self[key] = value
+
+    def index(self, key):
+        """Return the number of keys smaller than key, raises KeyError if key
+        is not present."""
+        node = self._root
+        position = 0
+        while node is not None:
+            node_key = node[KEY]
+            if key < node_key:
+                node = node[LEFT]
+            else:
+                left = node[LEFT]
+                if node_key < key:
+                    position += _size(left) + 1
+                    node = node[RIGHT]
+                else:
+                    return position + _size(left)
+        raise KeyError(str(key))
+
+    def bisect_left(self, key):
+        """Return the number of keys smaller than key, which need not be
+        present."""
+        node = self._root
+        position = 0
+        while node is not None:
+            if node[KEY] < key:
+                position += _size(node[LEFT]) + 1
+                node = node[RIGHT]
+            else:
+                node = node[LEFT]
+        return position
+
+    def select(self, rank):
+        """Return the (key, value) item with rank smaller keys. Negative
+        ranks count from the end, raises IndexError if out of range."""
+        node = self._root
+        if rank < 0:
+            rank += _size(node)
+        if not 0 <= rank < _size(node):
+            raise IndexError("rank out of range")
+        while True:
+            size_left = _size(node[LEFT])
+            if rank < size_left:
+                node = node[LEFT]
+            elif rank > size_left:
+                rank -= size_left + 1
+                node = node[RIGHT]
+            else:
+                return node[KEY], node[VALUE]
+
+    def iter_rank_items(self, start, stop, reverse=False):
+        """Iterate over the items with ranks start <= k < stop."""
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        if start >= stop:
+            return
+        if reverse:
+            near, far = RIGHT, LEFT
+            skip = len(self) - stop
+        else:
+            near, far = LEFT, RIGHT
+            skip = start
+        # Descend to the first node of the range, stacking the nodes that
+        # still follow it in iteration order.
+        parents = []
+        node = self._root
+        while node is not None:
+            size_near = _size(node[near])
+            if skip < size_near:
+                parents.append(node)
+                node = node[near]
+            else:
+                skip -= size_near + 1
+                if skip < 0:
+                    parents.append(node)
+                    break
+                node = node[far]
+        for _ in range(stop - start):
+            node = parents.pop()
+            yield node[KEY], node[VALUE]
+            node = node[far]
+            while node is not None:
+                parents.append(node)
+                node = node[near]
+
+    @property
+    def by_rank(self):
+        return RankSlice(self)
+
+    def items(self, reverse=False):
+        return self.iter_rank_items(0, len(self), reverse)
+
+    def keys(self, reverse=False):
+        return (key for key, _ in self.items(reverse))
+
+    def values(self, reverse=False):
+        return (value for _, value in self.items(reverse))
+
+    def min_key(self):
+        if self._root is None:
+            raise ValueError("Tree is empty")
+        return self.select(0)[0]
+
+    def max_key(self):
+        if self._root is None:
+            raise ValueError("Tree is empty")
+        return self.select(-1)[0]
+
+    def metadata_bytes(self):
+        """Bytes held by the nodes reachable from this tree, counting nodes
+        shared with snapshots in full."""
+        size = sys.getsizeof(self)
+        parents = [self._root] if self._root is not None else []
+        while parents:
+            node = parents.pop()
+            size += sys.getsizeof(node)
+            if node[LEFT] is not None:
+                parents.append(node[LEFT])
+            if node[RIGHT] is not None:
+                parents.append(node[RIGHT])
+        return size
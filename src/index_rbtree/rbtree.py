@@ -34,12 +34,19 @@
 
 from __future__ import absolute_import
 
+from bisect import bisect_left
+
+import numpy as np
+
 from .abctree import ABCTree
+from .treeslice import RankSlice
 
 __all__ = ['RBTree']
 
 class Node(object):
     """Internal object, represents a tree node."""
+    __slots__ = ['key', 'value', 'red', '_parent', '_left', '_right',
+                 'number_left', 'number_right']
 
     def __init__(self, key=None, value=None):
         self.key = key
@@ -269,11 +276,47 @@ class RBTree(ABCTree):
 
     see also abctree.ABCTree() class.
     """
+    # The node with the smallest key, or None until it is looked up again.
+    _min_node = None
+
     def _new_node(self, key, value):
         """Create a new tree node."""
         self._count += 1
         return Node(key, value)
 
+    def _load_sorted(self, items):
+        """Build a balanced tree from sorted items in O(n).
+
+        Splitting at the middle item leaves every missing child at depth h or
+        h + 1, where h = floor(log2(n + 1)). Coloring only the nodes at depth
+        h red gives every path h black nodes.
+        """
+        count = len(items)
+        red_depth = (count + 1).bit_length() - 1
+
+        def build(lo, hi, depth, parent):
+            if lo >= hi:
+                return None
+            mid = (lo + hi) // 2
+            key, value = items[mid]
+            node = Node(key, value)
+            node.red = depth == red_depth
+            node._parent = parent
+            node._left = build(lo, mid, depth + 1, node)
+            node._right = build(mid + 1, hi, depth + 1, node)
+            node.number_left = mid - lo
+            node.number_right = hi - mid - 1
+            return node
+
+        self._root = build(0, count, 0, None)
+        self._count = count
+        self._min_node = None
+
+    def clear(self):
+        """T.clear() -> None.  Remove all items from T."""
+        ABCTree.clear(self)
+        self._min_node = None
+
     def index(self, key):
         node = self._root
         count = 0
@@ -287,11 +330,168 @@ class RBTree(ABCTree):
                 node = node.right
         raise KeyError(str(key))
 
+    def bisect_left(self, key):
+        """T.bisect_left(k) -> number of keys in T smaller than k, which need
+        not be in T."""
+        node = self._root
+        count = 0
+        while node is not None:
+            if node.key < key:
+                count += 1 + node.number_left
+                node = node._right
+            else:
+                node = node._left
+        return count
+
+    def rekey(self, old_key, new_key):
+        """T.rekey(k, k2) -> None, move the value of key k to key k2, raises
+        KeyError if k is not in T. When no other key lies between k and k2
+        the node keeps its place and only its key changes, which skips the
+        rebalancing of a remove and an insert."""
+        node = self._root
+        prev_node = succ_node = None
+        while node is not None:
+            if old_key == node.key:
+                break
+            elif old_key < node.key:
+                succ_node = node
+                node = node._left
+            else:
+                prev_node = node
+                node = node._right
+        if node is None:
+            raise KeyError(str(old_key))
+        if node._left is not None:
+            prev_node = node._left
+            while prev_node._right is not None:
+                prev_node = prev_node._right
+        if node._right is not None:
+            succ_node = node._right
+            while succ_node._left is not None:
+                succ_node = succ_node._left
+        if ((prev_node is None or prev_node.key < new_key) and
+                (succ_node is None or new_key < succ_node.key)):
+            node.key = new_key
+        else:
+            ABCTree.rekey(self, old_key, new_key)
+
+    def index_many(self, keys):
+        """T.index_many(S) -> NumPy array of T.index(k) for the keys k of S,
+        which have to be sorted, in one merged traversal of T. Each subtree is
+        entered once for all the keys that fall in it, so m keys cost
+        O(m log(n / m) + m) instead of O(m log(n)). Raises KeyError if a key
+        is not in T."""
+        keys = list(keys)
+        ranks = np.empty(len(keys), dtype=np.intp)
+
+        def visit(node, lo, hi, base):
+            while lo < hi:
+                if node is None:
+                    raise KeyError(str(keys[lo]))
+                split = bisect_left(keys, node.key, lo, hi)
+                visit(node._left, lo, split, base)
+                base += node.number_left
+                while split < hi and keys[split] == node.key:
+                    ranks[split] = base
+                    split += 1
+                base += 1
+                node, lo = node._right, split
+
+        visit(self._root, 0, len(keys), 0)
+        return ranks
+
+    def finger_index(self, key, limit=None):
+        """T.finger_index(k[, limit]) -> T.index(k) in O(log(d)), where d is
+        the rank of k. The search climbs from the min node instead of
+        descending from the root. If the rank is at least limit, returns limit
+        without checking that k is in T."""
+        if self._root is None:
+            raise KeyError(str(key))
+        node = self._min_node
+        if node is None:
+            node = self._root
+            while node._left is not None:
+                node = node._left
+            self._min_node = node
+        # Every node on the left spine has rank number_left. Climb while key
+        # is not below the parent; key is then in the subtree of node.
+        root = self._root
+        while node is not root and not key < node._parent.key:
+            node = node._parent
+            if limit is not None and node.number_left >= limit:
+                return limit
+        count = 0
+        while node is not None:
+            if key == node.key:
+                count += node.number_left
+                break
+            elif key < node.key:
+                node = node._left
+            else:
+                count += 1 + node.number_left
+                if limit is not None and count >= limit:
+                    return limit
+                node = node._right
+        else:
+            raise KeyError(str(key))
+        if limit is not None and count > limit:
+            return limit
+        return count
+
+    def _select_node(self, rank):
+        if rank < 0:
+            rank += self._count
+        if not 0 <= rank < self._count:
+            raise IndexError("rank out of range")
+        node = self._root
+        while rank != node.number_left:
+            if rank < node.number_left:
+                node = node._left
+            else:
+                rank -= node.number_left + 1
+                node = node._right
+        return node
+
+    def select(self, rank):
+        """T.select(k) -> (key, value) with k smaller keys in T, O(log(n)).
+        Negative k counts from the end, raises IndexError if k is out of
+        range."""
+        node = self._select_node(rank)
+        return node.key, node.value
+
+    def iter_rank_items(self, start, stop, reverse=False):
+        """Iterate over the items with ranks start <= k < stop, O(log(n)) to
+        find the first one and then O(1) amortized per item."""
+        if start >= stop:
+            return
+        # Step to the in-order successor (or predecessor) through the parent
+        # links, which the tree keeps for its subtree counts.
+        near, far = ('_right', '_left') if reverse else ('_left', '_right')
+        node = self._select_node(stop - 1 if reverse else start)
+        for _ in range(stop - start):
+            yield node.key, node.value
+            child = getattr(node, far)
+            if child is not None:
+                node = child
+                while getattr(node, near) is not None:
+                    node = getattr(node, near)
+            else:
+                while node._parent is not None and \
+                        getattr(node._parent, far) is node:
+                    node = node._parent
+                node = node._parent
+
+    @property
+    def by_rank(self):
+        """T.by_rank[i:j] -> RankSlice of the items with ranks i <= k < j."""
+        return RankSlice(self)
+
     def insert(self, key, value):
         """T.insert(key, value) <==> T[key] = value, insert key, value into tree."""
         if self._root is None:  # Empty tree case
             self._root = self._new_node(key, value)
             self._root.red = False  # make root black
+            self._min_node = self._root
             return
 
         head = Node()  # False tree root
@@ -300,6 +500,7 @@ class RBTree(ABCTree):
         parent = None  # parent
         direction = 0
         last = 0
+        created = None
 
         # Set up helpers
         grand_grand_parent.right = self._root
@@ -308,6 +509,7 @@ class RBTree(ABCTree):
         while True:
             if node is None:  # Insert new node at the bottom
                 node = self._new_node(key, value)
+                created = node
                 parent[direction] = node
             elif Node.is_red(node.left) and Node.is_red(node.right):  # Color flip
                 node.red = True
@@ -340,6 +542,9 @@ class RBTree(ABCTree):
 
         self._root = head.right  # Update root
         self._root.red = False  # make root black
+        min_node = self._min_node
+        if created is not None and min_node is not None and key < min_node.key:
+            self._min_node = created
 
     def remove(self, key):
         """T.remove(key) <==> del T[key], remove item <key> from tree."""
@@ -401,6 +606,8 @@ class RBTree(ABCTree):
             found.key = node.key
             found.value = node.value
             parent[int(parent.right is node)] = node[int(node.left is None)]
+            if node is self._min_node:
+                self._min_node = None
             node.free()
             self._count -= 1
 
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+#coding:utf-8
+# Purpose: indexable skiplist with in-place rekey
+# License: MIT License
+
+from __future__ import absolute_import
+
+import sys
+from random import Random
+
+from .indexmixin import IndexMixin
+from .treeslice import RankSlice
+
+__all__ = ['SkipList']
+
+MAX_LEVELS = 32
+
+
+class Node(object):
+    """Skiplist node. width[level] is the number of positions from this node
+    to next[level]; prev links level 0 backwards."""
+    __slots__ = ['key', 'value', 'next', 'width', 'prev']
+
+    def __init__(self, key, value, height):
+        self.key = key
+        self.value = value
+        self.next = [None] * height
+        self.width = [1] * height
+        self.prev = None
+
+
+class SkipList(IndexMixin):
+    """Sorted mapping with O(log n) index(key) and rekey(old_key, new_key).
+
+    Offers the part of the RBTree interface that MMCPolicy.ranker uses. A
+    dict finds the node of a key in O(1), so rekey() only has to search the
+    list when the new key does not fit between the node's neighbours; the
+    node is then unlinked and relinked at its new position, keeping its
+    height.
+    """
+    def __init__(self, items=None, seed=0):
+        self._head = Node(None, None, MAX_LEVELS)
+        self._levels = 1
+        self._nodes = {}
+        self._random = Random(seed)
+        if items is not None:
+            self.update(items)
+
+    def __repr__(self):
+        return "%s({%s})" % (self.__class__.__name__, ", ".join(
+                "%r: %r" % item for item in self.items()))
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, key):
+        return key in self._nodes
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, key):
+        return self._nodes[key].value
+
+    def get(self, key, default=None):
+        node = self._nodes.get(key)
+        if node is None:
+            return default
+        return node.value
+
+    def _height(self):
+        height = 1
+        while height < MAX_LEVELS and self._random.random() < 0.5:
+            height += 1
+        return height
+
+    def _path(self, key):
+        """Return the last node before key on every level, and its position
+        counting the head as 0."""
+        chain = [None] * self._levels
+        positions = [0] * self._levels
+        node = self._head
+        position = 0
+        for level in range(self._levels - 1, -1, -1):
+            succ = node.next[level]
+            while succ is not None and succ.key < key:
+                position += node.width[level]
+                node = succ
+                succ = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def _link(self, node):
+        height = len(node.next)
+        if height > self._levels:
+            self._levels = height
+        chain, positions = self._path(node.key)
+        position = positions[0] + 1
+        for level in range(self._levels):
+            prev = chain[level]
+            if level < height:
+                node.next[level] = prev.next[level]
+                node.width[level] = (prev.width[level] + positions[level] -
+                                     positions[0])
+                prev.next[level] = node
+                prev.width[level] = position - positions[level]
+            else:
+                prev.width[level] += 1
+        succ = node.next[0]
+        node.prev = chain[0]
+        if succ is not None:
+            succ.prev = node
+
+    def _unlink(self, node):
+        chain, _ = self._path(node.key)
+        height = len(node.next)
+        for level in range(self._levels):
+            prev = chain[level]
+            if level < height:
+                prev.width[level] += node.width[level] - 1
+                prev.next[level] = node.next[level]
+            else:
+                prev.width[level] -= 1
+        succ = node.next[0]
+        if succ is not None:
+            succ.prev = node.prev
+
+    def __setitem__(self, key, value):
+        node = self._nodes.get(key)
+        if node is not None:
+            node.value = value
+            return
+        node = Node(key, value, self._height())
+        self._nodes[key] = node
+        self._link(node)
+
+    insert = __setitem__
+
+    def __delitem__(self, key):
+        self._unlink(self._nodes.pop(key))
+
+    remove = __delitem__
+
+    def discard(self, key):
+        node = self._nodes.pop(key, None)
+        if node is not None:
+            self._unlink(node)
+
+    def pop(self, key, *args):
+        node = self._nodes.get(key)
+        if node is None:
+            if args:
+                return args[0]
+            raise KeyError(str(key))
+        del self[key]
+        return node.value
+
+    def rekey(self, old_key, new_key):
+        """Move the value of old_key to new_key, raises KeyError if old_key is
+        not present."""
+        if new_key in self._nodes and new_key != old_key:
+            raise ValueError("rekey target %r is already present" % (new_key,))
+        node = self._nodes.pop(old_key)
+        prev = node.prev
+        succ = node.next[0]
+        if ((prev is self._head or prev.key < new_key) and
+                (succ is None or new_key < succ.key)):
+            node.key = new_key
+        else:
+            self._unlink(node)
+            node.key = new_key
+            self._link(node)
+        self._nodes[new_key] = node
+
+    @classmethod
+    def from_sorted_items(cls, items):
+        """New skiplist from (key, value) pairs sorted by key without
+        duplicates, raises ValueError if not. Appends in O(n)."""
+        tree = cls()
+        last = [tree._head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS
+        prev = tree._head
+        for position, (key, value) in enumerate(items, 1):
+            if prev is not tree._head and not prev.key < key:
+                raise ValueError("items are not sorted by key")
+            node = Node(key, value, tree._height())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+            tree._levels = max(tree._levels, len(node.next))
+            node.prev = prev
+            prev = node
+            tree._nodes[key] = node
+        return tree
+
+    def clear(self):
+        self.__init__()
+
+    def update(self, *args):
+        for items in args:
+            try:
+                items = items.items()
+            except AttributeError:
+                pass
+            for key, value in items:
+                self[key] = value
+
+    def index(self, key):
+        """Return the number of keys smaller than key, raises KeyError if key
+        is not present.
+
+        The search starts at the highest level whose first node is still
+        below key, so a key d positions from the front costs O(log d).
+        """
+        if key not in self._nodes:
+            raise KeyError(str(key))
+        head = self._head
+        top = 0
+        while (top + 1 < self._levels and head.next[top + 1] is not None and
+               head.next[top + 1].key < key):
+            top += 1
+        node = head
+        position = 0
+        for level in range(top, -1, -1):
+            succ = node.next[level]
+            while succ is not None and succ.key < key:
+                position += node.width[level]
+                node = succ
+                succ = node.next[level]
+        return position
+
+    def bisect_left(self, key):
+        """Return the number of keys smaller than key, which need not be
+        present."""
+        _, positions = self._path(key)
+        return positions[0]
+
+    def _select_node(self, rank):
+        if rank < 0:
+            rank += len(self._nodes)
+        if not 0 <= rank < len(self._nodes):
+            raise IndexError("rank out of range")
+        node = self._head
+        position = 0
+        target = rank + 1
+        for level in range(self._levels - 1, -1, -1):
+            while (node.next[level] is not None and
+                   position + node.width[level] <= target):
+                position += node.width[level]
+                node = node.next[level]
+        return node
+
+    def select(self, rank):
+        """Return the (key, value) item with rank smaller keys. Negative
+        ranks count from the end, raises IndexError if out of range."""
+        node = self._select_node(rank)
+        return node.key, node.value
+
+    def iter_rank_items(self, start, stop, reverse=False):
+        """Iterate over the items with ranks start <= k < stop."""
+        if start >= stop:
+            return
+        node = self._select_node(stop - 1 if reverse else start)
+        for _ in range(stop - start):
+            yield node.key, node.value
+            node = node.prev if reverse else node.next[0]
+
+    @property
+    def by_rank(self):
+        return RankSlice(self)
+
+    def _iter_nodes(self, reverse):
+        if reverse:
+            if not self._nodes:
+                return
+            node = self._head
+            for level in range(self._levels - 1, -1, -1):
+                while node.next[level] is not None:
+                    node = node.next[level]
+            while node is not self._head:
+                yield node
+                node = node.prev
+        else:
+            node = self._head.next[0]
+            while node is not None:
+                yield node
+                node = node.next[0]
+
+    def keys(self, reverse=False):
+        return (node.key for node in self._iter_nodes(reverse))
+
+    def values(self, reverse=False):
+        return (node.value for node in self._iter_nodes(reverse))
+
+    def items(self, reverse=False):
+        return ((node.key, node.value) for node in self._iter_nodes(reverse))
+
+    def min_key(self):
+        for key in self.keys():
+            return key
+        raise ValueError("Tree is empty")
+
+    def max_key(self):
+        for key in self.keys(reverse=True):
+            return key
+        raise ValueError("Tree is empty")
+
+    def metadata_bytes(self):
+        size = sys.getsizeof(self) + sys.getsizeof(self._nodes)
+        for node in self._iter_nodes(False):
+            size += (sys.getsizeof(node) + sys.getsizeof(node.next) +
+                     sys.getsizeof(node.width))
+        return size
@@ -68,3 +68,53 @@ class TreeSlice(object):
 
     def items(self):
         return self._tree.iter_items(self._start, self._stop)
+
+
+class RankSlice(object):
+    """Items of a tree whose ranks fall in range(start, stop), see
+    T.by_rank[i:j]. Bounds follow list slicing and are resolved against the
+    tree's current size."""
+    __slots__ = ['_tree', '_start', '_stop']
+
+    def __init__(self, tree, start=None, stop=None):
+        self._tree = tree
+        self._start = start
+        self._stop = stop
+
+    def __repr__(self):
+        tpl = "%s({%s})" % (self._tree.__class__.__name__, '%s')
+        return tpl % ", ".join( ("%r: %r" % item for item in self.items()) )
+
+    def _range(self):
+        start, stop, _ = slice(self._start, self._stop).indices(
+                len(self._tree))
+        return start, max(start, stop)
+
+    def __len__(self):
+        start, stop = self._range()
+        return stop - start
+
+    def __getitem__(self, index):
+        start, stop = self._range()
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("rank slices do not support steps")
+            sub_start, sub_stop, _ = index.indices(stop - start)
+            return RankSlice(self._tree, start + sub_start,
+                             start + max(sub_start, sub_stop))
+        if index < 0:
+            index += stop - start
+        if not 0 <= index < stop - start:
+            raise IndexError("rank out of range")
+        return self._tree.select(start + index)
+
+    def items(self, reverse=False):
+        start, stop = self._range()
+        return self._tree.iter_rank_items(start, stop, reverse)
+
+    def keys(self, reverse=False):
+        return (item[0] for item in self.items(reverse))
+    __iter__ = keys
+
+    def values(self, reverse=False):
+        return (item[1] for item in self.items(reverse))
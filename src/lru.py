@@ -25,11 +25,12 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 
-import csv
 import collections
+from metadata import container_bytes
+from telemetry import BufferedCSVSink
 
 class LRUPolicy(object):
-    def __init__(self, cache_size_limit, csv_suffix=".csv"):
+    def __init__(self, cache_size_limit, csv_suffix=".csv", telemetry=None):
         self.cache_size_limit = cache_size_limit
         self.cache = collections.deque()
         self.hits = 0.0
@@ -37,13 +38,25 @@ class LRUPolicy(object):
         self.ts_order = ['row', 'hit']
         self.ts_datapoint = {key: None for key in self.ts_order}
         self.ts_datapoint['row'] = 0
-        self.ts_file = open("csv/lru" + csv_suffix, "w")
-        self.ts_writer = csv.writer(self.ts_file)
-        self.ts_writer.writerow(self.ts_order)
+        if telemetry is None:
+            telemetry = BufferedCSVSink()
+        self.telemetry = telemetry
+        self.ts_writer = self.telemetry.open("lru" + csv_suffix, self.ts_order)
+
+    def close(self):
+        """Close the policy's time series, flushing what is buffered."""
+        self.ts_writer.close()
 
     def hit_rate(self):
         return self.hits / self.requests
 
+    def metadata_bytes(self):
+        return {
+                'entries': container_bytes(self.cache),
+                'ghosts': 0,
+                'trace': 0,
+                'indexes': 0}
+
     def request(self, page):
         self.requests += 1
         if page in self.cache:
@@ -56,14 +69,14 @@ class LRUPolicy(object):
 
         self.ts_datapoint['row'] += 1
 
-        if was_hit:
-            self.ts_datapoint['hit'] = 1
-        else:
-            self.ts_datapoint['hit'] = 0
+        if self.ts_writer.offer_row():
+            if was_hit:
+                self.ts_datapoint['hit'] = 1
+            else:
+                self.ts_datapoint['hit'] = 0
 
-        self.ts_writer.writerow(
-                [self.ts_datapoint[key] for key in self.ts_order])
-        self.ts_file.flush()
+            self.ts_writer.writerow(
+                    [self.ts_datapoint[key] for key in self.ts_order])
 
         if len(self.cache) > self.cache_size_limit:
             self.cache.pop()
@@ -0,0 +1,85 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import sys
+
+# sizeof(node_t) in the bintrees C extension: two links, a key, a value and
+# an int of extra data.
+CTREE_NODE_BYTES = 40
+
+
+def value_bytes(value):
+    """Bytes of the boxed floats, tuples, lists and dicts a node holds on to.
+
+    Ints, bools and None are left out since they are usually shared."""
+    if isinstance(value, float):
+        return sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(value_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+                value_bytes(v) for v in value.values())
+    return 0
+
+
+def object_bytes(obj):
+    """Bytes of obj, its instance dict if it has one and the values in its
+    slots, read straight from the slot descriptors so that properties which
+    shadow a slot are not counted."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += value_bytes(obj.__dict__)
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            try:
+                size += value_bytes(cls.__dict__[name].__get__(obj, cls))
+            except AttributeError:
+                pass
+    return size
+
+
+def container_bytes(container):
+    """Bytes of a deque, list, set or dict and the objects it holds, or the
+    keys for a dict."""
+    return sys.getsizeof(container) + sum(
+            object_bytes(item) for item in container)
+
+
+def tree_node_bytes(tree):
+    """Bytes of one node of a bintrees style tree."""
+    try:
+        return sys.getsizeof(tree._root)
+    except AttributeError:
+        return CTREE_NODE_BYTES
+
+
+def tree_bytes(tree):
+    """Bytes of a bintrees style tree and its nodes, not counting the keys or
+    values."""
+    if hasattr(tree, 'metadata_bytes'):
+        return tree.metadata_bytes()
+    return sys.getsizeof(tree) + len(tree) * tree_node_bytes(tree)
@@ -25,14 +25,16 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 
-import csv
 import collections
 import sys
 import time
 from bintrees import FastRBTree
+from metadata import container_bytes, tree_bytes
+from telemetry import BufferedCSVSink
 
 class MINPolicy(object):
-    def __init__(self, cache_size_limit, trace, csv_suffix=".csv"):
+    def __init__(self, cache_size_limit, trace, csv_suffix=".csv",
+                 telemetry=None):
         self.cache_size_limit = cache_size_limit
         self.cache = {}
         self.hits = 0.0
@@ -40,9 +42,10 @@ class MINPolicy(object):
         self.ts_order = ['row', 'hit']
         self.ts_datapoint = {key: None for key in self.ts_order}
         self.ts_datapoint['row'] = 0
-        self.ts_file = open("csv/min" + csv_suffix, "w")
-        self.ts_writer = csv.writer(self.ts_file)
-        self.ts_writer.writerow(self.ts_order)
+        if telemetry is None:
+            telemetry = BufferedCSVSink()
+        self.telemetry = telemetry
+        self.ts_writer = self.telemetry.open("min" + csv_suffix, self.ts_order)
 
         self.clairvoyance = FastRBTree()
 
@@ -68,9 +71,25 @@ class MINPolicy(object):
         print
         print 'Done loading.'
 
+    def close(self):
+        """Close the policy's time series, flushing what is buffered."""
+        self.ts_writer.close()
+
     def hit_rate(self):
         return self.hits / self.requests
 
+    def metadata_bytes(self):
+        """The trace is the table of future request times that MIN is
+        allowed to look at."""
+        future = tree_bytes(self.precog)
+        for times in self.precog.values():
+            future += sys.getsizeof(times)
+        return {
+                'entries': container_bytes(self.cache),
+                'ghosts': 0,
+                'trace': future,
+                'indexes': tree_bytes(self.clairvoyance)}
+
     def request(self, page):
         self.requests += 1
         if page in self.cache:
@@ -86,14 +105,14 @@ class MINPolicy(object):
         self.clairvoyance[self.cache[page]] = page
         self.ts_datapoint['row'] += 1
 
-        if was_hit:
-            self.ts_datapoint['hit'] = 1
-        else:
-            self.ts_datapoint['hit'] = 0
+        if self.ts_writer.offer_row():
+            if was_hit:
+                self.ts_datapoint['hit'] = 1
+            else:
+                self.ts_datapoint['hit'] = 0
 
-        self.ts_writer.writerow(
-                [self.ts_datapoint[key] for key in self.ts_order])
-        self.ts_file.flush()
+            self.ts_writer.writerow(
+                    [self.ts_datapoint[key] for key in self.ts_order])
 
         if len(self.cache) > self.cache_size_limit:
             next_use, page = self.clairvoyance.pop_max()
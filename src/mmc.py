@@ -26,15 +26,26 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 from bintrees import FastRBTree
-from index_rbtree.rbtree import RBTree
+from index_rbtree import RANKER_INDEXES, STACK_INDEXES
+from index_rbtree.persistent import PersistentTree
 from pprint import pprint
 import numpy as np
-import collections
-import csv
+import heapq
+from operator import itemgetter
+import sys
 import time
+from cache_snapshot import CacheSnapshot, SnapshotDumper
 from dump_full_cache_to_csv import dump_cache
+from metadata import object_bytes, tree_bytes, tree_node_bytes
+from ring_trace import RingTrace, HIT_FLAG
+from telemetry import BufferedCSVSink
+from trace_columns import TraceColumns, sequential_sum
 
 class Node(object):
+    __slots__ = ['cache', 'page_key', 'is_evicted', 'is_purged',
+                 '_expected_value', '_hit_count', 'stack_key', 'ranker_key',
+                 'trace_slot', 'rank_purge_memo', 'depth_memo']
+
     def __init__(self, cache):
         self.cache = cache
         self.page_key = None
@@ -44,6 +55,7 @@ class Node(object):
         self._hit_count = 0.0
         self.stack_key = None
         self.ranker_key = None
+        self.trace_slot = None
 
     @property
     def expected_value(self):
@@ -63,7 +75,7 @@ class Node(object):
     @property
     def depth(self):
         try:
-            return self.cache.stack.index(self.stack_key)
+            return self.cache.stack.finger_index(self.stack_key)
         except KeyError:
             return 1.0 / self.cache.theta[0]
 
@@ -73,9 +85,10 @@ class Node(object):
         self.cache.stack[self.stack_key] = self
 
     def rerank(self):
-        self.cache.ranker.discard(self.ranker_key)
-        self.ranker_key = self.new_ranker_key()
-        self.cache.ranker[self.ranker_key] = self
+        """Give the node a new ranker key. The key goes into the cache's
+        rerank journal; apply_reranks() moves the node in the ranker."""
+        self.cache.rerank_journal[self] = self.new_ranker_key()
+        self.cache.num_reranks += 1
 
     @property
     def hit_count(self):
@@ -100,13 +113,19 @@ class Node(object):
 
     @property
     def rank(self):
+        journal = self.cache.rerank_journal
+        if journal:
+            key = journal.get(self, self.ranker_key)
+            if key is not None:
+                return self.cache.journal_rank(key)
         try:
-            return self.cache.ranker.index(self.ranker_key)
+            return self.cache.ranker.finger_index(self.ranker_key)
         except KeyError:
             return 1.0 / self.cache.theta[1]
 
     def purge(self):
         self.rank_purge_memo = self.rank
+        self.cache.rerank_journal.pop(self, None)
         self.cache.stack.discard(self.stack_key)
         self.stack_key = None
         self.cache.ranker.discard(self.ranker_key)
@@ -115,26 +134,15 @@ class Node(object):
         del self.cache.full_cache[self.page_key]
 
 
-class Record(object):
-    def __init__(self, cache, node):
-        self.cache = cache
-        self.node = node
-        self.depth = node.depth
-        self.rank_memo = node.rank
-        self._Z = self.cache.calculate_Z(self.depth, node.rank)
-        self.was_hit = cache.was_hit
-
-    @property
-    def Z(self):
-        return self._Z
-
-    @Z.setter
-    def Z(self, new_Z):
-        self._Z = new_Z
-
 class MMCPolicy(object):
+    node_class = Node
+
     def __init__(self, cache_entries_limit, ghost_entries_limit,
-                 trace_size_limit, csv_suffix="_mmc.csv", draw_dump=False):
+                 trace_size_limit, csv_suffix="_mmc.csv", draw_dump=False,
+                 pageout_mode='scan', low_watermark=1.0,
+                 estimator='batch', online_refresh=4, telemetry=None,
+                 stack_index='rbtree', ranker_index='rbtree',
+                 dump_in_background=False):
         self.full_cache = FastRBTree()
         self.was_hit = None
         self.was_ghost_hit = None
@@ -143,9 +151,24 @@ class MMCPolicy(object):
         self.cache_entries_limit = cache_entries_limit
         self.ghost_entries_limit = ghost_entries_limit
         self.trace_size_limit = trace_size_limit
-        self.trace = collections.deque()
-        self.stack = RBTree()
-        self.ranker = RBTree()
+        self.trace = RingTrace(trace_size_limit + 1)
+        self.stack = STACK_INDEXES[stack_index]()
+        self.ranker = RANKER_INDEXES[ranker_index]()
+        # page_key -> True for the evicted pages, kept so that snapshot() can
+        # freeze the evicted flags along with the stack and ranker. Only
+        # kept when both indexes can be snapshotted.
+        self.evicted_pages = None
+        if (hasattr(self.stack, 'snapshot') and
+                hasattr(self.ranker, 'snapshot')):
+            self.evicted_pages = PersistentTree()
+        # Node -> the ranker key it has been given but not moved to yet.
+        # A request changes a node's hit count up to three times; the ranker
+        # is only updated once, by apply_reranks().
+        self.rerank_journal = {}
+        # Reranks asked for, and the ranker moves apply_reranks() made for
+        # them.
+        self.num_reranks = 0
+        self.num_rekeys = 0
         self.generation = 0
         # During startup, this will act like an LRU.
         self.startup = True
@@ -155,34 +178,65 @@ class MMCPolicy(object):
         self.theta = [0.5, 0.5]
         self.acc_tau = [0.0]
         self.acc_theta = [0.0, 0.0]
+        # With estimator='online', the batch EM only runs once to get out of
+        # startup. After that, each request re-estimates the Z of
+        # online_refresh records, sweeping the trace from oldest to newest.
+        # Each record is counted in acc_tau and acc_theta with the rank held
+        # in the trace's rank column, so it can be taken out exactly.
+        self.estimator = estimator
+        self.online_refresh = online_refresh
+        self.online_cursor = 0
         self.num_in_cache = 0
         self.num_in_full_cache = 0
         self.csv_suffix = csv_suffix
         self.draw_dump = draw_dump
-
+        # With dump_in_background, draw_dump hands a snapshot of the cache to
+        # a SnapshotDumper thread instead of writing the dump inline.
+        self.dumper = None
+        if draw_dump and dump_in_background:
+            if self.evicted_pages is None:
+                raise ValueError("dump_in_background needs the 'persistent' "
+                                 "stack and ranker indexes")
+            self.dumper = SnapshotDumper(csv_suffix)
+            self.dumper.start()
+        # Selects the <mode>_victims search used by pageout: 'scan' or
+        # 'frontier'. Both pick the same victims; they differ in how many
+        # nodes they have to look at. The frontier walk looks at fewer nodes
+        # when the victims sit at both deep ends, but pays a rank or depth
+        # lookup for each, so on most workloads the scan is faster.
+        self.pageout_mode = pageout_mode
+        self.pageout_examined = 0
+        # The entry limits act as high watermarks. Once one is crossed,
+        # pageout frees entries in a single pass until the count is back down
+        # to low_watermark times the limit.
+        self.low_watermark = low_watermark
+        self.cache_low_watermark = int(cache_entries_limit * low_watermark)
+        self.full_cache_low_watermark = int(
+                (cache_entries_limit + ghost_entries_limit) * low_watermark)
+
+        if telemetry is None:
+            telemetry = BufferedCSVSink()
+        self.telemetry = telemetry
         self.ts_order = [
                 'row', 'hit', 'ghost_hit', 'tau',
                 'theta0', 'theta1', 'Z', 'depth', 'rank']
         self.ts_datapoint = {key: None for key in self.ts_order}
         self.ts_datapoint['row'] = 0
-        self.ts_file = open("csv/mmc" + self.csv_suffix, "w")
-        self.ts_writer = csv.writer(self.ts_file)
-        self.ts_writer.writerow(self.ts_order)
+        self.ts_writer = self.telemetry.open(
+                "mmc" + self.csv_suffix, self.ts_order)
 
         self.evict_order = [
-                'row', 'depth', 'rank', 'value', 'Z', 'tau']
+                'row', 'depth', 'rank', 'value', 'Z', 'tau', 'examined']
         self.evict_datapoint = {key: None for key in self.evict_order}
         self.evict_datapoint['row'] = 0
-        self.evict_file = open("csv/mmc_evict" + self.csv_suffix, "w")
-        self.evict_writer = csv.writer(self.evict_file)
-        self.evict_writer.writerow(self.evict_order)
+        self.evict_writer = self.telemetry.open(
+                "mmc_evict" + self.csv_suffix, self.evict_order)
 
-        self.purge_order = ['row', 'depth', 'rank', 'value', 'Z']
+        self.purge_order = ['row', 'depth', 'rank', 'value', 'Z', 'examined']
         self.purge_datapoint = {key: None for key in self.purge_order}
         self.purge_datapoint['row'] = 0
-        self.purge_file = open("csv/mmc_purge" + self.csv_suffix, "w")
-        self.purge_writer = csv.writer(self.purge_file)
-        self.purge_writer.writerow(self.purge_order)
+        self.purge_writer = self.telemetry.open(
+                "mmc_purge" + self.csv_suffix, self.purge_order)
 
     def request(self, page):
         self.num_requests += 1
@@ -194,10 +248,12 @@ class MMCPolicy(object):
             if not node.is_evicted:
                 self.num_hits += 1
                 self.was_hit = True
-            node.hit_count += 1.0 - self.calculate_Z(node.depth, node.rank)
+            hit_count_increment = 1.0 - self.calculate_Z(node.depth, node.rank)
+            node.hit_count += hit_count_increment
         else:
-            node = Node(self)
-            node.hit_count = self.tau[1]
+            node = self.node_class(self)
+            hit_count_increment = self.tau[1]
+            node.hit_count = hit_count_increment
             node.page_key = page
             self.full_cache[page] = node
 
@@ -206,25 +262,53 @@ class MMCPolicy(object):
         if not self.was_ghost_hit:
             self.num_in_full_cache += 1
 
+        if node.is_evicted and self.evicted_pages is not None:
+            self.evicted_pages.remove(page)
         node.is_evicted = node.is_purged = False
-        record = Record(self, node)
-        self.add_trace_record(record)
-
+        depth = node.depth
+        rank = node.rank
+        row = self.trace.append(
+                node, depth, rank, self.calculate_Z(depth, rank),
+                HIT_FLAG if self.was_hit else 0)
+        self.add_trace_record(row)
+
+        online = self.estimator == 'online' and not self.startup
+        Z = self.trace.get_Z(row)
+        if online and hit_count_increment != 1.0 - Z:
+            # Without a batch E step to rebuild them, hit counts have to stay
+            # equal to the sum of 1 - Z over each node's records.
+            node.hit_count += (1.0 - Z) - hit_count_increment
         if len(self.trace) > self.trace_size_limit:
-            popped_record = self.trace.popleft()
-            self.update_tau_and_theta_accs(record, increment=True)
-            self.update_tau_and_theta_accs(popped_record, increment=False)
+            popped_row = self.trace.popleft()
+            if online and self.online_cursor:
+                self.online_cursor -= 1
+            self.update_tau_and_theta_accs(
+                    row, increment=True, rank=self.counted_rank(row, online))
+            self.update_tau_and_theta_accs(
+                    popped_row, increment=False,
+                    rank=self.counted_rank(popped_row, online))
+            self.refresh_params()
+            self.trace.node(popped_row).hit_count -= (
+                    1.0 - self.trace.get_Z(popped_row))
+        elif online:
+            self.update_tau_and_theta_accs(
+                    row, increment=True, rank=self.counted_rank(row, online))
             self.refresh_params()
-            popped_record.node.hit_count -= 1.0 - popped_record.Z
 
         node.restack()
         node.rerank()
+        self.apply_reranks()
 
-        self.countdown_to_EM -= 1
-        if self.countdown_to_EM == 0:
-            self.EM_algorithm(delta=0.00001)
-            self.countdown_to_EM = self.EM_period
-            self.startup = False
+        if online:
+            self.online_EM_step(self.online_refresh)
+        else:
+            self.countdown_to_EM -= 1
+            if self.countdown_to_EM == 0:
+                self.EM_algorithm(delta=0.00001)
+                self.countdown_to_EM = self.EM_period
+                self.startup = False
+                if self.estimator == 'online':
+                    self.count_trace()
 
         if (
           self.num_in_cache > self.cache_entries_limit or
@@ -233,9 +317,56 @@ class MMCPolicy(object):
         ):
             self.pageout()
         if self.draw_dump:
-            dump_cache(self, self.csv_suffix)
-
-    def add_trace_record(self, record):
+            if self.dumper is not None:
+                self.dumper.submit(self.snapshot())
+            else:
+                dump_cache(self, self.csv_suffix)
+
+    def apply_reranks(self):
+        """Move every node in the rerank journal to its new ranker key."""
+        ranker = self.ranker
+        for node, new_key in self.rerank_journal.iteritems():
+            if node.ranker_key is None:
+                ranker[new_key] = node
+            else:
+                ranker.rekey(node.ranker_key, new_key)
+            node.ranker_key = new_key
+        self.num_rekeys += len(self.rerank_journal)
+        self.rerank_journal.clear()
+
+    def journal_rank(self, key):
+        """Rank of key in the ranker as it will be once the journal is
+        applied. Costs O(log |K| + len(rerank_journal))."""
+        rank = self.ranker.bisect_left(key)
+        for node, new_key in self.rerank_journal.iteritems():
+            old_key = node.ranker_key
+            if old_key is not None and old_key < key:
+                rank -= 1
+            if new_key < key:
+                rank += 1
+        return rank
+
+    def snapshot(self):
+        """Return a read-only CacheSnapshot of the cache as it is now, in
+        O(1). Raises TypeError unless the stack and ranker are 'persistent'
+        indexes."""
+        if self.evicted_pages is None:
+            raise TypeError("snapshots need the 'persistent' stack and "
+                            "ranker indexes")
+        return CacheSnapshot(self)
+
+    def close(self):
+        """Finish the background dumps and close the policy's time series,
+        flushing what is buffered."""
+        if self.dumper is not None:
+            self.dumper.close()
+            self.dumper = None
+        for writer in (self.ts_writer, self.evict_writer, self.purge_writer):
+            writer.close()
+
+    def add_trace_record(self, row):
+        if not self.ts_writer.offer_row():
+            return
         self.ts_datapoint['row'] = self.num_requests
         if self.was_hit:
             self.ts_datapoint['hit'] = 1
@@ -250,16 +381,60 @@ class MMCPolicy(object):
         self.ts_datapoint['tau'] = self.tau[0]
         self.ts_datapoint['theta0'] = self.theta[0]
         self.ts_datapoint['theta1'] = self.theta[1]
-        depth = record.depth
-        self.ts_datapoint['depth'] = depth
-        self.ts_datapoint['rank'] = record.node.rank
-        self.ts_datapoint['Z'] = record.Z
+        self.ts_datapoint['depth'] = float(self.trace.depth[row])
+        self.ts_datapoint['rank'] = self.trace.node(row).rank
+        self.ts_datapoint['Z'] = self.trace.get_Z(row)
         self.ts_writer.writerow(
                 [self.ts_datapoint[key] for key in self.ts_order])
-        self.ts_file.flush()
-        self.trace.append(record)
+
+    def pageout_counts(self):
+        """Return how many nodes pageout has to evict and purge."""
+        num_evict = 0
+        num_purge = 0
+        if self.num_in_cache > self.cache_entries_limit:
+            num_evict = self.num_in_cache - self.cache_low_watermark
+        if (
+          self.num_in_full_cache >
+          self.cache_entries_limit + self.ghost_entries_limit
+        ):
+            num_purge = self.num_in_full_cache - self.full_cache_low_watermark
+        return num_evict, num_purge
 
     def pageout(self):
+        num_evict, num_purge = self.pageout_counts()
+        if num_evict <= 1 and num_purge <= 1:
+            min_node, min_ghost = getattr(
+                    self, self.pageout_mode + '_victims')()
+            evict_nodes = [min_node][:num_evict]
+            purge_nodes = [min_ghost][:num_purge]
+        else:
+            evict_nodes, purge_nodes = self.batch_victims(num_evict, num_purge)
+
+        for node in evict_nodes:
+            self.evict(node)
+        for node in purge_nodes:
+            self.purge(node)
+
+    def batch_victims(self, num_evict, num_purge):
+        """Score every node once and return the num_evict lowest-valued
+        resident nodes and the num_purge lowest-valued nodes overall."""
+        for depth, node in enumerate(self.stack.values()):
+            node.depth_memo = depth
+
+        scored = []
+        for rank, node in enumerate(self.ranker.values()):
+            node.recompute_expected_value(depth=node.depth_memo, rank=rank)
+            scored.append((node.expected_value, rank, node))
+        self.pageout_examined = len(scored)
+
+        residents = [item for item in scored if not item[2].is_evicted]
+        evict_nodes = [item[2] for item in heapq.nsmallest(num_evict, residents)]
+        purge_nodes = [item[2] for item in heapq.nsmallest(num_purge, scored)]
+        return evict_nodes, purge_nodes
+
+    def scan_victims(self):
+        """Score every node and return (min_node, min_ghost). This is O(|K|)
+        and is kept as the reference for the other searches."""
         min_node = None
         min_node_value = None
         min_ghost = None
@@ -268,6 +443,7 @@ class MMCPolicy(object):
         for depth, node in enumerate(self.stack.values()):
             node.depth_memo = depth
 
+        self.pageout_examined = len(self.ranker)
         for rank, node in enumerate(self.ranker.values()):
             node.recompute_expected_value(depth=node.depth_memo, rank=rank)
             value = node.expected_value
@@ -279,16 +455,122 @@ class MMCPolicy(object):
                 min_ghost = node
                 min_ghost_value = value
 
-        if self.num_in_cache > self.cache_entries_limit:
-            self.evict(min_node)
-
-        if (
-          self.num_in_full_cache >
-          self.cache_entries_limit + self.ghost_entries_limit
-        ):
-            self.purge(min_ghost)
-
-    def EM_algorithm(self, delta):
+        return min_node, min_ghost
+
+    def frontier_victims(self):
+        """Return (min_node, min_ghost) by walking the deep end of the stack
+        and the low-frequency end of the ranker in lockstep.
+
+        Both terms of the expected value fall as depth and rank grow, so the
+        minimum lies on the Pareto frontier of nodes that are not beaten on
+        both depth and rank by some other node. A node that neither walk has
+        reached yet sits above both cursors, which bounds its value from
+        below; the search stops once that bound exceeds the best resident
+        candidate. A node reached by one walk is skipped without a lookup when
+        a node already seen by that walk dominates every position the node
+        could still occupy in the other tree.
+
+        self.pageout_examined is set to the number of nodes whose depth or
+        rank had to be looked up.
+        """
+        tau = self.tau
+        theta = self.theta
+        if not (0.0 <= theta[0] <= 1.0 and 0.0 <= theta[1] <= 1.0 and
+                tau[0] >= 0.0 and tau[1] >= 0.0):
+            return self.scan_victims()
+        # Domination only implies a strictly larger value when both terms are
+        # strictly decreasing; otherwise a dominated node could win a tie.
+        strict = (0.0 < theta[0] < 1.0 and 0.0 < theta[1] < 1.0 and
+                  tau[0] > 0.0 and tau[1] > 0.0)
+
+        size = len(self.stack)
+        stack_walk = self.stack.values(reverse=True)
+        ranker_walk = self.ranker.values(reverse=True)
+        # The next depth and rank that each walk will visit.
+        stack_cursor = size - 1
+        ranker_cursor = size - 1
+        # Known (depth, rank) of every node either walk has passed.
+        seen = {}
+        # Largest rank (or depth) among the nodes each walk has passed,
+        # tracked separately for resident nodes and for all nodes.
+        stack_max_rank = [-1, -1]
+        ranker_max_depth = [-1, -1]
+
+        best = [None, None]
+        best_value = [None, None]
+        best_rank = [None, None]
+        self.pageout_examined = 0
+
+        def consider(node, depth, rank):
+            node.recompute_expected_value(depth=depth, rank=rank)
+            value = node.expected_value
+            for i in (0, 1):
+                if i == 0 and node.is_evicted:
+                    continue
+                if (best[i] is None or value < best_value[i] or
+                    (value == best_value[i] and rank < best_rank[i])):
+                    best[i] = node
+                    best_value[i] = value
+                    best_rank[i] = rank
+
+        while stack_cursor >= 0 and ranker_cursor >= 0:
+            if best[0] is not None:
+                bound = tau[0] * theta[0] * (1.0 - theta[0])**stack_cursor
+                bound += tau[1] * theta[1] * (1.0 - theta[1])**ranker_cursor
+                if bound > best_value[0]:
+                    break
+
+            node = next(stack_walk)
+            depth = stack_cursor
+            stack_cursor -= 1
+            resident = int(not node.is_evicted)
+            if node in seen:
+                rank = seen[node][1]
+            elif strict and stack_max_rank[1 - resident] > ranker_cursor:
+                # Every node with a higher rank has been seen by the ranker
+                # walk, so this node's rank is at most ranker_cursor and a
+                # deeper node beats it on both counts.
+                rank = None
+                seen[node] = (depth, None)
+            else:
+                rank = node.rank
+                self.pageout_examined += 1
+                seen[node] = (depth, rank)
+                consider(node, depth, rank)
+            if rank is not None:
+                stack_max_rank[1] = max(stack_max_rank[1], rank)
+                if resident:
+                    stack_max_rank[0] = max(stack_max_rank[0], rank)
+
+            node = next(ranker_walk)
+            rank = ranker_cursor
+            ranker_cursor -= 1
+            resident = int(not node.is_evicted)
+            if node in seen:
+                depth = seen[node][0]
+            elif strict and ranker_max_depth[1 - resident] > stack_cursor:
+                depth = None
+                seen[node] = (None, rank)
+            else:
+                depth = node.depth
+                self.pageout_examined += 1
+                seen[node] = (depth, rank)
+                consider(node, depth, rank)
+            if depth is not None:
+                ranker_max_depth[1] = max(ranker_max_depth[1], depth)
+                if resident:
+                    ranker_max_depth[0] = max(ranker_max_depth[0], depth)
+
+        return best[0], best[1]
+
+    def EM_algorithm(self, delta, vectorized=True):
+        """Run EM until tau and theta settle.
+
+        By default the trace is gathered into NumPy columns once and each
+        iteration is a few vector operations over them; the ranker is only
+        rebuilt when the run is over. vectorized=False runs the per-record
+        E_step and M_step instead, which give the same results.
+        """
         def abs_sum():
             return abs(self.tau[0]) + abs(self.theta[0]) + abs(self.theta[1])
         before = delta + 4.0
@@ -306,47 +588,163 @@ class MMCPolicy(object):
         else:
             use_hard_Z = False
 
+        if vectorized:
+            columns = TraceColumns(self)
         while abs(before - abs_sum()) > delta:
             before = abs_sum()
             hard_Z = 0.5 if use_hard_Z and i == 0 else None
-            self.E_step(hard_Z=hard_Z)
+            if vectorized:
+                self.vector_E_step(columns, hard_Z=hard_Z)
+            else:
+                self.E_step(hard_Z=hard_Z)
             i += 1
-            self.M_step()
+            if vectorized:
+                self.vector_M_step(columns)
+            else:
+                self.M_step()
             # Since we are rearranging the ranks, it's possible that we can
             # get into a situation where the ranks shift in a cycle such
             # that the tau delta is always exeeded. I've only seen this limit
             # hit when the trace size is very small (e.g. 10).
             if i > 50:
                 break
+        if vectorized:
+            columns.store(self)
 
     def E_step(self, hard_Z=None):
         """Treat self.tau and self.theta as constants."""
         for node in self.full_cache.values():
             node._hit_count = 0.0
 
-        for record in self.trace:
+        trace = self.trace
+        rows = trace.rows().tolist()
+        ranks = [None] * len(rows)
+        if hard_Z is None:
+            ranks = self.record_ranks(rows)
+        for row, rank in zip(rows, ranks):
+            node = trace.node(row)
             if hard_Z is None:
-                if record.node.is_purged:
-                    rank = record.node.rank_purge_memo
-                else:
-                    rank = record.node.rank
-                record._Z = self.calculate_Z(record.depth, rank)
+                trace.set_Z(row, self.calculate_Z(float(trace.depth[row]),
+                                                  rank))
             else:
-                record._Z = hard_Z
-            record.node._hit_count += (1.0 - record._Z)
+                trace.set_Z(row, hard_Z)
+            node._hit_count += (1.0 - trace.get_Z(row))
 
-        new_ranker = RBTree()
+        ranked = []
         for node in self.full_cache.values():
             node.ranker_key = node.new_ranker_key()
-            new_ranker[node.ranker_key] = node
-        self.ranker = new_ranker
+            ranked.append((node.ranker_key, node))
+        ranked.sort(key=itemgetter(0))
+        self.ranker = type(self.ranker).from_sorted_items(ranked)
 
     def M_step(self):
-        """Treat Record.Z as constant."""
+        """Treat the trace's Z values as constant."""
         self.acc_tau = [0.0]
         self.acc_theta = [0.0, 0.0]
-        for record in self.trace:
-            self.update_tau_and_theta_accs(record, increment=True)
+        rows = self.trace.rows().tolist()
+        for row, rank in zip(rows, self.record_ranks(rows)):
+            self.update_tau_and_theta_accs(row, increment=True, rank=rank)
+        self.refresh_params()
+
+    def record_ranks(self, rows):
+        """Return the rank each record in rows sees. The ranks of the live
+        nodes come from one ranker.index_many call over their sorted keys."""
+        trace = self.trace
+        nodes = [trace.node(row) for row in rows]
+        keys = sorted(set(node.ranker_key for node in nodes
+                          if not node.is_purged))
+        ranks = dict(zip(keys, self.ranker.index_many(keys).tolist()))
+        return [node.rank_purge_memo if node.is_purged
+                else ranks[node.ranker_key] for node in nodes]
+
+    def vector_E_step(self, columns, hard_Z=None):
+        """E_step over a TraceColumns snapshot of the trace."""
+        if hard_Z is None:
+            columns.set_Z(self.calculate_Z_vector(
+                    columns.depth, columns.record_ranks()))
+        else:
+            columns.set_Z(np.full(len(columns.depth), hard_Z))
+        columns.rerank(self, 1.0 - columns.Z)
+
+    def vector_M_step(self, columns):
+        """M_step over a TraceColumns snapshot of the trace."""
+        Z = columns.Z
+        rank = columns.record_ranks()
+        self.acc_tau = [sequential_sum(Z)]
+        self.acc_theta = [sequential_sum(Z * columns.depth),
+                          sequential_sum((1.0 - Z) * rank)]
+        self.refresh_params()
+
+    def counted_rank(self, row, online):
+        """The rank the record at row is counted with: the one stored with
+        it for the online estimator, the node's current rank otherwise."""
+        if online:
+            return float(self.trace.rank[row])
+        return None
+
+    def count_trace(self):
+        """Store the rank each record sees now as its counted rank, and sum
+        acc_tau and acc_theta from the trace. Starts the online estimator."""
+        trace = self.trace
+        rows = trace.rows()
+        trace.rank[rows] = self.record_ranks(rows.tolist())
+        self.sum_trace()
+
+    def sum_trace(self):
+        """Set acc_tau and acc_theta to the sums over the trace's records,
+        each counted with its stored rank."""
+        trace = self.trace
+        rows = trace.rows()
+        Z = trace.Z[rows]
+        self.acc_tau = [sequential_sum(Z)]
+        self.acc_theta = [
+                sequential_sum(Z * trace.depth[rows]),
+                sequential_sum((1.0 - Z) * trace.rank[rows])]
+
+    def online_EM_step(self, num_records):
+        """Re-estimate the Z of the next num_records records in the trace.
+
+        Like E_step, every record is scored against the ranks from before the
+        step: moving a node after each of its records let the node's later
+        records see their own change, which fed back until tau ran off to 1.
+        Each record's contribution to acc_tau and acc_theta is replaced by
+        the one for its new Z and rank, which becomes its counted rank, and
+        each node has its hit count adjusted once for all of its records.
+        The accumulators are summed from the trace again each time the sweep
+        starts over. Each call costs O(num_records * log |K|).
+        """
+        trace = self.trace
+        if self.online_cursor >= len(trace):
+            self.sum_trace()
+            self.online_cursor = 0
+        stop = min(len(trace), self.online_cursor + num_records)
+        rows = (trace.head +
+                np.arange(self.online_cursor, stop)) % trace.capacity
+        self.online_cursor = stop
+
+        depth = trace.depth[rows]
+        old_Z = trace.Z[rows]
+        old_rank = trace.rank[rows]
+        rank = np.array(self.record_ranks(rows.tolist()), dtype=np.float64)
+        Z = self.calculate_Z_vector(depth, rank)
+        trace.rank[rows] = rank
+        trace.Z[rows] = Z
+        delta_Z = Z - old_Z
+
+        self.acc_tau[0] += float(delta_Z.sum())
+        self.acc_theta[0] = max(
+                0.0, self.acc_theta[0] + float((delta_Z * depth).sum()))
+        self.acc_theta[1] = max(
+                0.0, self.acc_theta[1] +
+                float(((1.0 - Z) * rank - (1.0 - old_Z) * old_rank).sum()))
+        node_deltas = {}
+        for row, node_delta in zip(rows.tolist(), delta_Z.tolist()):
+            if node_delta:
+                node = trace.node(row)
+                node_deltas[node] = node_deltas.get(node, 0.0) + node_delta
+        for node, node_delta in node_deltas.iteritems():
+            node.hit_count -= node_delta
+        self.apply_reranks()
         self.refresh_params()
 
     def calculate_Z(self, depth, rank):
@@ -366,6 +764,22 @@ class MMCPolicy(object):
             # depth become greater than the limits.
             return self.tau[0]
 
+    def calculate_Z_vector(self, depth, rank):
+        """calculate_Z for arrays of depths and ranks."""
+        numerator = (
+                self.tau[0] *
+                self.theta[0] *
+                (1 - self.theta[0])**depth)
+        denominator = (
+                numerator +
+                self.tau[1] *
+                self.theta[1] *
+                (1 - self.theta[1])**rank)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Z = numerator / denominator
+        Z[denominator == 0] = self.tau[0]
+        return Z
+
     def refresh_params(self):
         R = len(self.trace)
         self.tau[0] = self.acc_tau[0] / R
@@ -394,43 +808,80 @@ class MMCPolicy(object):
             self.acc_theta[1] -= (1.0 - Z) * rank
             self.acc_theta = [max(0.0, acc) for acc in self.acc_theta]
 
-    def update_tau_and_theta_accs(self, record, increment=True):
-        depth = record.depth
+    def update_tau_and_theta_accs(self, row, increment=True, rank=None):
+        depth = float(self.trace.depth[row])
 
-        if record.node.is_purged:
-            rank = record.node.rank_purge_memo
-        else:
-            rank = record.node.rank
+        if rank is None:
+            node = self.trace.node(row)
+            if node.is_purged:
+                rank = node.rank_purge_memo
+            else:
+                rank = node.rank
 
-        self._update_tau_and_theta_accs(record.Z, depth, rank, increment)
+        self._update_tau_and_theta_accs(
+                self.trace.get_Z(row), depth, rank, increment)
 
     def evict(self, node):
         self.evict_datapoint['row'] += 1
-        self.evict_datapoint['depth'] = node.depth
-        self.evict_datapoint['rank'] = node.rank
-        self.evict_datapoint['value'] = node.expected_value
-        self.evict_datapoint['Z'] = self.calculate_Z(
-                node.depth, node.rank)
-        self.evict_datapoint['tau'] = self.tau[0]
-        self.evict_writer.writerow(
-                [self.evict_datapoint[key] for key in self.evict_order])
-        self.evict_file.flush()
+        if self.evict_writer.offer_row():
+            self.evict_datapoint['depth'] = node.depth
+            self.evict_datapoint['rank'] = node.rank
+            self.evict_datapoint['value'] = node.expected_value
+            self.evict_datapoint['Z'] = self.calculate_Z(
+                    node.depth, node.rank)
+            self.evict_datapoint['tau'] = self.tau[0]
+            self.evict_datapoint['examined'] = self.pageout_examined
+            self.evict_writer.writerow(
+                    [self.evict_datapoint[key] for key in self.evict_order])
         self.num_in_cache -= 1
         node.is_evicted = True
+        if self.evicted_pages is not None:
+            self.evicted_pages[node.page_key] = True
 
     def purge(self, node):
         self.purge_datapoint['row'] += 1
-        self.purge_datapoint['depth'] = node.depth
-        self.purge_datapoint['rank'] = node.rank
-        self.purge_datapoint['value'] = node.expected_value
-        self.purge_datapoint['Z'] = self.calculate_Z(
-                node.depth, node.rank)
-        self.purge_writer.writerow(
-                [self.purge_datapoint[key] for key in self.purge_order])
-        self.purge_file.flush()
+        if self.purge_writer.offer_row():
+            self.purge_datapoint['depth'] = node.depth
+            self.purge_datapoint['rank'] = node.rank
+            self.purge_datapoint['value'] = node.expected_value
+            self.purge_datapoint['Z'] = self.calculate_Z(
+                    node.depth, node.rank)
+            self.purge_datapoint['examined'] = self.pageout_examined
+            self.purge_writer.writerow(
+                    [self.purge_datapoint[key] for key in self.purge_order])
         self.num_in_full_cache -= 1
+        if self.evicted_pages is not None:
+            self.evicted_pages.discard(node.page_key)
         node.purge()
 
+    def metadata_bytes(self):
+        """Return the bytes of metadata held by the policy, split into
+        entries, ghosts, trace and indexes.
+
+        Nodes and their full_cache tree nodes count as entries or ghosts.
+        The trace includes purged nodes that records still point at, and
+        the indexes are the stack and ranker trees.
+        """
+        breakdown = {
+                'entries': 0,
+                'ghosts': 0,
+                'trace': self.trace.metadata_bytes(),
+                'indexes': (sys.getsizeof(self.full_cache) +
+                            tree_bytes(self.stack) + tree_bytes(self.ranker))}
+        lookup_bytes = tree_node_bytes(self.full_cache)
+        for node in self.full_cache.values():
+            if node.is_evicted:
+                breakdown['ghosts'] += self.node_bytes(node) + lookup_bytes
+            else:
+                breakdown['entries'] += self.node_bytes(node) + lookup_bytes
+        for node in self.trace.referenced_nodes():
+            if node.is_purged:
+                breakdown['trace'] += self.node_bytes(node)
+        return breakdown
+
+    def node_bytes(self, node):
+        return object_bytes(node)
+
     @property
     def cache_list(self):
         return filter(lambda node: not node.is_evicted, self.full_cache_list)
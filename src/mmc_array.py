@@ -0,0 +1,297 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+from mmc import Node, MMCPolicy
+import math
+import numpy as np
+
+# Depth and rank of a slot that is not in the stack and ranker yet. It sorts
+# after every real position.
+NO_POSITION = np.iinfo(np.int64).max // 2
+
+# apply_reranks() shifts the rank column once per journal entry. Past this
+# many entries, as after a batch E step, it is cheaper to renumber every
+# rank with one walk of the ranker.
+BULK_RERANKS = 256
+
+class NodeTable(object):
+    """Stack depth, rank and residency of every node, as parallel NumPy
+    columns indexed by slot id.
+
+    The columns are kept exact as the stack and ranker change, by shifting
+    the positions between a node's old and new place with one vector
+    operation, so pageout never has to sort. That operation touches the
+    whole column: each move is O(capacity), and a request makes at least
+    one for its restack and one for its rerank whether or not it pages
+    out. bench_pageout.py times both kinds of request.
+    """
+    def __init__(self, capacity):
+        self.capacity = 0
+        self.free_slots = []
+        self.depth = np.zeros(0, dtype=np.int64)
+        self.rank = np.zeros(0, dtype=np.int64)
+        self.is_evicted = np.zeros(0, dtype=bool)
+        self.live = np.zeros(0, dtype=bool)
+        self.nodes = []
+        self.grow(max(1, capacity))
+
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        for name in ('depth', 'rank', 'is_evicted', 'live'):
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate(
+                    [column, np.zeros(extra, dtype=column.dtype)]))
+        self.depth[self.capacity:] = NO_POSITION
+        self.rank[self.capacity:] = NO_POSITION
+        self.nodes.extend([None] * extra)
+        self.free_slots.extend(reversed(range(self.capacity, capacity)))
+        self.capacity = capacity
+
+    def allocate(self, node):
+        if not self.free_slots:
+            self.grow(2 * self.capacity)
+        slot = self.free_slots.pop()
+        self.depth[slot] = NO_POSITION
+        self.rank[slot] = NO_POSITION
+        self.is_evicted[slot] = False
+        self.live[slot] = True
+        self.nodes[slot] = node
+        return slot
+
+    def release(self, slot):
+        self.live[slot] = False
+        self.nodes[slot] = None
+        self.free_slots.append(slot)
+
+    def move(self, column, slot, position):
+        """Move slot to position in column, shifting the slots in between.
+        A slot at NO_POSITION is inserted; position NO_POSITION removes it.
+        """
+        positions = getattr(self, column)
+        old = positions[slot]
+        if position < old:
+            positions += (positions >= position) & (positions < old)
+        elif position > old:
+            positions -= (positions > old) & (positions <= position)
+        positions[slot] = position
+
+    def row_bytes(self):
+        """Bytes of one slot across the columns and the nodes list."""
+        columns = [self.depth, self.rank, self.is_evicted, self.live]
+        pointer = np.dtype(np.intp).itemsize
+        return sum(column.itemsize for column in columns) + pointer
+
+    def live_slots(self):
+        return np.flatnonzero(self.live)
+
+
+class SlotNode(Node):
+    """A Node with a row in the policy's NodeTable.
+
+    The node's own fields stay plain attributes; the table only mirrors its
+    position in the stack and ranker. Purged nodes can still be referenced
+    by the trace, so on purge the node gives its slot back.
+    """
+    __slots__ = ['slot']
+
+    def __init__(self, cache):
+        self.slot = cache.table.allocate(self)
+        Node.__init__(self, cache)
+
+    def restack(self):
+        Node.restack(self)
+        table = self.cache.table
+        table.move('depth', self.slot, 0)
+        table.is_evicted[self.slot] = False
+
+    def purge(self):
+        Node.purge(self)
+        table = self.cache.table
+        table.move('depth', self.slot, NO_POSITION)
+        table.move('rank', self.slot, NO_POSITION)
+        table.release(self.slot)
+        self.slot = None
+
+
+class ArrayMMCPolicy(MMCPolicy):
+    """MMCPolicy whose pageout scores every node in one vectorized pass.
+
+    The stack and ranker trees are still used for the O(log |K|) depth and
+    rank lookups on the request path. The NodeTable keeps every depth and
+    rank up to date alongside them, at one O(capacity) vector shift per
+    move, so pageout is just the expected values of the table and an argmin,
+    which avoids the per-node Python overhead of scan_victims on large
+    caches. Requests that do not page out pay for the shifts too, which
+    makes them slower than MMCPolicy's O(log |K|) ones on large caches.
+
+    Both terms of the expected value fall with depth and rank, so the value
+    of any one slot bounds how shallow or low-ranked the minimum can be;
+    vector_victims only raises the slots past those bounds to a power.
+    """
+    node_class = SlotNode
+
+    def __init__(self, cache_entries_limit, ghost_entries_limit,
+                 trace_size_limit, csv_suffix="_mmc.csv", draw_dump=False,
+                 pageout_mode='vector', low_watermark=1.0, telemetry=None):
+        self.table = NodeTable(cache_entries_limit + ghost_entries_limit + 2)
+        MMCPolicy.__init__(
+                self, cache_entries_limit, ghost_entries_limit,
+                trace_size_limit, csv_suffix=csv_suffix, draw_dump=draw_dump,
+                pageout_mode=pageout_mode, low_watermark=low_watermark,
+                telemetry=telemetry)
+
+    def node_bytes(self, node):
+        size = MMCPolicy.node_bytes(self, node)
+        if node.slot is not None:
+            size += self.table.row_bytes()
+        return size
+
+    def apply_reranks(self):
+        if len(self.rerank_journal) > BULK_RERANKS:
+            MMCPolicy.apply_reranks(self)
+            self.refresh_ranks()
+            return
+        ranker = self.ranker
+        table = self.table
+        for node, new_key in self.rerank_journal.iteritems():
+            if node.ranker_key is None:
+                ranker[new_key] = node
+            else:
+                ranker.rekey(node.ranker_key, new_key)
+            node.ranker_key = new_key
+            table.move('rank', node.slot, ranker.index(new_key))
+        self.num_rekeys += len(self.rerank_journal)
+        self.rerank_journal.clear()
+
+    def refresh_ranks(self):
+        """Renumber the rank column from the ranker."""
+        rank = self.table.rank
+        for position, node in enumerate(self.ranker.values()):
+            rank[node.slot] = position
+
+    def EM_algorithm(self, delta, vectorized=True):
+        # EM rebuilds the ranker from scratch.
+        MMCPolicy.EM_algorithm(self, delta, vectorized)
+        self.refresh_ranks()
+
+    def evict(self, node):
+        MMCPolicy.evict(self, node)
+        self.table.is_evicted[node.slot] = True
+
+    def min_slot(self, allowed):
+        """The allowed slot of lowest expected value, ties broken toward the
+        lower rank like scan_victims."""
+        table = self.table
+        depth = table.depth
+        rank = table.rank
+        sdd_weight = self.tau[0] * self.theta[0]
+        irm_weight = self.tau[1] * self.theta[1]
+        sdd_base = 1.0 - self.theta[0]
+        irm_base = 1.0 - self.theta[1]
+
+        # The deepest and the lowest-ranked slot are both likely to be worth
+        # little, and the minimum is worth no more than either.
+        probes = [np.argmax(np.where(allowed, depth, -1)),
+                  np.argmax(np.where(allowed, rank, -1))]
+        bound = min(sdd_weight * sdd_base**depth[slot] +
+                    irm_weight * irm_base**rank[slot] for slot in probes)
+        candidates = allowed.copy()
+        for weight, base, positions in ((sdd_weight, sdd_base, depth),
+                                        (irm_weight, irm_base, rank)):
+            # A slot is worth more than one term, weight * base**position,
+            # so the minimum has that term <= bound. One position of slack
+            # covers the rounding of the logs.
+            if weight > 0.0 and 0.0 < base < 1.0 and bound > 0.0:
+                lowest = math.floor(math.log(bound / weight) /
+                                    math.log(base)) - 1
+                if lowest > 0:
+                    candidates &= positions >= lowest
+
+        slots = np.flatnonzero(candidates)
+        self.pageout_examined = len(slots)
+        values = sdd_weight * sdd_base**depth[slots]
+        values += irm_weight * irm_base**rank[slots]
+        ties = slots[values == values.min()]
+        return ties[np.argmin(rank[ties])]
+
+    def slot_values(self):
+        """Expected value of every slot, inf for the free ones."""
+        table = self.table
+        tau = self.tau
+        theta = self.theta
+        self.pageout_examined = len(self.ranker)
+        values = tau[0] * theta[0] * (1.0 - theta[0])**table.depth
+        values += tau[1] * theta[1] * (1.0 - theta[1])**table.rank
+        values[~table.live] = np.inf
+        return values
+
+    def lowest_slots(self, values, count):
+        """The count slots of lowest value, ties broken toward the lower
+        rank like scan_victims, lowest first. Skips slots valued inf."""
+        count = min(count, int(np.isfinite(values).sum()))
+        if count <= 0:
+            return np.zeros(0, dtype=np.intp)
+        if count < len(values):
+            bound = np.partition(values, count - 1)[count - 1]
+        else:
+            bound = values.max()
+        candidates = np.flatnonzero(values <= bound)
+        order = np.lexsort((self.table.rank[candidates], values[candidates]))
+        return candidates[order[:count]]
+
+    def slot_nodes(self, slots):
+        """Return the nodes in slots with their expected values filled in."""
+        table = self.table
+        nodes = []
+        for slot in slots:
+            node = table.nodes[slot]
+            node.recompute_expected_value(
+                    depth=int(table.depth[slot]), rank=int(table.rank[slot]))
+            nodes.append(node)
+        return nodes
+
+    def vector_victims(self):
+        table = self.table
+        if not table.live.any():
+            return None, None
+        examined = 0
+        min_ghost = self.min_slot(table.live)
+        examined += self.pageout_examined
+        resident = table.live & ~table.is_evicted
+        if resident.any():
+            min_node = self.min_slot(resident)
+            self.pageout_examined += examined
+            return tuple(self.slot_nodes([min_node, min_ghost]))
+        self.pageout_examined = examined
+        return None, self.slot_nodes([min_ghost])[0]
+
+    def batch_victims(self, num_evict, num_purge):
+        values = self.slot_values()
+        purge_slots = self.lowest_slots(values, num_purge)
+        values[self.table.is_evicted] = np.inf
+        evict_slots = self.lowest_slots(values, num_evict)
+        return self.slot_nodes(evict_slots), self.slot_nodes(purge_slots)
@@ -30,10 +30,15 @@ from bintrees import FastRBTree
 from index_rbtree.rbtree import RBTree
 from pprint import pprint
 import numpy as np
-import collections
-import csv
+import heapq
+from operator import itemgetter
+import sys
 import time
 from dump_full_cache_to_csv import dump_cache
+from metadata import object_bytes, tree_bytes, tree_node_bytes
+from ring_trace import RingTrace, HIT_FLAG, READ_FLAG, WRITE_FLAG
+from telemetry import BufferedCSVSink
+from trace_columns import TraceColumns, sequential_sum
 
 R_SDD = 0
 R_IRM = 1
@@ -42,6 +47,10 @@ W_IRM = 3
 D = 4
 
 class Node(object):
+    __slots__ = ['cache', 'page_key', 'is_evicted', 'is_purged',
+                 '_expected_value', '_hit_count', 'stack_key', 'ranker_key',
+                 'opcode', 'trace_slot', 'rank_purge_memo', 'depth_memo']
+
     def __init__(self, cache):
         self.cache = cache
         self.page_key = None
@@ -52,6 +61,7 @@ class Node(object):
         self.stack_key = None
         self.ranker_key = None
         self.opcode = None
+        self.trace_slot = None
 
     @property
     def expected_value(self):
@@ -81,7 +91,7 @@ class Node(object):
     @property
     def depth(self):
         try:
-            return self.cache.stack.index(self.stack_key)
+            return self.cache.stack.finger_index(self.stack_key)
         except KeyError:
             return (((self.cache.tau[R_SDD] * (1.0 / self.cache.theta[R_SDD])) +
                      (self.cache.tau[W_SDD] * (1.0 / self.cache.theta[W_SDD]))) /
@@ -93,9 +103,12 @@ class Node(object):
         self.cache.stack[self.stack_key] = self
 
     def rerank(self):
-        self.cache.ranker.discard(self.ranker_key)
-        self.ranker_key = self.new_ranker_key()
-        self.cache.ranker[self.ranker_key] = self
+        new_key = self.new_ranker_key()
+        if self.ranker_key is None:
+            self.cache.ranker[new_key] = self
+        else:
+            self.cache.ranker.rekey(self.ranker_key, new_key)
+        self.ranker_key = new_key
 
     @property
     def hit_count(self):
@@ -121,7 +134,7 @@ class Node(object):
     @property
     def rank(self):
         try:
-            return self.cache.ranker.index(self.ranker_key)
+            return self.cache.ranker.finger_index(self.ranker_key)
         except KeyError:
             return (((self.cache.tau[R_IRM] * (1.0 / self.cache.theta[R_IRM])) +
                      (self.cache.tau[W_IRM] * (1.0 / self.cache.theta[W_IRM]))) /
@@ -139,31 +152,15 @@ class Node(object):
         except Exception as err:
             print
             print locals()
-            print self.__dict__
+            print dict((name, getattr(self, name, None))
+                       for name in self.__slots__)
             raise
 
 
-class Record(object):
-    def __init__(self, cache, node):
-        self.cache = cache
-        self.node = node
-        self.depth = node.depth
-        self.rank_memo = node.rank
-        self._Z = self.cache.calculate_Z(self.depth, node.rank, node.opcode)
-        self.was_hit = cache.was_hit
-        self.opcode = node.opcode
-
-    @property
-    def Z(self):
-        return self._Z
-
-    @Z.setter
-    def Z(self, new_Z):
-        self._Z = new_Z
-
 class MMCRWPolicy(object):
     def __init__(self, cache_entries_limit, ghost_entries_limit,
-                 trace_size_limit, csv_suffix="_mmc.csv"):
+                 trace_size_limit, csv_suffix="_mmc.csv", low_watermark=1.0,
+                 telemetry=None):
         self.full_cache = FastRBTree()
         self.was_hit = None
         self.was_ghost_hit = None
@@ -172,7 +169,7 @@ class MMCRWPolicy(object):
         self.cache_entries_limit = cache_entries_limit
         self.ghost_entries_limit = ghost_entries_limit
         self.trace_size_limit = trace_size_limit
-        self.trace = collections.deque()
+        self.trace = RingTrace(trace_size_limit + 1, Z_width=D)
         self.stack = RBTree()
         self.ranker = RBTree()
         self.generation = 0
@@ -188,7 +185,17 @@ class MMCRWPolicy(object):
         self.num_in_full_cache = 0
         self.num_reads = 0
         self.csv_suffix = csv_suffix
-
+        # The entry limits act as high watermarks. Once one is crossed,
+        # pageout frees entries in a single pass until the count is back down
+        # to low_watermark times the limit.
+        self.low_watermark = low_watermark
+        self.cache_low_watermark = int(cache_entries_limit * low_watermark)
+        self.full_cache_low_watermark = int(
+                (cache_entries_limit + ghost_entries_limit) * low_watermark)
+
+        if telemetry is None:
+            telemetry = BufferedCSVSink()
+        self.telemetry = telemetry
         self.ts_order = [
                 'row', 'hit', 'ghost_hit',
                 'tau_R_SDD', 'tau_R_IRM', 'tau_W_SDD', 'tau_W_IRM',
@@ -198,24 +205,21 @@ class MMCRWPolicy(object):
             ]
         self.ts_datapoint = {key: None for key in self.ts_order}
         self.ts_datapoint['row'] = 0
-        self.ts_file = open("csv/mmc_rw" + self.csv_suffix, "w")
-        self.ts_writer = csv.writer(self.ts_file)
-        self.ts_writer.writerow(self.ts_order)
+        self.ts_writer = self.telemetry.open(
+                "mmc_rw" + self.csv_suffix, self.ts_order)
 
         self.evict_order = [
                 'row', 'depth', 'rank', 'value', 'opcode']
         self.evict_datapoint = {key: None for key in self.evict_order}
         self.evict_datapoint['row'] = 0
-        self.evict_file = open("csv/mmc_rw_evict" + self.csv_suffix, "w")
-        self.evict_writer = csv.writer(self.evict_file)
-        self.evict_writer.writerow(self.evict_order)
+        self.evict_writer = self.telemetry.open(
+                "mmc_rw_evict" + self.csv_suffix, self.evict_order)
 
         self.purge_order = ['row', 'depth', 'rank', 'value', 'opcode']
         self.purge_datapoint = {key: None for key in self.purge_order}
         self.purge_datapoint['row'] = 0
-        self.purge_file = open("csv/mmc_rw_purge" + self.csv_suffix, "w")
-        self.purge_writer = csv.writer(self.purge_file)
-        self.purge_writer.writerow(self.purge_order)
+        self.purge_writer = self.telemetry.open(
+                "mmc_rw_purge" + self.csv_suffix, self.purge_order)
 
     def request(self, page, opcode):
         self.num_requests += 1
@@ -248,17 +252,28 @@ class MMCRWPolicy(object):
             self.num_reads += 1
 
         node.is_evicted = node.is_purged = False
-        record = Record(self, node)
-        self.add_trace_record(record)
+        depth = node.depth
+        rank = node.rank
+        flags = HIT_FLAG if self.was_hit else 0
+        if node.opcode == 'r':
+            flags |= READ_FLAG
+        elif node.opcode == 'w':
+            flags |= WRITE_FLAG
+        row = self.trace.append(
+                node, depth, rank, self.calculate_Z(depth, rank, node.opcode),
+                flags)
+        self.add_trace_record(row)
         node.opcode = opcode
 
         if len(self.trace) > self.trace_size_limit:
-            popped_record = self.trace.popleft()
-            self.update_tau_and_theta_accs(record, increment=True)
-            self.update_tau_and_theta_accs(popped_record, increment=False)
+            popped_row = self.trace.popleft()
+            self.update_tau_and_theta_accs(row, increment=True)
+            self.update_tau_and_theta_accs(popped_row, increment=False)
             self.refresh_params()
-            popped_record.node.hit_count -= popped_record.Z[R_IRM]
-            popped_record.node.hit_count -= popped_record.Z[W_IRM]
+            popped_node = self.trace.node(popped_row)
+            popped_Z = self.trace.get_Z(popped_row)
+            popped_node.hit_count -= popped_Z[R_IRM]
+            popped_node.hit_count -= popped_Z[W_IRM]
 
         node.restack()
         node.rerank()
@@ -277,7 +292,9 @@ class MMCRWPolicy(object):
             self.pageout()
         #dump_cache(self, "exp")
 
-    def add_trace_record(self, record):
+    def add_trace_record(self, row):
+        if not self.ts_writer.offer_row():
+            return
         self.ts_datapoint['row'] = self.num_requests
         if self.was_hit:
             self.ts_datapoint['hit'] = 1
@@ -299,22 +316,45 @@ class MMCRWPolicy(object):
         self.ts_datapoint['theta_W_SDD'] = self.theta[W_SDD]
         self.ts_datapoint['theta_W_IRM'] = self.theta[W_IRM]
 
-        self.ts_datapoint['Z_R_SDD'] = record.Z[R_SDD]
-        self.ts_datapoint['Z_R_IRM'] = record.Z[R_IRM]
-        self.ts_datapoint['Z_W_SDD'] = record.Z[W_SDD]
-        self.ts_datapoint['Z_W_IRM'] = record.Z[W_IRM]
+        Z = self.trace.get_Z(row)
+        self.ts_datapoint['Z_R_SDD'] = Z[R_SDD]
+        self.ts_datapoint['Z_R_IRM'] = Z[R_IRM]
+        self.ts_datapoint['Z_W_SDD'] = Z[W_SDD]
+        self.ts_datapoint['Z_W_IRM'] = Z[W_IRM]
 
-        self.ts_datapoint['Z_sum'] = sum(record.Z)
+        self.ts_datapoint['Z_sum'] = sum(Z)
 
-        self.ts_datapoint['depth'] = record.depth
-        self.ts_datapoint['rank'] = record.node.rank
+        self.ts_datapoint['depth'] = float(self.trace.depth[row])
+        self.ts_datapoint['rank'] = self.trace.node(row).rank
 
         self.ts_writer.writerow(
                 [self.ts_datapoint[key] for key in self.ts_order])
-        self.ts_file.flush()
-        self.trace.append(record)
 
     def pageout(self):
+        num_evict = 0
+        num_purge = 0
+        if self.num_in_cache > self.cache_entries_limit:
+            num_evict = self.num_in_cache - self.cache_low_watermark
+        if (
+          self.num_in_full_cache >
+          self.cache_entries_limit + self.ghost_entries_limit
+        ):
+            num_purge = self.num_in_full_cache - self.full_cache_low_watermark
+
+        if num_evict <= 1 and num_purge <= 1:
+            min_node, min_ghost = self.scan_victims()
+            evict_nodes = [min_node][:num_evict]
+            purge_nodes = [min_ghost][:num_purge]
+        else:
+            evict_nodes, purge_nodes = self.batch_victims(num_evict, num_purge)
+        for node in evict_nodes:
+            self.evict(node)
+        for node in purge_nodes:
+            self.purge(node)
+
+    def scan_victims(self):
+        """Score every node and return (min_node, min_ghost), the lowest-valued
+        resident node and the lowest-valued node overall."""
         min_node = None
         min_node_value = None
         min_ghost = None
@@ -334,16 +374,31 @@ class MMCRWPolicy(object):
                 min_ghost = node
                 min_ghost_value = value
 
-        if self.num_in_cache > self.cache_entries_limit:
-            self.evict(min_node)
+        return min_node, min_ghost
 
-        if (
-          self.num_in_full_cache >
-          self.cache_entries_limit + self.ghost_entries_limit
-        ):
-            self.purge(min_ghost)
+    def batch_victims(self, num_evict, num_purge):
+        """Score every node once and return the num_evict lowest-valued
+        resident nodes and the num_purge lowest-valued nodes overall. Ties go
+        to the lower rank."""
+        for depth, node in enumerate(self.stack.values()):
+            node.depth_memo = depth
+
+        scored = []
+        for rank, node in enumerate(self.ranker.values()):
+            node.recompute_expected_value(depth=node.depth_memo, rank=rank)
+            scored.append((node.expected_value, rank, node))
 
-    def EM_algorithm(self, delta):
+        residents = [item for item in scored if not item[2].is_evicted]
+        evict_nodes = [item[2] for item in heapq.nsmallest(num_evict, residents)]
+        purge_nodes = [item[2] for item in heapq.nsmallest(num_purge, scored)]
+        return evict_nodes, purge_nodes
+
+    def EM_algorithm(self, delta, vectorized=True):
+        """Run EM until tau and theta settle.
+
+        See MMCPolicy.EM_algorithm; vectorized=False runs the per-record
+        E_step and M_step.
+        """
         def abs_sum():
             return sum(self.tau) + sum(self.theta)
         before = delta + 4.0
@@ -359,49 +414,117 @@ class MMCRWPolicy(object):
         else:
             use_hard_Z = False
 
+        if vectorized:
+            columns = TraceColumns(self)
         while abs(before - abs_sum()) > delta:
             before = abs_sum()
             hard_Z = [0.25, 0.25, 0.25, 0.25] if use_hard_Z and i == 0 else None
-            self.E_step(hard_Z=hard_Z)
+            if vectorized:
+                self.vector_E_step(columns, hard_Z=hard_Z)
+            else:
+                self.E_step(hard_Z=hard_Z)
             i += 1
-            self.M_step()
+            if vectorized:
+                self.vector_M_step(columns)
+            else:
+                self.M_step()
             # Since we are rearranging the ranks, it's possible that we can
             # get into a situation where the ranks shift in a cycle such
             # that the tau delta is always exeeded. I've only seen this limit
             # hit when the trace size is very small (e.g. 10).
             if i > 50:
                 break
+        if vectorized:
+            columns.store(self)
 
     def E_step(self, hard_Z=None):
         """Treat self.tau and self.theta as constants."""
         for node in self.full_cache.values():
             node._hit_count = 0.0
 
-        for record in self.trace:
+        trace = self.trace
+        rows = trace.rows().tolist()
+        ranks = [None] * len(rows)
+        if hard_Z is None:
+            ranks = self.record_ranks(rows)
+        for row, rank in zip(rows, ranks):
+            node = trace.node(row)
             if hard_Z is None:
-                if record.node.is_purged:
-                    rank = record.node.rank_purge_memo
-                else:
-                    rank = record.node.rank
-                record._Z = self.calculate_Z(record.depth, rank, record.opcode)
+                trace.set_Z(row, self.calculate_Z(
+                        float(trace.depth[row]), rank, trace.opcode(row)))
             else:
-                record._Z = hard_Z
-            record.node._hit_count += record._Z[R_IRM] + record._Z[W_IRM]
+                trace.set_Z(row, hard_Z)
+            Z = trace.get_Z(row)
+            node._hit_count += Z[R_IRM] + Z[W_IRM]
 
-        new_ranker = RBTree()
+        ranked = []
         for node in self.full_cache.values():
             node.ranker_key = node.new_ranker_key()
-            new_ranker[node.ranker_key] = node
-        self.ranker = new_ranker
+            ranked.append((node.ranker_key, node))
+        ranked.sort(key=itemgetter(0))
+        self.ranker = type(self.ranker).from_sorted_items(ranked)
 
     def M_step(self):
-        """Treat Record.Z as constant."""
+        """Treat the trace's Z values as constant."""
         self.acc_tau = [0.0 for d in range(D)]
         self.acc_theta = [0.0 for d in range(D)]
-        for record in self.trace:
-            self.update_tau_and_theta_accs(record, increment=True)
+        rows = self.trace.rows().tolist()
+        for row, rank in zip(rows, self.record_ranks(rows)):
+            self.update_tau_and_theta_accs(row, increment=True, rank=rank)
+        self.refresh_params()
+
+    def record_ranks(self, rows):
+        """Return the rank each record in rows sees. The ranks of the live
+        nodes come from one ranker.index_many call over their sorted keys."""
+        trace = self.trace
+        nodes = [trace.node(row) for row in rows]
+        keys = sorted(set(node.ranker_key for node in nodes
+                          if not node.is_purged))
+        ranks = dict(zip(keys, self.ranker.index_many(keys).tolist()))
+        return [node.rank_purge_memo if node.is_purged
+                else ranks[node.ranker_key] for node in nodes]
+
+    def vector_E_step(self, columns, hard_Z=None):
+        """E_step over a TraceColumns snapshot of the trace."""
+        if hard_Z is None:
+            columns.set_Z(self.calculate_Z_vector(
+                    columns.depth, columns.record_ranks(), columns.opcode))
+        else:
+            columns.set_Z(np.tile(hard_Z, (len(columns.depth), 1)))
+        columns.rerank(self, columns.Z[:, R_IRM] + columns.Z[:, W_IRM])
+
+    def vector_M_step(self, columns):
+        """M_step over a TraceColumns snapshot of the trace."""
+        Z = columns.Z
+        rank = columns.record_ranks()
+        H = [columns.depth, rank, columns.depth, rank]
+        self.acc_tau = [sequential_sum(Z[:, d]) for d in range(D)]
+        self.acc_theta = [sequential_sum(Z[:, d] * H[d]) for d in range(D)]
         self.refresh_params()
 
+    def calculate_Z_vector(self, depth, rank, opcode):
+        """calculate_Z for arrays of depths, ranks and opcodes."""
+        H = [depth, rank, depth, rank]
+        num = [self.tau[d] * self.theta[d] * (1 - self.theta[d])**H[d]
+               for d in range(D)]
+        Z = np.zeros((len(depth), D))
+        reads = opcode == 'r'
+        writes = opcode == 'w'
+        others = ~(reads | writes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for sdd, irm, mask in [(R_SDD, R_IRM, reads),
+                                   (W_SDD, W_IRM, writes)]:
+                den = num[sdd] + num[irm]
+                split = mask & (den == 0)
+                Z[mask, sdd] = (num[sdd] / den)[mask]
+                Z[mask, irm] = (num[irm] / den)[mask]
+                Z[split, sdd] = 0.5
+                Z[split, irm] = 0.5
+            den = num[R_SDD] + num[R_IRM] + num[W_SDD] + num[W_IRM]
+            for d in range(D):
+                Z[others, d] = (num[d] / den)[others]
+        return Z
+
     def calculate_Z(self, depth, rank, opcode):
         Z = [0.0 for d in range(D)]
         H = [depth, rank, depth, rank]
@@ -459,40 +582,66 @@ class MMCRWPolicy(object):
             self.acc_theta = [max(0.0, self.acc_theta[d] - Z[d] * H[d])
                               for d in range(D)]
 
-    def update_tau_and_theta_accs(self, record, increment=True):
-        if record.node.is_purged:
-            rank = record.node.rank_purge_memo
-        else:
-            rank = record.node.rank
+    def update_tau_and_theta_accs(self, row, increment=True, rank=None):
+        if rank is None:
+            node = self.trace.node(row)
+            if node.is_purged:
+                rank = node.rank_purge_memo
+            else:
+                rank = node.rank
 
-        self._update_tau_and_theta_accs(record.Z, record.depth, rank, increment)
+        self._update_tau_and_theta_accs(
+                self.trace.get_Z(row), float(self.trace.depth[row]), rank,
+                increment)
 
     def evict(self, node):
         self.evict_datapoint['row'] += 1
-        self.evict_datapoint['depth'] = node.depth
-        self.evict_datapoint['rank'] = node.rank
-        self.evict_datapoint['value'] = node.expected_value
-        self.evict_datapoint['opcode'] = node.opcode
-        self.evict_writer.writerow(
-                [self.evict_datapoint[key] for key in self.evict_order])
-        self.evict_file.flush()
+        if self.evict_writer.offer_row():
+            self.evict_datapoint['depth'] = node.depth
+            self.evict_datapoint['rank'] = node.rank
+            self.evict_datapoint['value'] = node.expected_value
+            self.evict_datapoint['opcode'] = node.opcode
+            self.evict_writer.writerow(
+                    [self.evict_datapoint[key] for key in self.evict_order])
         self.num_in_cache -= 1
         node.is_evicted = True
 
     def purge(self, node):
         self.purge_datapoint['row'] += 1
-        self.purge_datapoint['depth'] = node.depth
-        self.purge_datapoint['rank'] = node.rank
-        self.purge_datapoint['value'] = node.expected_value
-        self.purge_datapoint['opcode'] = node.opcode
-        self.purge_writer.writerow(
-                [self.purge_datapoint[key] for key in self.purge_order])
-        self.purge_file.flush()
+        if self.purge_writer.offer_row():
+            self.purge_datapoint['depth'] = node.depth
+            self.purge_datapoint['rank'] = node.rank
+            self.purge_datapoint['value'] = node.expected_value
+            self.purge_datapoint['opcode'] = node.opcode
+            self.purge_writer.writerow(
+                    [self.purge_datapoint[key] for key in self.purge_order])
         self.num_in_full_cache -= 1
         if node.opcode == 'r':
             self.num_reads -= 1
         node.purge()
 
+    def metadata_bytes(self):
+        """See MMCPolicy.metadata_bytes."""
+        breakdown = {
+                'entries': 0,
+                'ghosts': 0,
+                'trace': self.trace.metadata_bytes(),
+                'indexes': (sys.getsizeof(self.full_cache) +
+                            tree_bytes(self.stack) + tree_bytes(self.ranker))}
+        lookup_bytes = tree_node_bytes(self.full_cache)
+        for node in self.full_cache.values():
+            if node.is_evicted:
+                breakdown['ghosts'] += self.node_bytes(node) + lookup_bytes
+            else:
+                breakdown['entries'] += self.node_bytes(node) + lookup_bytes
+        for node in self.trace.referenced_nodes():
+            if node.is_purged:
+                breakdown['trace'] += self.node_bytes(node)
+        return breakdown
+
+    def node_bytes(self, node):
+        return object_bytes(node)
+
     @property
     def cache_list(self):
         return filter(lambda node: not node.is_evicted, self.full_cache_list)
@@ -501,6 +650,11 @@ class MMCRWPolicy(object):
     def full_cache_list(self):
         return list(self.full_cache.values())
 
+    def close(self):
+        """Close the policy's time series, flushing what is buffered."""
+        for writer in (self.ts_writer, self.evict_writer, self.purge_writer):
+            writer.close()
+
     def hit_rate(self):
         return float(self.num_hits) / self.num_requests
 
@@ -0,0 +1,198 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+from metadata import value_bytes
+from mmc import MMCPolicy
+import collections
+import sys
+import threading
+
+class PageoutDaemon(threading.Thread):
+    """Keeps a DaemonMMCPolicy's victim queues filled.
+
+    Each pass takes an O(1) CacheSnapshot under the policy's lock, walks
+    and scores it outside of the lock and installs the lowest valued
+    candidates as the new queues.
+    """
+    def __init__(self, policy):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.policy = policy
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.passes = 0
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if self.stopped:
+                return
+            self.refill()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def refill(self):
+        policy = self.policy
+        with policy.lock:
+            snapshot = policy.snapshot()
+        tau = snapshot.tau
+        theta = snapshot.theta
+
+        ranks = {}
+        for rank, node in enumerate(snapshot.ranker.values()):
+            ranks[node] = rank
+        scored = []
+        for depth, (stack_key, node) in enumerate(snapshot.stack.items()):
+            rank = ranks[node]
+            value = tau[0] * theta[0] * (1.0 - theta[0])**depth
+            value += tau[1] * theta[1] * (1.0 - theta[1])**rank
+            scored.append([value, rank, depth, node, stack_key,
+                           node.page_key in snapshot.evicted])
+        scored.sort()
+
+        size = policy.queue_size
+        evict_queue = [item for item in scored if not item[5]][:size]
+        purge_queue = scored[:size]
+
+        with policy.lock:
+            policy.evict_queue = collections.deque(evict_queue)
+            policy.purge_queue = collections.deque(purge_queue)
+            policy.queue_params = (tau, theta)
+            # Parameters may have moved while we were scoring.
+            policy.revalidate_queues()
+        self.passes += 1
+
+
+class DaemonMMCPolicy(MMCPolicy):
+    """MMCPolicy that takes victims from queues filled by a PageoutDaemon.
+
+    request() pops victims in O(1) instead of searching the cache. A queued
+    node is skipped if it has been requested or purged since the snapshot it
+    came from. When tau or theta move by more than param_tolerance, the
+    queued candidates are rescored from their snapshot depth and rank, which
+    only touches the queue. If a queue runs dry, pageout falls back to the
+    synchronous search.
+
+    The stack and ranker are 'persistent' indexes, so the daemon holds the
+    lock only to take a snapshot of them. The victims are chosen from a
+    slightly stale view of the cache, so the decisions can differ from
+    MMCPolicy. Under CPython's GIL the daemon
+    mostly overlaps with the CSV output rather than with the request path.
+    """
+    def __init__(self, cache_entries_limit, ghost_entries_limit,
+                 trace_size_limit, csv_suffix="_mmc.csv", draw_dump=False,
+                 pageout_mode='scan', low_watermark=1.0, queue_size=64,
+                 param_tolerance=0.01, telemetry=None):
+        MMCPolicy.__init__(
+                self, cache_entries_limit, ghost_entries_limit,
+                trace_size_limit, csv_suffix=csv_suffix, draw_dump=draw_dump,
+                pageout_mode=pageout_mode, low_watermark=low_watermark,
+                telemetry=telemetry, stack_index='persistent',
+                ranker_index='persistent')
+        self.lock = threading.Lock()
+        self.queue_size = queue_size
+        self.param_tolerance = param_tolerance
+        self.evict_queue = collections.deque()
+        self.purge_queue = collections.deque()
+        self.queue_params = (list(self.tau), list(self.theta))
+        self.num_fallbacks = 0
+        self.daemon = PageoutDaemon(self)
+        self.daemon.start()
+
+    def close(self):
+        self.daemon.stop()
+        self.daemon.join()
+        MMCPolicy.close(self)
+
+    def request(self, page):
+        with self.lock:
+            MMCPolicy.request(self, page)
+            tau, theta = self.queue_params
+            drift = max(abs(self.tau[0] - tau[0]),
+                        abs(self.theta[0] - theta[0]),
+                        abs(self.theta[1] - theta[1]))
+            if drift > self.param_tolerance:
+                self.revalidate_queues()
+            low = self.queue_size // 4
+            if len(self.evict_queue) <= low or len(self.purge_queue) <= low:
+                self.daemon.wakeup.set()
+
+    def metadata_bytes(self):
+        """MMCPolicy.metadata_bytes, with the victim queues as indexes."""
+        with self.lock:
+            breakdown = MMCPolicy.metadata_bytes(self)
+            for queue in (self.evict_queue, self.purge_queue):
+                breakdown['indexes'] += sys.getsizeof(queue)
+                breakdown['indexes'] += sum(value_bytes(item) for item in queue)
+        return breakdown
+
+    def revalidate_queues(self):
+        """Rescore the queued candidates with the current parameters."""
+        tau = self.tau
+        theta = self.theta
+        for queue in (self.evict_queue, self.purge_queue):
+            items = list(queue)
+            for item in items:
+                depth = item[2]
+                rank = item[1]
+                item[0] = tau[0] * theta[0] * (1.0 - theta[0])**depth
+                item[0] += tau[1] * theta[1] * (1.0 - theta[1])**rank
+            items.sort()
+            queue.clear()
+            queue.extend(items)
+        self.queue_params = (list(tau), list(theta))
+
+    def pop_victim(self, queue, resident):
+        while queue:
+            value, rank, depth, node, stack_key, _ = queue.popleft()
+            if node.is_purged or node.stack_key != stack_key:
+                continue
+            if resident and node.is_evicted:
+                continue
+            node._expected_value = value
+            return node
+        return None
+
+    def pageout(self):
+        num_evict, num_purge = self.pageout_counts()
+        for _ in range(num_evict):
+            node = self.pop_victim(self.evict_queue, resident=True)
+            if node is None:
+                break
+            self.evict(node)
+        for _ in range(num_purge):
+            node = self.pop_victim(self.purge_queue, resident=False)
+            if node is None:
+                break
+            self.purge(node)
+
+        if self.pageout_counts() != (0, 0):
+            self.num_fallbacks += 1
+            MMCPolicy.pageout(self)
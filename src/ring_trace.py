@@ -0,0 +1,188 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import numpy as np
+import sys
+
+HIT_FLAG = 1
+READ_FLAG = 2
+WRITE_FLAG = 4
+
+
+class RingTrace(object):
+    """A fixed-capacity FIFO of trace records held in typed columns.
+
+    Each record takes a row with an int32 node slot, float64 depth, rank and
+    Z (Z_width of them) and a uint8 of flags. Depth and rank are not always
+    whole numbers, and rounding any of the three to float32 changes which
+    pages are evicted. Nodes are stored once in a slot
+    table and reference counted by the records that point at them, so a
+    purged node keeps its slot until its last record leaves the trace.
+    append() and popleft() only write into the preallocated columns and both
+    return the row they touched. A popped row stays readable until the next
+    append().
+    """
+    def __init__(self, capacity, Z_width=1):
+        self.capacity = capacity
+        self.Z_width = Z_width
+        self.head = 0
+        self.count = 0
+        self.slot = np.zeros(capacity, dtype=np.int32)
+        self.depth = np.zeros(capacity, dtype=np.float64)
+        self.rank = np.zeros(capacity, dtype=np.float64)
+        if Z_width == 1:
+            self.Z = np.zeros(capacity, dtype=np.float64)
+        else:
+            self.Z = np.zeros((capacity, Z_width), dtype=np.float64)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+
+        # At most one slot per record is ever in use.
+        self.nodes = [None] * capacity
+        self.refcount = np.zeros(capacity, dtype=np.int32)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield TraceRecord(self, (self.head + i) % self.capacity)
+
+    def __getitem__(self, i):
+        return TraceRecord(self, self.row(i))
+
+    def row(self, i):
+        """Return the row of the i-th oldest record."""
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("trace index out of range")
+        return (self.head + i) % self.capacity
+
+    def rows(self):
+        """Return every row, oldest first, as an array."""
+        return (self.head + np.arange(self.count)) % self.capacity
+
+    def append(self, node, depth, rank, Z, flags=0):
+        if self.count == self.capacity:
+            raise IndexError("append to a full trace")
+        slot = node.trace_slot
+        if slot is None:
+            slot = self.free_slots.pop()
+            node.trace_slot = slot
+            self.nodes[slot] = node
+        self.refcount[slot] += 1
+
+        row = (self.head + self.count) % self.capacity
+        self.count += 1
+        self.slot[row] = slot
+        self.depth[row] = depth
+        self.rank[row] = rank
+        self.Z[row] = Z
+        self.flags[row] = flags
+        return row
+
+    def popleft(self):
+        if not self.count:
+            raise IndexError("pop from an empty trace")
+        row = self.head
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+
+        slot = self.slot[row]
+        self.refcount[slot] -= 1
+        if not self.refcount[slot]:
+            # nodes[slot] is left in place so that the popped row can still
+            # be read; it is overwritten when the slot is handed out again.
+            self.nodes[slot].trace_slot = None
+            self.free_slots.append(slot)
+        return row
+
+    def node(self, row):
+        return self.nodes[self.slot[row]]
+
+    def get_Z(self, row):
+        if self.Z_width == 1:
+            return float(self.Z[row])
+        return self.Z[row].tolist()
+
+    def set_Z(self, row, Z):
+        self.Z[row] = Z
+
+    def referenced_nodes(self):
+        """Return the nodes that at least one record points at."""
+        return [self.nodes[slot] for slot in np.flatnonzero(self.refcount)]
+
+    def metadata_bytes(self):
+        return (self.slot.nbytes + self.depth.nbytes + self.rank.nbytes +
+                self.Z.nbytes + self.flags.nbytes + self.refcount.nbytes +
+                sys.getsizeof(self.nodes) + sys.getsizeof(self.free_slots))
+
+    def opcode(self, row):
+        flags = self.flags[row]
+        if flags & READ_FLAG:
+            return 'r'
+        if flags & WRITE_FLAG:
+            return 'w'
+        return None
+
+
+class TraceRecord(object):
+    """A view of one row of a RingTrace with the old Record attributes."""
+    __slots__ = ['trace', 'row']
+
+    def __init__(self, trace, row):
+        self.trace = trace
+        self.row = row
+
+    @property
+    def node(self):
+        return self.trace.node(self.row)
+
+    @property
+    def depth(self):
+        return float(self.trace.depth[self.row])
+
+    @property
+    def rank_memo(self):
+        return float(self.trace.rank[self.row])
+
+    @property
+    def was_hit(self):
+        return bool(self.trace.flags[self.row] & HIT_FLAG)
+
+    @property
+    def opcode(self):
+        return self.trace.opcode(self.row)
+
+    @property
+    def Z(self):
+        return self.trace.get_Z(self.row)
+
+    @Z.setter
+    def Z(self, new_Z):
+        self.trace.set_Z(self.row, new_Z)
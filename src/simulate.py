@@ -33,32 +33,9 @@ from arc import ARCPolicy
 from lru import LRUPolicy
 from min_policy import MINPolicy
 from dump_full_cache_to_csv import dump_cache
+from spc import merged_trace, spc_trace
 import numpy as np
 
-def spc_trace(fname, lower, upper):
-    burned = 0
-    yielded = 0
-    with open(fname, 'r') as fin:
-        while True:
-            next_line = fin.readline()
-            if not next_line:
-                raise StopIteration
-            else:
-                asu, lba, size, opcode, timestamp = next_line.split(',')
-                asu = int(asu)
-                lba = int(lba)
-                size = int(size)
-                timestamp = float(timestamp)
-                for i in range(size / 512):
-                    if burned < lower:
-                        burned += 1
-                    elif yielded < upper - lower:
-                        yield int(lba + i), opcode
-                        yielded += 1
-                    else:
-                        raise StopIteration
-
-
 def synthetic_trace(count, tau, theta):
     domain = list(range(100000))
     np.random.seed(0)
@@ -103,7 +80,8 @@ def simulate(request_generator, mmc=None, arc=None, lru=None, mmc_rw=None,
     for i, page_opcode in enumerate(request_generator):
         if seq > 10000:
             break
-        page, opcode = page_opcode
+        # merged_trace requests carry their source as a third field.
+        page, opcode = page_opcode[:2]
       # if i < 50000:
       #     continue
       # seq += 1
@@ -126,6 +104,9 @@ def simulate(request_generator, mmc=None, arc=None, lru=None, mmc_rw=None,
         print mmc.tau, mmc.theta
 
 
+# SPC traces, or page files made from them with spc.convert_spc, which
+# spc_trace reads without scanning up to lower. A tuple of traces is replayed
+# as one multi-tenant trace, merged by timestamp.
 spc_files = [
     "../traces/short.spc",
     "../traces/short2.spc",
@@ -135,7 +116,102 @@ spc_files = [
     "../traces/Financial1.spc",
     "../traces/WebSearch1.spc",
     "../traces/WebSearch2.spc",
-    "../traces/WebSearch3.spc"]
+    "../traces/WebSearch3.spc",
+    ("../traces/Financial1.spc", "../traces/WebSearch1.spc")]
+
+def open_trace(fname, lower, upper):
+    """Requests lower <= i < upper of an spc_files entry: spc_trace for one
+    trace, merged_trace for a tuple of them."""
+    if isinstance(fname, tuple):
+        return merged_trace(fname, lower, upper)
+    return spc_trace(fname, lower, upper)
+
+def compare_watermarks(get_trace, entries, watermarks=(1.0, 0.98, 0.95, 0.9)):
+    """Replays get_trace() through MMCPolicy and MMCRWPolicy once per low
+    watermark and prints each hit rate next to single eviction (1.0).
+
+    On 6000 synthetic requests (tau=0.35, theta=[0.02, 0.002], 70% reads)
+    with 100 entries, where passes counts the requests that paged out:
+
+    watermark      mmc    delta   passes   mmc_rw    delta   passes
+         1.00   0.3450  +0.0000     3830   0.3408  +0.0000     3855
+         0.98   0.3355  -0.0095     1296   0.3280  -0.0128     1311
+         0.95   0.3320  -0.0130      652   0.3248  -0.0160      659
+         0.90   0.3300  -0.0150      357   0.3207  -0.0202      362
+    """
+    results = []
+    for low_watermark in watermarks:
+        csv_suffix = "_watermark_{0}_{1}.csv".format(entries, low_watermark)
+        mmc = MMCPolicy(
+                cache_entries_limit=entries, ghost_entries_limit=entries,
+                trace_size_limit=4 * entries, csv_suffix=csv_suffix,
+                low_watermark=low_watermark)
+        mmc_rw = MMCRWPolicy(
+                cache_entries_limit=entries, ghost_entries_limit=entries,
+                trace_size_limit=4 * entries, csv_suffix=csv_suffix,
+                low_watermark=low_watermark)
+        pageouts = [0, 0]
+        for page, opcode in get_trace():
+            before = [mmc.evict_datapoint['row'], mmc_rw.evict_datapoint['row']]
+            mmc.request(page)
+            mmc_rw.request(page, opcode)
+            pageouts[0] += mmc.evict_datapoint['row'] > before[0]
+            pageouts[1] += mmc_rw.evict_datapoint['row'] > before[1]
+        results.append((low_watermark, mmc.hit_rate(), pageouts[0],
+                        mmc_rw.hit_rate(), pageouts[1]))
+        mmc.close()
+        mmc_rw.close()
+
+    base_mmc = results[0][1]
+    base_mmc_rw = results[0][3]
+    print '{0:>9} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8}'.format(
+            'watermark', 'mmc', 'delta', 'passes', 'mmc_rw', 'delta', 'passes')
+    for low_watermark, mmc_hr, mmc_passes, rw_hr, rw_passes in results:
+        print ('{0:>9.2f} {1:>8.4f} {2:>+8.4f} {3:>8} '
+               '{4:>8.4f} {5:>+8.4f} {6:>8}'.format(
+                    low_watermark, mmc_hr, mmc_hr - base_mmc, mmc_passes,
+                    rw_hr, rw_hr - base_mmc_rw, rw_passes))
+    return results
+
+def compare_metadata(get_trace, entries):
+    """Replays get_trace() through each policy and prints its hit rate next
+    to the metadata it ended up holding and its hits per MB of it."""
+    csv_suffix = "_metadata_{0}.csv".format(entries)
+    policies = [
+            ('mmc', MMCPolicy(
+                cache_entries_limit=entries, ghost_entries_limit=entries,
+                trace_size_limit=4 * entries, csv_suffix=csv_suffix)),
+            ('mmc_rw', MMCRWPolicy(
+                cache_entries_limit=entries, ghost_entries_limit=entries,
+                trace_size_limit=4 * entries, csv_suffix=csv_suffix)),
+            ('arc', ARCPolicy(entries, csv_suffix=csv_suffix)),
+            ('lru', LRUPolicy(entries, csv_suffix=csv_suffix)),
+            ('min', MINPolicy(entries, get_trace(), csv_suffix=csv_suffix))]
+    requests = 0
+    for page, opcode in get_trace():
+        requests += 1
+        for name, policy in policies:
+            if name == 'mmc_rw':
+                policy.request(page, opcode)
+            else:
+                policy.request(page)
+
+    results = []
+    print '{0:>7} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+            'policy', 'hit rate', 'entries', 'ghosts', 'trace', 'indexes',
+            'hits/MB')
+    for name, policy in policies:
+        breakdown = policy.metadata_bytes()
+        total = sum(breakdown.values())
+        results.append((name, policy.hit_rate(), breakdown))
+        print ('{0:>7} {1:>8.4f} {2:>10} {3:>10} {4:>10} {5:>10} '
+               '{6:>10.4f}'.format(
+                    name, policy.hit_rate(), breakdown['entries'],
+                    breakdown['ghosts'], breakdown['trace'],
+                    breakdown['indexes'],
+                    policy.hit_rate() * requests / total * 2**20))
+        policy.close()
+    return results
 
 def run_min(entries, get_trace, csv_suffix):
     min_ = MINPolicy(entries, get_trace(), csv_suffix)
@@ -148,6 +224,7 @@ def run_min(entries, get_trace, csv_suffix):
 
         page, opcode = page_opcode
         min_.request(page)
+    min_.close()
 
 if __name__ == '__main__':
     entries = 445
@@ -170,10 +247,13 @@ if __name__ == '__main__':
     arc = ARCPolicy(entries, csv_suffix=csv_suffix)
     lru = LRUPolicy(entries, csv_suffix=csv_suffix)
 
-    get_trace = lambda: spc_trace(spc_files[file_choice], base, base + limit)
+    get_trace = lambda: open_trace(spc_files[file_choice], base, base + limit)
     #run_min(entries, get_trace, csv_suffix)
     simulate(get_trace(), mmc=mmc, arc=arc, lru=lru, mmc_rw=None,
              tag=tag)
+    mmc.close()
+    arc.close()
+    lru.close()
    #simulate(
    #        synthetic_trace(count=20000, tau=0.35, theta=[0.02, 0.002]),
    #        mmc=mmc, arc=arc, lru=lru, tag=tag)
@@ -0,0 +1,521 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+"""Readers for SPC block traces.
+
+Each line of an SPC trace is asu,lba,size,opcode,timestamp. A request for
+size bytes stands for size / 512 page requests, lba, lba + 1, and so on,
+which is how the simulators consume it. Page numbers only mean something
+within an ASU, so the readers hand out page keys that pack the ASU into the
+bits above ASU_SHIFT, and can keep just the requests of some ASUs.
+
+convert_spc() writes those page requests to a page file once: a header and
+three packed columns, int64 page keys, float64 timestamps and uint8 opcodes.
+read_pages_file() maps the columns with np.memmap, so any window of
+requests is a slice instead of a scan from the start of the trace. The
+readers below take either kind of file.
+
+SPC traces can also be gzip, bzip2 or xz compressed; open_trace() tells
+them apart by their first bytes. xz needs the lzma module, which Python 2
+only has as the backports.lzma package. trace_batches() reads compressed
+traces on a read-ahead thread, so decompressing the next blocks overlaps
+with whatever consumes the current one.
+
+merge_batches() and merged_trace() interleave several traces by timestamp,
+tagging each request with the trace it came from, for replaying tenants
+that share a cache.
+
+    python spc.py trace.spc trace.pages
+"""
+
+from itertools import izip
+import Queue
+import bz2
+import gzip
+import os
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import numpy as np
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# The opcodes are the one non-numeric field. They are swapped for digits
+# before the block is parsed, then looked up in OPCODES.
+OPCODES = np.array(['r', 'w', 'R', 'W'])
+_TO_CODES = string.maketrans('rwRW\n', '0123,')
+
+SECTOR_BYTES = 512
+
+# A page key is asu << ASU_SHIFT | page, which fits an int64 for pages below
+# 2^48 and ASUs up to MAX_ASU.
+ASU_SHIFT = 48
+PAGE_MASK = (1 << ASU_SHIFT) - 1
+MAX_ASU = (1 << (63 - ASU_SHIFT)) - 1
+
+PAGES_MAGIC = 'SPCPAGES'
+# Version 2 page files hold packed page keys. Version 1 held bare pages,
+# which read as keys of ASU 0.
+PAGES_VERSION = 2
+PAGES_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'),
+                         ('reserved', '<u4'), ('count', '<u8')])
+# The columns start past a fixed-size header so they stay 8-byte aligned.
+PAGES_HEADER_BYTES = 64
+
+
+def compression(fname):
+    """'gzip', 'bz2' or 'xz' for a compressed trace file, None otherwise."""
+    with open(fname, 'rb') as fin:
+        magic = fin.read(6)
+    if magic.startswith('\x1f\x8b'):
+        return 'gzip'
+    if magic.startswith('BZh'):
+        return 'bz2'
+    if magic == '\xfd7zXZ\x00':
+        return 'xz'
+    return None
+
+
+def open_trace(fname):
+    """Open a trace file for binary reading, decompressing gzip, bzip2 and
+    xz files."""
+    kind = compression(fname)
+    if kind == 'gzip':
+        return gzip.open(fname, 'rb')
+    if kind == 'bz2':
+        return bz2.BZ2File(fname, 'rb')
+    if kind == 'xz':
+        if lzma is None:
+            raise ImportError("reading %s needs the lzma module" % fname)
+        return lzma.LZMAFile(fname, 'rb')
+    return open(fname, 'rb')
+
+
+def spc_columns(fname, block_size=1 << 22):
+    """Parse an SPC trace block_size bytes at a time. Yields (asu, lba, size,
+    opcode, timestamp) NumPy columns for the whole lines of each block;
+    opcode holds indexes into OPCODES."""
+    with open_trace(fname) as fin:
+        tail = ''
+        while True:
+            block = fin.read(block_size)
+            if not block:
+                break
+            block = tail + block
+            end = block.rfind('\n') + 1
+            tail = block[end:]
+            if end:
+                yield _parse(block[:end])
+        if tail.strip():
+            yield _parse(tail)
+
+
+def _parse(text):
+    text = text.translate(_TO_CODES, '\r').rstrip(',')
+    fields = np.fromstring(text, sep=',')
+    # fromstring stops at the first field it cannot parse.
+    if len(fields) != text.count(',') + 1 or len(fields) % 5:
+        raise ValueError("malformed SPC line")
+    fields = fields.reshape(-1, 5)
+    return (fields[:, 0].astype(np.int64), fields[:, 1].astype(np.int64),
+            fields[:, 2].astype(np.int64), fields[:, 3].astype(np.intp),
+            fields[:, 4])
+
+
+def _expand(lba, size, *columns):
+    """The pages of a block's requests, and each column repeated once per
+    page."""
+    counts = size // SECTOR_BYTES
+    starts = np.cumsum(counts) - counts
+    offsets = np.arange(int(counts.sum())) - np.repeat(starts, counts)
+    return (np.repeat(lba, counts) + offsets,) + tuple(
+            np.repeat(column, counts) for column in columns)
+
+
+def pack_keys(asus, pages):
+    """int64 page keys for the pages of the given ASUs."""
+    asus = np.asarray(asus, dtype=np.int64)
+    pages = np.asarray(pages, dtype=np.int64)
+    if pages.size and (pages.min() < 0 or pages.max() > PAGE_MASK or
+                       asus.min() < 0 or asus.max() > MAX_ASU):
+        raise ValueError("ASU or page out of range for a page key")
+    return (asus << ASU_SHIFT) | pages
+
+
+def unpack_keys(keys):
+    """The (asus, pages) of an array of page keys."""
+    keys = np.asarray(keys, dtype=np.int64)
+    return keys >> ASU_SHIFT, keys & PAGE_MASK
+
+
+def _asu_filter(asus):
+    if asus is None:
+        return None
+    return np.array(sorted(set(asus)), dtype=np.int64)
+
+
+def _window(batches, lower, upper):
+    """The rows lower <= i < upper of a stream of column tuples."""
+    position = 0
+    for batch in batches:
+        total = len(batch[0])
+        first = max(lower - position, 0)
+        last = total if upper is None else min(upper - position, total)
+        position += total
+        if first < last:
+            yield tuple(column[first:last] for column in batch)
+        if upper is not None and position >= upper:
+            return
+
+
+def spc_batches(fname, lower=0, upper=None, block_size=1 << 22,
+                timestamps=False, asus=None, packed=True):
+    """Yield (pages, opcodes) arrays of the page requests lower <= i < upper
+    of an SPC trace, one batch per block. With timestamps, the batches are
+    (pages, opcodes, timestamps).
+
+    The pages are packed page keys, or bare page numbers if not packed.
+    With asus, only the requests of those ASUs are kept, and lower and upper
+    count those requests alone.
+    """
+    keep = _asu_filter(asus)
+    position = 0
+    for asu, lba, size, opcode, timestamp in spc_columns(fname, block_size):
+        if keep is not None:
+            mask = np.in1d(asu, keep)
+            asu, lba, size, opcode, timestamp = (
+                    asu[mask], lba[mask], size[mask], opcode[mask],
+                    timestamp[mask])
+        total = int((size // SECTOR_BYTES).sum())
+        if position + total <= lower:
+            position += total
+            continue
+        repeated = [opcode]
+        if packed:
+            repeated.append(asu)
+        if timestamps:
+            repeated.append(timestamp)
+        expanded = _expand(lba, size, *repeated)
+        pages = expanded[0]
+        if packed:
+            pages = pack_keys(expanded[2], pages)
+        columns = (pages, OPCODES[expanded[1]])
+        if timestamps:
+            columns += (expanded[-1],)
+        first = max(lower - position, 0)
+        last = total if upper is None else min(upper - position, total)
+        position += total
+        if first < last:
+            yield tuple(column[first:last] for column in columns)
+        if upper is not None and position >= upper:
+            return
+
+
+def _layout(count):
+    """Offsets of the page, timestamp and opcode columns and the file size."""
+    pages_at = PAGES_HEADER_BYTES
+    times_at = pages_at + 8 * count
+    opcodes_at = times_at + 8 * count
+    return pages_at, times_at, opcodes_at, opcodes_at + count
+
+
+def _map_columns(fname, count, mode):
+    if not count:
+        # np.memmap cannot map zero bytes.
+        return (np.zeros(0, '<i8'), np.zeros(0, 'u1'), np.zeros(0, '<f8'))
+    pages_at, times_at, opcodes_at, _ = _layout(count)
+    return (np.memmap(fname, '<i8', mode, pages_at, (count,)),
+            np.memmap(fname, 'u1', mode, opcodes_at, (count,)),
+            np.memmap(fname, '<f8', mode, times_at, (count,)))
+
+
+def convert_spc(src, dst, block_size=1 << 22):
+    """Write the page requests of the SPC trace src to the page file dst.
+    Returns the number of requests.
+
+    src is parsed once. The page keys are written in place as they come,
+    the timestamps and opcodes are spooled to temporary files next to dst
+    and copied in behind them, and the count goes into the header last."""
+    spool_dir = os.path.dirname(os.path.abspath(dst))
+    count = 0
+    with open(dst, 'wb') as fout:
+        fout.write('\0' * PAGES_HEADER_BYTES)
+        with tempfile.TemporaryFile(dir=spool_dir) as times, \
+                tempfile.TemporaryFile(dir=spool_dir) as opcodes:
+            for asu, lba, size, opcode, timestamp in spc_columns(
+                    src, block_size):
+                block = _expand(lba, size, opcode, timestamp, asu)
+                pack_keys(block[3], block[0]).astype('<i8').tofile(fout)
+                block[2].astype('<f8').tofile(times)
+                block[1].astype('u1').tofile(opcodes)
+                count += len(block[0])
+            for spool in (times, opcodes):
+                spool.seek(0)
+                shutil.copyfileobj(spool, fout, 1 << 22)
+        header = np.zeros(1, PAGES_HEADER)
+        header['magic'] = PAGES_MAGIC
+        header['version'] = PAGES_VERSION
+        header['count'] = count
+        fout.seek(0)
+        fout.write(header.tostring())
+    return count
+
+
+def is_pages_file(fname):
+    with open(fname, 'rb') as fin:
+        return fin.read(len(PAGES_MAGIC)) == PAGES_MAGIC
+
+
+def read_pages_file(fname):
+    """Map the (pages, opcodes, timestamps) columns of a page file read-only.
+    pages holds packed page keys and opcodes indexes into OPCODES."""
+    header = np.fromfile(fname, PAGES_HEADER, count=1)
+    if len(header) == 0 or header['magic'][0] != PAGES_MAGIC:
+        raise ValueError("%s is not a page file" % fname)
+    if header['version'][0] not in (1, PAGES_VERSION):
+        raise ValueError("%s has page file version %d" % (
+                fname, header['version'][0]))
+    return _map_columns(fname, int(header['count'][0]), 'r')
+
+
+def pages_batches(fname, lower=0, upper=None, batch_size=1 << 16,
+                  timestamps=False, asus=None, packed=True):
+    """Yield (pages, opcodes) arrays of the requests lower <= i < upper of a
+    page file, or (pages, opcodes, timestamps) with timestamps. asus and
+    packed are as for spc_batches. Without asus the window is a slice, and
+    packed keys and timestamps are views of the mapped file; with asus the
+    file is scanned up to the window."""
+    keep = _asu_filter(asus)
+    if keep is not None:
+        batches = pages_batches(fname, batch_size=batch_size,
+                                timestamps=timestamps)
+        for batch in _window(_keep_asus(batches, keep, packed), lower, upper):
+            yield batch
+        return
+    pages, opcodes, times = read_pages_file(fname)
+    if upper is None or upper > len(pages):
+        upper = len(pages)
+    for start in xrange(lower, upper, batch_size):
+        stop = min(start + batch_size, upper)
+        keys = pages[start:stop]
+        if not packed:
+            keys = keys & PAGE_MASK
+        if timestamps:
+            yield keys, OPCODES[opcodes[start:stop]], times[start:stop]
+        else:
+            yield keys, OPCODES[opcodes[start:stop]]
+
+
+def _keep_asus(batches, keep, packed):
+    for batch in batches:
+        mask = np.in1d(batch[0] >> ASU_SHIFT, keep)
+        batch = tuple(column[mask] for column in batch)
+        if not packed:
+            batch = (batch[0] & PAGE_MASK,) + batch[1:]
+        yield batch
+
+
+_DONE = object()
+
+
+def read_ahead(batches, depth=4):
+    """Iterate over batches, producing up to depth of them ahead on a
+    background thread. Exceptions are re-raised in the consumer, and
+    closing the iterator early stops the thread."""
+    queue = Queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if not put((batch, None)):
+                    return
+        except Exception:
+            put((_DONE, sys.exc_info()))
+        else:
+            put((_DONE, None))
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            try:
+                batch, error = queue.get(timeout=0.1)
+            except Queue.Empty:
+                # A producer killed by anything other than an Exception
+                # never queues _DONE.
+                if producer.is_alive() or not queue.empty():
+                    continue
+                raise RuntimeError("read-ahead thread exited early")
+            if batch is _DONE:
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                return
+            yield batch
+    finally:
+        stopped.set()
+
+
+# Read-ahead depth for compressed SPC traces. Parsing holds the GIL, so
+# only decompression overlaps with the consumer, and plain traces are
+# parsed on demand.
+COMPRESSED_DEPTH = 4
+
+
+def trace_batches(fname, lower=0, upper=None, depth=None, timestamps=False,
+                  asus=None, packed=True):
+    """pages_batches or spc_batches, whichever fits the file. SPC traces are
+    parsed depth batches ahead on a read-ahead thread; depth=0 parses them
+    on demand. By default only compressed traces are read ahead."""
+    if is_pages_file(fname):
+        return pages_batches(fname, lower, upper, timestamps=timestamps,
+                             asus=asus, packed=packed)
+    batches = spc_batches(fname, lower, upper, timestamps=timestamps,
+                          asus=asus, packed=packed)
+    if depth is None:
+        depth = COMPRESSED_DEPTH if compression(fname) else 0
+    if depth:
+        return read_ahead(batches, depth)
+    return batches
+
+
+def _ordered_blocks(fname, depth, asus, packed):
+    """The non-empty (pages, opcodes, timestamps) batches of a trace,
+    checking that its timestamps never go back."""
+    last = None
+    for block in trace_batches(fname, depth=depth, timestamps=True,
+                               asus=asus, packed=packed):
+        times = block[2]
+        if not len(times):
+            continue
+        if ((last is not None and times[0] < last) or
+                np.any(times[1:] < times[:-1])):
+            raise ValueError("%s is not in timestamp order" % fname)
+        last = times[-1]
+        yield block
+
+
+def merge_batches(fnames, depth=None, asus=None, packed=True):
+    """Merge the page requests of several traces by timestamp.
+
+    Yields (pages, opcodes, sources) arrays, where sources holds the index in
+    fnames of the trace each request came from. Requests with the same
+    timestamp keep the order of fnames, and their order within each trace.
+    Every trace is read a parsed block at a time: each round merges all the
+    requests up to the earliest last timestamp among the blocks at hand, so
+    only about one block per trace is held at once. The exception is a run
+    of requests sharing that timestamp, which is read to its end and held
+    whole: memory grows with the longest such run, which SPC's microsecond
+    timestamps keep short. depth, asus and packed apply to every trace, as
+    for trace_batches.
+
+    Each round is one stable argsort over the blocks' timestamps rather
+    than a k-way heap merge of the traces. The sort does O(n log n) work to
+    the heap's O(n log k), but it stays in numpy, where the heap would pop
+    the requests one at a time in Python.
+    """
+    sources = [_ordered_blocks(fname, depth, asus, packed)
+               for fname in fnames]
+    blocks = {}
+    for index, source in enumerate(sources):
+        block = next(source, None)
+        if block is not None:
+            blocks[index] = block
+    while blocks:
+        bound = min(block[2][-1] for block in blocks.itervalues())
+        # Read on through requests stamped bound, so that every request up
+        # to bound is at hand and ties are merged in one round.
+        for index, block in blocks.items():
+            run = [block]
+            while run[-1][2][-1] == bound:
+                more = next(sources[index], None)
+                if more is None:
+                    break
+                run.append(more)
+            if len(run) > 1:
+                blocks[index] = tuple(np.concatenate(column)
+                                      for column in zip(*run))
+
+        parts = []
+        for index in sorted(blocks):
+            pages, opcodes, times = blocks[index]
+            cut = np.searchsorted(times, bound, side='right')
+            parts.append((pages[:cut], opcodes[:cut], times[:cut],
+                          np.full(cut, index, dtype=np.intp)))
+            if cut < len(times):
+                blocks[index] = (pages[cut:], opcodes[cut:], times[cut:])
+            else:
+                block = next(sources[index], None)
+                if block is None:
+                    del blocks[index]
+                else:
+                    blocks[index] = block
+        pages, opcodes, times, tags = [np.concatenate(column)
+                                       for column in zip(*parts)]
+        order = np.argsort(times, kind='mergesort')
+        yield pages[order], opcodes[order], tags[order]
+
+
+def merged_trace(fnames, lower=0, upper=None, asus=None, packed=True):
+    """Yield the (page, opcode, source) requests lower <= i < upper of the
+    traces merged by merge_batches, one at a time."""
+    batches = merge_batches(fnames, asus=asus, packed=packed)
+    for pages, opcodes, sources in _window(batches, lower, upper):
+        for request in izip(pages.tolist(), opcodes.tolist(),
+                            sources.tolist()):
+            yield request
+
+
+def spc_trace(fname, lower, upper, asus=None, packed=True):
+    """Yield the (page, opcode) requests lower <= i < upper one at a time,
+    from an SPC trace or a page file. asus and packed are as for
+    spc_batches."""
+    for pages, opcodes in trace_batches(fname, lower, upper, asus=asus,
+                                        packed=packed):
+        for page_opcode in izip(pages.tolist(), opcodes.tolist()):
+            yield page_opcode
+
+
+if __name__ == '__main__':
+    print convert_spc(sys.argv[1], sys.argv[2]), "requests"
@@ -0,0 +1,166 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import collections
+import csv
+import os
+
+
+class TelemetrySink(object):
+    """Where a policy sends its time series.
+
+    A policy calls open() once per series with the file name it used to
+    write under csv/ and the header row. The channel it gets back has the
+    csv writer's writerow(), plus offer_row(). The policy calls offer_row()
+    once for every row it could write, before it spends time filling the row
+    in, and writes the row only if it returns True. A channel may count the
+    offers, so each row is offered exactly once. The policy's close()
+    closes the channels it opened.
+    """
+    def open(self, name, header):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Channel(object):
+    def offer_row(self):
+        return True
+
+    def writerow(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NullChannel(Channel):
+    def offer_row(self):
+        return False
+
+    def writerow(self, row):
+        pass
+
+
+class NullSink(TelemetrySink):
+    """Drops every row."""
+    def open(self, name, header):
+        return NullChannel()
+
+
+class CSVChannel(Channel):
+    def __init__(self, path, header, flush_every, buffer_size):
+        self.file = open(path, "w", buffer_size)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(header)
+        self.flush_every = flush_every
+        self.pending = 0
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.file.flush()
+            self.pending = 0
+
+    def close(self):
+        self.file.close()
+
+
+class BufferedCSVSink(TelemetrySink):
+    """Writes each series to directory/name, flushing every flush_every rows
+    instead of after every row."""
+    def __init__(self, directory="csv", flush_every=4096,
+                 buffer_size=1 << 20):
+        self.directory = directory
+        self.flush_every = flush_every
+        self.buffer_size = buffer_size
+        self.channels = []
+
+    def open(self, name, header):
+        channel = CSVChannel(os.path.join(self.directory, name), header,
+                             self.flush_every, self.buffer_size)
+        self.channels.append(channel)
+        return channel
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+
+
+class SampledChannel(Channel):
+    def __init__(self, channel, every):
+        self.channel = channel
+        self.every = every
+        self.seen = 0
+
+    def offer_row(self):
+        """Count one more row and accept every every-th, from the first."""
+        self.seen += 1
+        return (self.seen - 1) % self.every == 0
+
+    def writerow(self, row):
+        self.channel.writerow(row)
+
+    def close(self):
+        self.channel.close()
+
+
+class SampledSink(TelemetrySink):
+    """Passes the first row and then one row in every to sink."""
+    def __init__(self, sink, every):
+        self.sink = sink
+        self.every = every
+
+    def open(self, name, header):
+        return SampledChannel(self.sink.open(name, header), self.every)
+
+    def close(self):
+        self.sink.close()
+
+
+class RingChannel(Channel):
+    def __init__(self, header, capacity):
+        self.header = header
+        self.rows = collections.deque(maxlen=capacity)
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+class RingSink(TelemetrySink):
+    """Keeps the last capacity rows of each series in memory, in
+    channels[name].rows."""
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.channels = {}
+
+    def open(self, name, header):
+        channel = RingChannel(list(header), self.capacity)
+        self.channels[name] = channel
+        return channel
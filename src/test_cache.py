@@ -26,8 +26,13 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import unittest
+from bisect import bisect_left, insort
 from empirical_cache_hits import LinkedNode, LinkedList, Cache
+from index_rbtree.bplustree import BPlusTree
+from index_rbtree.fenwick import FenwickIndex
+from index_rbtree.persistent import PersistentTree
 from index_rbtree.rbtree import RBTree
+from index_rbtree.skiplist import SkipList
 from numpy import random
 
 
@@ -76,6 +81,347 @@ class TestRBTree(unittest.TestCase):
             self.uut.discard(element)
             sorted_list.remove(element)
 
+    def test_index_many(self):
+        for _ in range(1000):
+            self.uut[random.randint(0, 1000000)] = None
+        keys = list(self.uut.keys())
+        for count in (0, 1, 10, 300, len(keys)):
+            batch = sorted(random.choice(keys, count))
+            self.assertEqual([self.uut.index(key) for key in batch],
+                             self.uut.index_many(batch).tolist())
+        self.assertRaises(KeyError, self.uut.index_many, [-1, keys[0]])
+
+    def test_finger_index(self):
+        # Mix in new minimums and removals of the smallest keys, which move
+        # the node the finger search starts from.
+        for step in range(3000):
+            key = random.randint(-step, 1000)
+            if random.randint(0, 3):
+                self.uut[key] = None
+            else:
+                self.uut.discard(self.uut.min_key() if step % 2 else key)
+            if self.uut:
+                key = self.uut.select(random.randint(0, len(self.uut)))[0]
+                rank = self.uut.index(key)
+                self.assertEqual(rank, self.uut.finger_index(key))
+                self.assertEqual(min(rank, 10),
+                                 self.uut.finger_index(key, limit=10))
+        self.assertRaises(KeyError, self.uut.finger_index, 2000)
+        self.uut.clear()
+        self.uut[5] = None
+        self.assertEqual(0, self.uut.finger_index(5))
+
+    def check_node(self, node):
+        """Return the black height and size of the subtree at node."""
+        if node is None:
+            return 1, 0
+        for child in (node.left, node.right):
+            if child is not None:
+                self.assertIs(node, child.parent)
+                self.assertFalse(node.red and child.red)
+        left_black, left_count = self.check_node(node.left)
+        right_black, right_count = self.check_node(node.right)
+        self.assertEqual(left_black, right_black)
+        self.assertEqual(left_count, node.number_left)
+        self.assertEqual(right_count, node.number_right)
+        return left_black + (not node.red), left_count + right_count + 1
+
+    def test_from_sorted_items(self):
+        for count in range(70):
+            self.uut = RBTree.from_sorted_items((i, -i) for i in range(count))
+            self.check_node(self.uut._root)
+            self.assertEqual(count, len(self.uut))
+            for val in range(count):
+                self.assertEqual(val, self.uut.index(val))
+            for val in range(0, count, 3):
+                self.uut.discard(val)
+                self.uut[count + val] = None
+            self.check_node(self.uut._root)
+        self.assertRaises(ValueError, RBTree.from_sorted_items,
+                          [(1, None), (1, None)])
+
+    def test_update_unsorted(self):
+        to_add = [(random.randint(0, 1000000), None) for _ in range(100)]
+        self.uut.update(to_add)
+        self.check_node(self.uut._root)
+        self.assertEqual(sorted(set(to_add)), list(self.uut.items()))
+
+
+class SortedListTestCase(unittest.TestCase):
+    """Checks an index against a sorted list of its (key, value) items."""
+    def check_matches(self, items, uut):
+        self.assertEqual(len(items), len(uut))
+        self.assertEqual(items, list(uut.items()))
+        self.assertEqual(items[::-1], list(uut.items(reverse=True)))
+        for index, (key, _) in enumerate(items):
+            self.assertEqual(index, uut.index(key))
+
+
+class TestBPlusTree(SortedListTestCase):
+    def setUp(self):
+        # A small order exercises splits, merges and redistribution.
+        self.uut = BPlusTree(order=4)
+        self.reference = RBTree()
+        random.seed(0)
+
+    def check_node(self, node, depth=0):
+        """Return the size and leaf depths of the subtree at node."""
+        uut = self.uut
+        keys = uut._keys[node]
+        self.assertEqual(sorted(keys), keys)
+        if node != uut._root:
+            self.assertTrue(uut._min_fill <= len(keys) <= uut._order)
+        if uut._counts[node] is None:
+            return len(keys), set([depth])
+        count = 0
+        depths = set()
+        for child, child_count in zip(uut._items[node], uut._counts[node]):
+            size, child_depths = self.check_node(child, depth + 1)
+            self.assertEqual(child_count, size)
+            count += size
+            depths |= child_depths
+        return count, depths
+
+    def check_matches_reference(self):
+        size, depths = self.check_node(self.uut._root)
+        self.assertEqual(len(self.reference), size)
+        self.assertEqual(1, len(depths))
+        self.check_matches(list(self.reference.items()), self.uut)
+        self.assertEqual(list(self.reference.item_slice(200, 800, True)),
+                         list(self.uut.item_slice(200, 800, True)))
+
+    def test_inserts_and_discards(self):
+        for step in range(5000):
+            key = random.randint(0, 1000)
+            if random.randint(0, 2):
+                self.uut[key] = step
+                self.reference[key] = step
+            else:
+                self.uut.discard(key)
+                self.reference.discard(key)
+        self.check_matches_reference()
+        for key in list(self.reference.keys()):
+            self.uut.discard(key)
+            self.reference.discard(key)
+        self.check_matches_reference()
+
+    def test_neighbours(self):
+        for key in range(0, 1000, 10):
+            self.uut[key] = key
+            self.reference[key] = key
+        for key in range(-5, 1005, 5):
+            for name in ('floor_item', 'ceiling_item', 'prev_item',
+                         'succ_item'):
+                try:
+                    expected = getattr(self.reference, name)(key)
+                except KeyError:
+                    self.assertRaises(KeyError, getattr(self.uut, name), key)
+                else:
+                    self.assertEqual(expected, getattr(self.uut, name)(key))
+
+    def test_from_sorted_items(self):
+        for count in (0, 1, 5, 100, 1000):
+            self.uut = BPlusTree.from_sorted_items(
+                    (key, None) for key in range(count))
+            self.reference = RBTree((key, None) for key in range(count))
+            self.check_matches_reference()
+
+
+class TestFenwickIndex(unittest.TestCase):
+    def setUp(self):
+        self.uut = FenwickIndex(capacity=4)
+        random.seed(0)
+
+    def test_discard(self):
+        for key in range(0, -100, -1):
+            self.uut[key] = None
+        sorted_list = range(-99, 1)
+        while self.uut:
+            index = random.randint(0, len(sorted_list))
+            element = sorted_list[index]
+            self.assertEqual(index, self.uut.index(element))
+            self.uut.discard(element)
+            sorted_list.remove(element)
+        self.assertRaises(KeyError, self.uut.index, 0)
+
+    def test_rejects_old_keys(self):
+        self.uut[0] = None
+        self.uut[0] = 'updated'
+        self.assertEqual('updated', self.uut[0])
+        self.assertRaises(ValueError, self.uut.__setitem__, 1, None)
+
+
+class TestSkipList(SortedListTestCase):
+    def setUp(self):
+        self.uut = SkipList()
+        self.reference = RBTree()
+        random.seed(0)
+
+    def test_rekey(self):
+        for key in range(500):
+            self.uut[key] = key
+            self.reference[key] = key
+        for _ in range(2000):
+            old_key = random.choice(list(self.reference.keys()))
+            new_key = random.randint(-1000, 1000)
+            if new_key in self.reference:
+                continue
+            self.uut.rekey(old_key, new_key)
+            self.reference.rekey(old_key, new_key)
+            self.assertEqual(self.reference.index(new_key),
+                             self.uut.index(new_key))
+        self.check_matches(list(self.reference.items()), self.uut)
+        self.assertRaises(KeyError, self.uut.rekey, 5000, 5001)
+
+
+class TestPersistentTree(SortedListTestCase):
+    def setUp(self):
+        self.uut = PersistentTree()
+        self.reference = RBTree()
+        random.seed(0)
+
+    def test_snapshots_do_not_change(self):
+        snapshots = []
+        for step in range(3000):
+            key = random.randint(0, 500)
+            if key in self.reference:
+                self.uut.rekey(key, -key - 1)
+                self.reference.rekey(key, -key - 1)
+            elif -key - 1 in self.reference:
+                self.uut.remove(-key - 1)
+                self.reference.remove(-key - 1)
+            else:
+                self.uut[key] = step
+                self.reference[key] = step
+            if step % 500 == 0:
+                snapshots.append((self.uut.snapshot(),
+                                  list(self.reference.items())))
+        self.check_matches(list(self.reference.items()), self.uut)
+        for snapshot, items in snapshots:
+            self.check_matches(items, snapshot)
+        self.assertRaises(TypeError, snapshot.insert, 1, 1)
+        self.assertRaises(TypeError, snapshot.discard, items[0][0])
+
+    def test_from_sorted_items(self):
+        items = [(key, -key) for key in range(0, 3000, 3)]
+        self.assertEqual(items, list(PersistentTree.from_sorted_items(items)
+                                     .items()))
+        self.assertRaises(ValueError, PersistentTree.from_sorted_items,
+                          items[::-1])
+
+
+class TestRankSlice(unittest.TestCase):
+    def check_index(self, uut):
+        for key in range(0, -300, -1):
+            uut[key] = -key
+        for key in range(0, -300, -3):
+            uut.discard(key)
+        items = list(uut.items())
+        for rank in range(-len(items), len(items)):
+            self.assertEqual(items[rank], uut.select(rank))
+        self.assertRaises(IndexError, uut.select, len(items))
+        for start in range(-5, len(items) + 5, 7):
+            for stop in range(-5, len(items) + 5, 13):
+                self.assertEqual(items[start:stop],
+                                 list(uut.by_rank[start:stop].items()))
+                self.assertEqual(items[start:stop][::-1],
+                                 list(uut.by_rank[start:stop].items(True)))
+        self.assertEqual([key for key, _ in items[10:100][5:-5]],
+                         list(uut.by_rank[10:100][5:-5]))
+        self.assertEqual(items[-1], uut.by_rank[-1])
+
+    def test_rbtree(self):
+        self.check_index(RBTree())
+
+    def test_skiplist(self):
+        self.check_index(SkipList())
+
+    def test_fenwick(self):
+        self.check_index(FenwickIndex(capacity=4))
+
+    def test_bplustree(self):
+        self.check_index(BPlusTree(order=4))
+
+    def test_persistent(self):
+        self.check_index(PersistentTree())
+
+
+class TestDifferential(SortedListTestCase):
+    """Random operation mixes on every backend, checked against a sorted
+    list. This is the shared check of the index backends' contents; the
+    per-backend classes above test what is particular to each."""
+    def setUp(self):
+        random.seed(0)
+
+    def check_backend(self, uut, steps, stack_order):
+        keys = []
+        values = {}
+        newest = 0
+        for step in range(steps):
+            op = random.randint(0, 10)
+            if op < 4 or not keys:
+                if stack_order:
+                    newest -= random.randint(1, 4)
+                    key = newest
+                else:
+                    key = random.randint(-5000, 5000)
+                if key not in values:
+                    insort(keys, key)
+                values[key] = step
+                uut[key] = step
+            elif op < 6:
+                key = keys.pop(random.randint(0, len(keys)))
+                value = values.pop(key)
+                if op == 4:
+                    uut.discard(key)
+                else:
+                    self.assertEqual(value, uut.pop(key))
+            elif op < 8 and hasattr(uut, 'rekey') and not stack_order:
+                old_key = keys[random.randint(0, len(keys))]
+                if op == 6:
+                    new_key = random.randint(-5000, 5000)
+                else:
+                    # Mostly stays between the same neighbours.
+                    new_key = old_key + random.randint(-3, 4)
+                if new_key in values:
+                    continue
+                keys.pop(bisect_left(keys, old_key))
+                insort(keys, new_key)
+                values[new_key] = values.pop(old_key)
+                uut.rekey(old_key, new_key)
+            else:
+                rank = random.randint(0, len(keys))
+                key = keys[rank]
+                self.assertEqual(rank, uut.index(key))
+                limit = random.randint(0, len(keys) + 1)
+                self.assertEqual(min(rank, limit),
+                                 uut.finger_index(key, limit))
+                self.assertEqual((key, values[key]), uut.select(rank))
+                if hasattr(uut, 'bisect_left'):
+                    probe = key + random.randint(-2, 3)
+                    self.assertEqual(bisect_left(keys, probe),
+                                     uut.bisect_left(probe))
+                if hasattr(uut, 'index_many'):
+                    sample = keys[rank::7]
+                    self.assertEqual(list(range(rank, len(keys), 7)),
+                                     uut.index_many(sample).tolist())
+            self.assertEqual(len(keys), len(uut))
+            if step % 250 == 0:
+                self.check_matches([(key, values[key]) for key in keys], uut)
+        self.check_matches([(key, values[key]) for key in keys], uut)
+        self.assertRaises(KeyError, uut.index, max(keys) + 1)
+
+    def test_ranker_backends(self):
+        for make_tree in [RBTree, SkipList, PersistentTree,
+                          lambda: BPlusTree(order=4)]:
+            self.check_backend(make_tree(), 3000, stack_order=False)
+
+    def test_stack_backends(self):
+        for make_tree in [RBTree, SkipList, PersistentTree,
+                          lambda: BPlusTree(order=4),
+                          lambda: FenwickIndex(capacity=4)]:
+            self.check_backend(make_tree(), 3000, stack_order=True)
+
 
 class TestLinkedList(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,571 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from index_rbtree import RANKER_INDEXES, STACK_INDEXES
+from mmc import MMCPolicy
+from mmc_array import ArrayMMCPolicy
+from mmc_rw import MMCRWPolicy
+from pageout_daemon import DaemonMMCPolicy
+from ring_trace import RingTrace
+from arc import ARCPolicy
+from lru import LRUPolicy
+from telemetry import BufferedCSVSink, NullSink, RingSink, SampledSink
+from simulate import compare_watermarks, synthetic_trace
+
+
+class PolicyTestCase(unittest.TestCase):
+    """Runs each test in a scratch directory, since the policies write their
+    time series under csv/."""
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.scratch = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.scratch, "csv"))
+        os.chdir(self.scratch)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.scratch)
+
+    def check_matches_reference(self, policy_class=MMCPolicy,
+                                **policy_kwargs):
+        """Replay one synthetic trace through a default MMCPolicy and through
+        policy_class(**policy_kwargs), and check that they end up in the
+        same state."""
+        pages = list(synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02]))
+        reference = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        uut = policy_class(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, csv_suffix="_uut.csv", **policy_kwargs)
+        for page in pages:
+            reference.request(page)
+            uut.request(page)
+        self.assertEqual(reference.num_hits, uut.num_hits)
+        self.assertEqual(reference.tau, uut.tau)
+        self.assertEqual(reference.theta, uut.theta)
+        self.assertEqual(list(reference.full_cache.keys()),
+                         list(uut.full_cache.keys()))
+        self.assertEqual(list(reference.stack.keys()),
+                         list(uut.stack.keys()))
+        self.assertEqual(list(reference.ranker.keys()),
+                         list(uut.ranker.keys()))
+
+
+class TestMMCPageout(PolicyTestCase):
+    def test_victim_searches_match_scan(self):
+        class CheckedMMCPolicy(MMCPolicy):
+            def pageout(inner):
+                expected = inner.scan_victims()
+                self.assertEqual(expected, inner.frontier_victims())
+                self.assertTrue(inner.pageout_examined <= len(inner.stack))
+                MMCPolicy.pageout(inner)
+
+        uut = CheckedMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        for page in synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02]):
+            uut.request(page)
+        self.assertEqual(len(uut.full_cache), 40)
+
+
+class TestArrayMMCPolicy(PolicyTestCase):
+    def test_vector_victims_match_scan(self):
+        class CheckedArrayMMCPolicy(ArrayMMCPolicy):
+            def pageout(inner):
+                self.assertEqual(inner.scan_victims(), inner.vector_victims())
+                ArrayMMCPolicy.pageout(inner)
+
+        uut = CheckedArrayMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        for page in synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02]):
+            uut.request(page)
+        self.assertEqual(len(uut.full_cache), 40)
+        self.assertEqual(len(uut.table.live_slots()), 40)
+
+    def test_matches_mmc_policy(self):
+        self.check_matches_reference(ArrayMMCPolicy)
+
+
+class TestIndexBackends(PolicyTestCase):
+    def test_stack_indexes(self):
+        for index in sorted(STACK_INDEXES):
+            self.check_matches_reference(stack_index=index)
+
+    def test_ranker_indexes(self):
+        for index in sorted(RANKER_INDEXES):
+            self.check_matches_reference(ranker_index=index)
+
+    def test_matching_indexes(self):
+        for index in sorted(set(STACK_INDEXES) & set(RANKER_INDEXES)):
+            self.check_matches_reference(stack_index=index,
+                                         ranker_index=index)
+
+
+class TestSnapshot(PolicyTestCase):
+    def live_rows(self, policy):
+        return [(page, node.is_evicted, node.depth, node.rank,
+                 node.expected_value)
+                for page, node in policy.full_cache.items()]
+
+    def snapshot_rows(self, snapshot):
+        return [(page, node.is_evicted, node.depth, node.rank,
+                 node.expected_value)
+                for page, node in snapshot.full_cache.items()]
+
+    def test_snapshots_are_consistent(self):
+        uut = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, stack_index='persistent',
+                ranker_index='persistent')
+        snapshots = []
+        pages = synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02])
+        for i, page in enumerate(pages):
+            uut.request(page)
+            if i % 150 == 149:
+                for node in uut.full_cache.values():
+                    node.recompute_expected_value()
+                snapshots.append((uut.snapshot(), self.live_rows(uut)))
+        for snapshot, rows in snapshots:
+            self.assertEqual(rows, self.snapshot_rows(snapshot))
+        self.assertEqual(
+                [page for page, node in uut.full_cache.items()
+                 if node.is_evicted],
+                list(uut.evicted_pages.keys()))
+
+    def test_rbtree_cannot_snapshot(self):
+        uut = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        uut.request(1)
+        self.assertRaises(TypeError, uut.snapshot)
+        self.assertRaises(
+                ValueError, MMCPolicy, cache_entries_limit=20,
+                ghost_entries_limit=20, trace_size_limit=80, draw_dump=True,
+                dump_in_background=True)
+
+    def test_background_dump_matches_inline(self):
+        os.mkdir(os.path.join("csv", "cache_dump"))
+        pages = list(synthetic_trace(count=120, tau=0.35, theta=[0.1, 0.02]))
+        for suffix, background in [("_inline.csv", False),
+                                   ("_background.csv", True)]:
+            uut = MMCPolicy(
+                    cache_entries_limit=20, ghost_entries_limit=20,
+                    trace_size_limit=80, csv_suffix=suffix, draw_dump=True,
+                    dump_in_background=background,
+                    stack_index='persistent', ranker_index='persistent')
+            for page in pages:
+                uut.request(page)
+            uut.close()
+        directory = os.path.join("csv", "cache_dump")
+        names = sorted(os.listdir(directory))
+        inline = [name for name in names if "_inline_" in name]
+        self.assertEqual(2 * len(pages), len(inline))
+        for name in inline:
+            with open(os.path.join(directory, name)) as inline_file:
+                with open(os.path.join(directory, name.replace(
+                        "_inline_", "_background_"))) as background_file:
+                    self.assertEqual(inline_file.read(),
+                                     background_file.read())
+
+
+class TestRerankJournal(PolicyTestCase):
+    def test_journal_ranks_match_applied_ranks(self):
+        class CheckedMMCPolicy(MMCPolicy):
+            def apply_reranks(inner):
+                ranks = [(node, node.rank)
+                         for node in inner.full_cache.values()]
+                MMCPolicy.apply_reranks(inner)
+                self.assertEqual(ranks, [(node, node.rank)
+                                         for node, _ in ranks])
+                self.assertFalse(inner.rerank_journal)
+
+        for estimator in ['batch', 'online']:
+            for index in ['rbtree', 'skiplist', 'bplustree', 'persistent']:
+                uut = CheckedMMCPolicy(
+                        cache_entries_limit=20, ghost_entries_limit=20,
+                        trace_size_limit=80, estimator=estimator,
+                        ranker_index=index)
+                pages = synthetic_trace(count=300, tau=0.35,
+                                        theta=[0.1, 0.02])
+                for page in pages:
+                    uut.request(page)
+
+    def test_reranks_are_coalesced(self):
+        uut = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, telemetry=NullSink())
+        for page in synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02]):
+            reranks = uut.num_reranks
+            rekeys = uut.num_rekeys
+            uut.request(page)
+            self.assertEqual(uut.rerank_journal, {})
+            # One move for the requested node and one for the node whose
+            # record left the trace, however often either was reranked.
+            self.assertTrue(uut.num_rekeys - rekeys <= 2)
+            self.assertTrue(
+                    uut.num_rekeys - rekeys <= uut.num_reranks - reranks)
+        # Every rerank used to move its node in the ranker; the journal
+        # moves 814 nodes for 1414 reranks here.
+        self.assertTrue(uut.num_rekeys < 0.6 * uut.num_reranks)
+
+
+class TestWatermarks(PolicyTestCase):
+    def test_single_batch_matches_scan(self):
+        class CheckedMMCPolicy(MMCPolicy):
+            def pageout(inner):
+                min_node, min_ghost = inner.scan_victims()
+                self.assertEqual(([min_node], [min_ghost]),
+                                 inner.batch_victims(1, 1))
+                MMCPolicy.pageout(inner)
+
+        uut = CheckedMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        for page in synthetic_trace(count=400, tau=0.35, theta=[0.1, 0.02]):
+            uut.request(page)
+
+    def test_low_watermark(self):
+        pages = list(synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02]))
+        reference = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, low_watermark=0.5)
+        uut = ArrayMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, csv_suffix="_array.csv",
+                low_watermark=0.5)
+        reached_low = False
+        for page in pages:
+            reference.request(page)
+            uut.request(page)
+            self.assertTrue(reference.num_in_cache <= 20)
+            self.assertTrue(reference.num_in_full_cache <= 40)
+            reached_low = reached_low or reference.num_in_cache == 10
+        self.assertTrue(reached_low)
+        self.assertEqual(reference.num_hits, uut.num_hits)
+
+    def test_mmc_rw_single_batch_matches_scan(self):
+        class CheckedMMCRWPolicy(MMCRWPolicy):
+            def pageout(inner):
+                min_node, min_ghost = inner.scan_victims()
+                self.assertEqual(([min_node], [min_ghost]),
+                                 inner.batch_victims(1, 1))
+                MMCRWPolicy.pageout(inner)
+
+        uut = CheckedMMCRWPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        pages = synthetic_trace(count=400, tau=0.35, theta=[0.1, 0.02])
+        for i, page in enumerate(pages):
+            uut.request(page, 'r' if i % 3 else 'w')
+
+    def test_hit_rate_cost(self):
+        # Fewer eviction passes should cost only a little hit rate against
+        # single eviction (low_watermark=1.0).
+        pages = list(synthetic_trace(count=1500, tau=0.35,
+                                     theta=[0.05, 0.005]))
+        trace = [(page, 'r' if i % 3 else 'w') for i, page in enumerate(pages)]
+        results = compare_watermarks(lambda: iter(trace), 40,
+                                     watermarks=(1.0, 0.9))
+        single, batched = results
+        self.assertTrue(batched[2] < single[2])
+        self.assertTrue(batched[4] < single[4])
+        self.assertTrue(batched[1] > single[1] - 0.05)
+        self.assertTrue(batched[3] > single[3] - 0.05)
+
+    def test_mmc_rw_low_watermark(self):
+        uut = MMCRWPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, low_watermark=0.5)
+        pages = synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02])
+        for i, page in enumerate(pages):
+            uut.request(page, 'r' if i % 3 else 'w')
+            self.assertTrue(uut.num_in_cache <= 20)
+            self.assertTrue(uut.num_in_full_cache <= 40)
+
+
+class TestDaemonMMCPolicy(PolicyTestCase):
+    def test_limits_hold(self):
+        uut = DaemonMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, queue_size=8)
+        try:
+            for page in synthetic_trace(count=600, tau=0.35,
+                                        theta=[0.1, 0.02]):
+                uut.request(page)
+                self.assertTrue(uut.num_in_cache <= 20)
+                self.assertTrue(uut.num_in_full_cache <= 40)
+                self.assertEqual(len(uut.full_cache), uut.num_in_full_cache)
+        finally:
+            uut.close()
+        self.assertFalse(uut.daemon.is_alive())
+
+    def test_pop_victim_skips_requested_nodes(self):
+        uut = DaemonMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        uut.daemon.stop()
+        uut.daemon.join()
+        for page in range(10):
+            uut.request(page)
+        uut.daemon.refill()
+        self.assertEqual(len(uut.evict_queue), 10)
+        stale = uut.evict_queue[0][3]
+        uut.request(stale.page_key)
+        self.assertTrue(uut.pop_victim(uut.evict_queue, resident=True)
+                        is not stale)
+        MMCPolicy.close(uut)
+
+    def test_refill_scores_a_snapshot(self):
+        uut = DaemonMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, queue_size=40)
+        uut.daemon.stop()
+        uut.daemon.join()
+        for page in synthetic_trace(count=300, tau=0.35, theta=[0.1, 0.02]):
+            uut.request(page)
+        uut.daemon.refill()
+        self.assertEqual(len(uut.purge_queue), 40)
+        for value, rank, depth, node, stack_key, is_evicted in uut.purge_queue:
+            self.assertEqual(depth, node.depth)
+            self.assertEqual(rank, node.rank)
+            self.assertEqual(stack_key, node.stack_key)
+            self.assertEqual(is_evicted, node.is_evicted)
+        MMCPolicy.close(uut)
+
+
+class TestOnlineEM(PolicyTestCase):
+    def test_online_estimator(self):
+        class CheckedMMCPolicy(MMCPolicy):
+            def EM_algorithm(inner, delta):
+                self.assertTrue(inner.startup)
+                MMCPolicy.EM_algorithm(inner, delta)
+
+        uut = CheckedMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, estimator='online')
+        for page in synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02]):
+            uut.request(page)
+            self.assertAlmostEqual(uut.tau[0] + uut.tau[1], 1.0)
+            for param in uut.tau + uut.theta:
+                self.assertTrue(0.0 <= param <= 1.0)
+        self.assertFalse(uut.startup)
+
+        hit_counts = {}
+        for record in uut.trace:
+            hit_counts[record.node] = (
+                    hit_counts.get(record.node, 0.0) + 1.0 - record.Z)
+        for node, hit_count in hit_counts.items():
+            if not node.is_purged:
+                self.assertAlmostEqual(node.hit_count, hit_count)
+
+    def test_online_estimates_track_batch(self):
+        pages = list(synthetic_trace(count=2000, tau=0.35, theta=[0.02, 0.002]))
+        policies = []
+        for estimator in ('batch', 'online'):
+            uut = MMCPolicy(
+                    cache_entries_limit=50, ghost_entries_limit=50,
+                    trace_size_limit=200, estimator=estimator,
+                    telemetry=NullSink())
+            for page in pages:
+                uut.request(page)
+            policies.append(uut)
+        batch, online = policies
+        self.assertAlmostEqual(online.tau[0], batch.tau[0], delta=0.05)
+        for online_theta, batch_theta in zip(online.theta, batch.theta):
+            self.assertAlmostEqual(online_theta, batch_theta, delta=0.01)
+
+
+class TestVectorizedEM(PolicyTestCase):
+    def check_parity(self, policy_class, opcodes):
+        class LoopPolicy(policy_class):
+            def EM_algorithm(self, delta):
+                policy_class.EM_algorithm(self, delta, vectorized=False)
+
+        loop = LoopPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, csv_suffix="_loop.csv")
+        vector = policy_class(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, csv_suffix="_vector.csv")
+        pages = synthetic_trace(count=600, tau=0.35, theta=[0.1, 0.02])
+        for i, page in enumerate(pages):
+            for uut in (loop, vector):
+                uut.request(page, *opcodes(i))
+        self.assertFalse(vector.startup)
+        self.assertEqual(loop.tau, vector.tau)
+        self.assertEqual(loop.theta, vector.theta)
+        self.assertEqual(loop.generation, vector.generation)
+        self.assertEqual([record.Z for record in loop.trace],
+                         [record.Z for record in vector.trace])
+        self.assertEqual(list(loop.ranker.keys()), list(vector.ranker.keys()))
+
+    def test_mmc_parity(self):
+        self.check_parity(MMCPolicy, lambda i: ())
+
+    def test_mmc_rw_parity(self):
+        self.check_parity(MMCRWPolicy, lambda i: ('r' if i % 3 else 'w',))
+
+
+class TestRingTrace(unittest.TestCase):
+    class Page(object):
+        trace_slot = None
+
+    def test_wraps_and_counts_references(self):
+        uut = RingTrace(3)
+        a, b = self.Page(), self.Page()
+        for i, page in enumerate([a, b, a]):
+            uut.append(page, i, 0, 0.25 * i)
+        self.assertRaises(IndexError, uut.append, b, 3, 0, 0.0)
+        self.assertEqual(a.trace_slot, uut.slot[uut.row(2)])
+
+        row = uut.popleft()
+        self.assertTrue(uut.node(row) is a)
+        self.assertTrue(a.trace_slot is not None)
+        uut.append(b, 3, 0, 0.75)
+        row = uut.popleft()
+        self.assertTrue(uut.node(row) is b)
+        self.assertTrue(b.trace_slot is not None)
+        row = uut.popleft()
+        self.assertTrue(uut.node(row) is a)
+        self.assertTrue(a.trace_slot is None)
+        self.assertEqual([record.Z for record in uut], [0.75])
+        self.assertEqual(uut[-1].depth, 3.0)
+
+    def test_keeps_full_precision(self):
+        # A node missing from the stack or ranker is given 1 / theta, and
+        # rounding it changed MMCRWPolicy's evictions.
+        uut = RingTrace(2, Z_width=2)
+        uut.append(self.Page(), 1 / 0.3, 1 / 0.07, [1 / 3.0, 0.1])
+        self.assertEqual(uut[0].depth, 1 / 0.3)
+        self.assertEqual(uut[0].rank_memo, 1 / 0.07)
+        self.assertEqual(uut[0].Z, [1 / 3.0, 0.1])
+
+
+class TestMetadataBytes(PolicyTestCase):
+    def test_breakdowns(self):
+        mmc = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        mmc_rw = MMCRWPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80)
+        array = ArrayMMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, csv_suffix="_array.csv")
+        arc = ARCPolicy(20)
+        lru = LRUPolicy(20)
+        for page in synthetic_trace(count=300, tau=0.35, theta=[0.1, 0.02]):
+            for uut in (mmc, array, arc, lru):
+                uut.request(page)
+            mmc_rw.request(page, 'r')
+
+        for uut in (mmc, mmc_rw, array, arc, lru):
+            breakdown = uut.metadata_bytes()
+            self.assertEqual(
+                    sorted(breakdown), ['entries', 'ghosts', 'indexes', 'trace'])
+            self.assertTrue(breakdown['entries'] > 0)
+        self.assertEqual(
+                lru.metadata_bytes()['entries'],
+                sys.getsizeof(lru.cache) +
+                sum(sys.getsizeof(page) for page in lru.cache))
+        for uut in (mmc, mmc_rw, array):
+            breakdown = uut.metadata_bytes()
+            self.assertTrue(breakdown['ghosts'] > 0)
+            self.assertTrue(breakdown['trace'] > 0)
+            self.assertTrue(breakdown['indexes'] > 0)
+
+
+class TestTelemetry(PolicyTestCase):
+    def test_null_sink(self):
+        uut = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, telemetry=NullSink())
+        for page in synthetic_trace(count=300, tau=0.35, theta=[0.1, 0.02]):
+            uut.request(page)
+        self.assertEqual(os.listdir("csv"), [])
+        self.assertTrue(uut.evict_datapoint['row'] > 0)
+
+    def test_ring_and_sampled_sinks(self):
+        ring = RingSink(capacity=50)
+        sampled = RingSink()
+        full = MMCPolicy(
+                cache_entries_limit=20, ghost_entries_limit=20,
+                trace_size_limit=80, telemetry=ring)
+        lru = LRUPolicy(20, telemetry=SampledSink(sampled, 7))
+        for page in synthetic_trace(count=300, tau=0.35, theta=[0.1, 0.02]):
+            full.request(page)
+            lru.request(page)
+
+        series = ring.channels["mmc_mmc.csv"]
+        self.assertEqual(series.header, full.ts_order)
+        self.assertEqual(len(series.rows), 50)
+        self.assertEqual(series.rows[-1][0], 300)
+        rows = sampled.channels["lru.csv"].rows
+        self.assertEqual([row[0] for row in rows], range(1, 301, 7))
+
+    def test_buffered_csv_sink(self):
+        sink = BufferedCSVSink(flush_every=1000)
+        uut = ARCPolicy(20, telemetry=sink)
+        for page in synthetic_trace(count=300, tau=0.35, theta=[0.1, 0.02]):
+            uut.request(page)
+        sink.close()
+        with open("csv/arc.csv") as fin:
+            lines = fin.readlines()
+        self.assertEqual(len(lines), 301)
+        self.assertEqual(lines[0].strip().split(","), uut.ts_order)
+
+    def test_policy_close_flushes(self):
+        policies = [
+                MMCPolicy(
+                    cache_entries_limit=20, ghost_entries_limit=20,
+                    trace_size_limit=80),
+                MMCRWPolicy(
+                    cache_entries_limit=20, ghost_entries_limit=20,
+                    trace_size_limit=80),
+                ARCPolicy(20),
+                LRUPolicy(20)]
+        for page in synthetic_trace(count=300, tau=0.35, theta=[0.1, 0.02]):
+            for uut in policies:
+                if isinstance(uut, MMCRWPolicy):
+                    uut.request(page, 'r')
+                else:
+                    uut.request(page)
+        for uut in policies:
+            uut.close()
+        for name in os.listdir("csv"):
+            with open(os.path.join("csv", name)) as fin:
+                self.assertTrue(len(fin.readlines()) > 1, name)
+        for name in ("mmc_mmc.csv", "mmc_rw_mmc.csv", "arc.csv", "lru.csv"):
+            with open(os.path.join("csv", name)) as fin:
+                self.assertEqual(len(fin.readlines()), 301)
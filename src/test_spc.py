@@ -0,0 +1,340 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+import warnings
+import numpy as np
+import spc
+from spc import (ASU_SHIFT, compression, convert_spc, is_pages_file, lzma, merge_batches,
+                 merged_trace, pack_keys, read_ahead, read_pages_file,
+                 spc_batches, spc_trace, unpack_keys)
+
+LINES = [
+    "0,303567,3584,w,0.000000",
+    "1,55590,3072,r,0.000000",
+    "0,303574,256,w,0.026214",
+    "2,1000,512,W,0.030000",
+    "0,724288,8192,R,0.100125",
+    "1,5,1024,r,1.5",
+]
+
+
+def reference_trace(lines, lower, upper, asus=None, packed=True):
+    """The page requests of lines, one line and sector at a time."""
+    requests = []
+    for line in lines:
+        asu, lba, size, opcode, timestamp = line.split(',')
+        if asus is not None and int(asu) not in asus:
+            continue
+        for i in range(int(size) / 512):
+            page = int(lba) + i
+            if packed:
+                page += int(asu) << ASU_SHIFT
+            requests.append((page, opcode))
+    return requests[lower:upper]
+
+
+class TraceFileTestCase(unittest.TestCase):
+    """Runs each test with a scratch directory for its trace files."""
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, "trace.spc")
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def write(self, lines, ending="\n"):
+        with open(self.path, "wb") as fout:
+            fout.write(ending.join(lines) + ending)
+
+
+class TestSPC(TraceFileTestCase):
+    def test_matches_reference(self):
+        lines = LINES * 50
+        self.write(lines)
+        total = len(reference_trace(lines, 0, None))
+        for lower, upper in [(0, total), (0, 10), (7, 300), (total - 3, total),
+                             (5, total + 100)]:
+            self.assertEqual(reference_trace(lines, lower, upper),
+                             list(spc_trace(self.path, lower, upper)))
+
+    def test_blocks_split_lines(self):
+        lines = LINES * 20
+        self.write(lines, ending="\r\n")
+        expected = reference_trace(lines, 3, 500)
+        for block_size in [1, 7, 64, 1 << 20]:
+            requests = []
+            for pages, opcodes in spc_batches(self.path, 3, 500, block_size):
+                requests.extend(zip(pages.tolist(), opcodes.tolist()))
+            self.assertEqual(expected, requests)
+
+    def test_plain_trace_is_not_compressed(self):
+        self.write(LINES)
+        self.assertEqual(None, compression(self.path))
+
+    def test_no_final_newline(self):
+        with open(self.path, "wb") as fout:
+            fout.write("\n".join(LINES))
+        self.assertEqual(reference_trace(LINES, 0, 100),
+                         list(spc_trace(self.path, 0, 100)))
+
+    def test_asus(self):
+        lines = LINES * 30
+        self.write(lines)
+        self.assertEqual(reference_trace(lines, 0, 50, packed=False),
+                         list(spc_trace(self.path, 0, 50, packed=False)))
+        for asus in [[0], [1, 2], [3]]:
+            for lower, upper in [(0, None), (4, 90)]:
+                self.assertEqual(
+                        reference_trace(lines, lower, upper, asus),
+                        list(spc_trace(self.path, lower, upper, asus)))
+
+    def test_pack_keys(self):
+        asus = np.array([0, 1, 7, 32767])
+        pages = np.array([5, 0, (1 << ASU_SHIFT) - 1, 12])
+        keys = pack_keys(asus, pages)
+        self.assertEqual(np.int64, keys.dtype)
+        self.assertEqual(len(set(keys.tolist())), len(keys))
+        unpacked = unpack_keys(keys)
+        self.assertEqual(asus.tolist(), unpacked[0].tolist())
+        self.assertEqual(pages.tolist(), unpacked[1].tolist())
+        self.assertRaises(ValueError, pack_keys, [0], [1 << ASU_SHIFT])
+        self.assertRaises(ValueError, pack_keys, [1 << 15], [0])
+        self.assertRaises(ValueError, pack_keys, [-1], [0])
+
+    def test_malformed_line(self):
+        self.write(LINES[:2] + ["0,12,512,x,0.5"])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.assertRaises(ValueError, list,
+                              spc_trace(self.path, 0, 100))
+
+
+class TestCompressed(TraceFileTestCase):
+    def check_compressed(self, open_compressed, name, kind):
+        lines = LINES * 30
+        compressed_path = os.path.join(self.scratch, name)
+        fout = open_compressed(compressed_path, 'wb')
+        fout.write("\n".join(lines) + "\n")
+        fout.close()
+        self.assertEqual(kind, compression(compressed_path))
+        self.assertEqual(reference_trace(lines, 2, 400),
+                         list(spc_trace(compressed_path, 2, 400)))
+
+    def test_gzip(self):
+        self.check_compressed(gzip.open, "trace.spc.gz", "gzip")
+
+    def test_bz2(self):
+        self.check_compressed(bz2.BZ2File, "trace.spc.bz2", "bz2")
+
+    @unittest.skipIf(lzma is None, "needs the lzma module")
+    def test_xz(self):
+        self.check_compressed(lzma.LZMAFile, "trace.spc.xz", "xz")
+
+    def test_read_ahead(self):
+        self.assertEqual(range(100), list(read_ahead(iter(range(100)), 3)))
+
+        def failing():
+            yield 1
+            raise KeyError("bad batch")
+        batches = read_ahead(failing())
+        self.assertEqual(1, next(batches))
+        self.assertRaises(KeyError, next, batches)
+
+        def exiting():
+            yield 1
+            raise SystemExit()
+        batches = read_ahead(exiting())
+        self.assertEqual(1, next(batches))
+        self.assertRaises(RuntimeError, next, batches)
+
+        threads = threading.active_count()
+        batches = read_ahead(iter(xrange(10 ** 9)), 2)
+        self.assertEqual(0, next(batches))
+        batches.close()
+        for _ in range(50):
+            if threading.active_count() == threads:
+                break
+            threading.Event().wait(0.05)
+        self.assertEqual(threads, threading.active_count())
+
+
+class TestPagesFile(TraceFileTestCase):
+    def test_converted_trace_matches(self):
+        lines = LINES * 50
+        self.write(lines)
+        pages_path = os.path.join(self.scratch, "trace.pages")
+        total = convert_spc(self.path, pages_path, block_size=64)
+        self.assertEqual(len(reference_trace(lines, 0, None)), total)
+        self.assertTrue(is_pages_file(pages_path))
+        self.assertFalse(is_pages_file(self.path))
+        for lower, upper in [(0, total), (7, 300), (total - 3, total + 5)]:
+            self.assertEqual(list(spc_trace(self.path, lower, upper)),
+                             list(spc_trace(pages_path, lower, upper)))
+
+        pages, opcodes, timestamps = read_pages_file(pages_path)
+        self.assertEqual(total, len(timestamps))
+        self.assertEqual([0.0] * 7, timestamps[:7].tolist())
+        self.assertEqual(1.5, timestamps[-1])
+
+    def test_asus(self):
+        lines = LINES * 40
+        self.write(lines)
+        pages_path = os.path.join(self.scratch, "trace.pages")
+        convert_spc(self.path, pages_path)
+        for asus in [None, [1], [0, 2]]:
+            for packed in [True, False]:
+                for lower, upper in [(0, None), (3, 100)]:
+                    self.assertEqual(
+                            reference_trace(lines, lower, upper, asus, packed),
+                            list(spc_trace(pages_path, lower, upper, asus,
+                                           packed)))
+
+    def test_convert_reads_once(self):
+        self.write(LINES * 50)
+        pages_path = os.path.join(self.scratch, "trace.pages")
+        parses = []
+        spc_columns = spc.spc_columns
+
+        def counted(*args):
+            parses.append(args)
+            return spc_columns(*args)
+
+        spc.spc_columns = counted
+        try:
+            convert_spc(self.path, pages_path, block_size=64)
+        finally:
+            spc.spc_columns = spc_columns
+        self.assertEqual(1, len(parses))
+        self.assertEqual(sorted(["trace.pages", os.path.basename(self.path)]),
+                         sorted(os.listdir(self.scratch)))
+
+    def test_empty_trace(self):
+        self.write([], ending="")
+        pages_path = os.path.join(self.scratch, "trace.pages")
+        self.assertEqual(0, convert_spc(self.path, pages_path))
+        self.assertEqual([], list(spc_trace(pages_path, 0, 10)))
+
+    def test_rejects_other_files(self):
+        self.write(LINES)
+        self.assertRaises(ValueError, read_pages_file, self.path)
+
+
+class TestMerge(TraceFileTestCase):
+    def write_tenants(self, count, lines_per_tenant, sizes):
+        """Write count traces whose timestamps collide now and then. Returns
+        their paths and the requests of each as (timestamp, page, opcode)."""
+        paths = []
+        requests = []
+        for tenant in range(count):
+            lines = []
+            tenant_requests = []
+            timestamp = 0.0
+            for i in range(lines_per_tenant):
+                timestamp += (i * (tenant + 3)) % 4 * 0.25
+                size = sizes[(i + tenant) % len(sizes)]
+                opcode = "rw"[(i * tenant) % 2]
+                lba = 1000 * tenant + i
+                lines.append("%d,%d,%d,%s,%f" % (tenant, lba, size, opcode,
+                                                 timestamp))
+                for sector in range(size / 512):
+                    page = (tenant << ASU_SHIFT) + lba + sector
+                    tenant_requests.append((timestamp, page, opcode))
+            path = os.path.join(self.scratch, "tenant%d.spc" % tenant)
+            with open(path, "wb") as fout:
+                fout.write("\n".join(lines) + "\n")
+            paths.append(path)
+            requests.append(tenant_requests)
+        return paths, requests
+
+    def reference_merge(self, requests):
+        merged = []
+        for source, tenant_requests in enumerate(requests):
+            for position, (timestamp, page, opcode) in enumerate(
+                    tenant_requests):
+                merged.append(((timestamp, source, position),
+                               (page, opcode, source)))
+        merged.sort()
+        return [request for _, request in merged]
+
+    def test_merge_matches_reference(self):
+        paths, requests = self.write_tenants(3, 200, [512, 4096, 0, 1024])
+        expected = self.reference_merge(requests)
+        self.assertEqual(expected, list(merged_trace(paths)))
+        self.assertEqual(expected[10:500], list(merged_trace(paths, 10, 500)))
+
+    def test_merge_across_blocks(self):
+        paths, requests = self.write_tenants(3, 12000, [4096, 8192, 512])
+        pages_paths = []
+        for path in paths:
+            convert_spc(path, path + ".pages")
+            pages_paths.append(path + ".pages")
+        expected = self.reference_merge(requests)
+        batches = list(merge_batches(pages_paths[:2] + paths[2:]))
+        self.assertTrue(len(batches) > 1)
+        merged = []
+        for pages, opcodes, sources in batches:
+            merged.extend(zip(pages.tolist(), opcodes.tolist(),
+                              sources.tolist()))
+        self.assertEqual(expected, merged)
+
+    def test_merge_long_tie(self):
+        paths = []
+        requests = []
+        for tenant in range(2):
+            path = os.path.join(self.scratch, "tie%d.spc" % tenant)
+            with open(path, "wb") as fout:
+                for lba in range(30000):
+                    fout.write("%d,%d,4096,r,1.000000\n" % (tenant, lba * 8))
+            convert_spc(path, path + ".pages")
+            paths.append(path + ".pages")
+            requests.append([(1.0, (tenant << ASU_SHIFT) + page, "r")
+                             for page in range(240000)])
+        batches = list(merge_batches(paths))
+        self.assertEqual(len(batches), 1)
+        pages, opcodes, sources = batches[0]
+        self.assertEqual(self.reference_merge(requests),
+                         zip(pages.tolist(), opcodes.tolist(),
+                             sources.tolist()))
+
+    def test_merge_asus(self):
+        paths, requests = self.write_tenants(3, 200, [512, 4096])
+        expected = [(page & ((1 << ASU_SHIFT) - 1), opcode, source)
+                    for page, opcode, source in self.reference_merge(requests)
+                    if source != 1]
+        self.assertEqual(expected,
+                         list(merged_trace(paths, asus=[0, 2], packed=False)))
+
+    def test_rejects_unordered_trace(self):
+        self.write(["0,1,512,r,2.0", "0,2,512,r,1.0"])
+        self.assertRaises(ValueError, list, merged_trace([self.path]))
@@ -0,0 +1,118 @@
+"""
+Copyright (c) 2014, Logan P. Evans <loganpevans@gmail.com>
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+from ring_trace import READ_FLAG, WRITE_FLAG
+import numpy as np
+
+
+def sequential_sum(values):
+    """Sum values left to right, like the += loops in M_step.
+
+    np.sum adds pairwise, which rounds differently."""
+    if not len(values):
+        return 0.0
+    return float(np.cumsum(values)[-1])
+
+
+class TraceColumns(object):
+    """The trace and the ranker gathered into NumPy columns for one EM run.
+
+    Records are indexed in trace order. Nodes still in full_cache are given
+    slots in full_cache order, which is the order E_step hands out ranker
+    generations in. Records of purged nodes get slot -1 and keep their
+    rank_purge_memo. During the run, node_rank plays the part of the ranker;
+    store() writes Z, hit counts and one rebuilt ranker back to the cache.
+    """
+    def __init__(self, cache):
+        trace = cache.trace
+        self.trace = trace
+        self.nodes = list(cache.full_cache.values())
+        slots = {}
+        node_slot = np.full(trace.capacity, -1, dtype=np.intp)
+        for slot, node in enumerate(self.nodes):
+            slots[node] = slot
+            if node.trace_slot is not None:
+                node_slot[node.trace_slot] = slot
+        self.node_rank = np.empty(len(self.nodes))
+        for rank, node in enumerate(cache.ranker.values()):
+            self.node_rank[slots[node]] = rank
+
+        self.rows = trace.rows()
+        trace_slot = trace.slot[self.rows]
+        purge_rank = np.zeros(trace.capacity)
+        for used in np.unique(trace_slot).tolist():
+            if node_slot[used] < 0:
+                purge_rank[used] = trace.nodes[used].rank_purge_memo
+        self.slot = node_slot[trace_slot]
+        self.purge_rank = purge_rank[trace_slot]
+        self.depth = trace.depth[self.rows]
+        flags = trace.flags[self.rows]
+        self.opcode = np.where(flags & READ_FLAG, 'r',
+                               np.where(flags & WRITE_FLAG, 'w', ''))
+        self.purged = self.slot < 0
+        self.live = ~self.purged
+        self.live_slot = self.slot[self.live]
+
+        self.Z = None
+        self.hit_count = None
+        self.ranker_gen = None
+        self.by_rank = None
+
+    def set_Z(self, Z):
+        """Use Z for the records."""
+        self.Z = Z
+
+    def record_ranks(self):
+        """Return the rank each record sees, as in update_tau_and_theta_accs."""
+        if not len(self.nodes):
+            return self.purge_rank.copy()
+        return np.where(self.purged, self.purge_rank,
+                        self.node_rank[self.slot])
+
+    def rerank(self, cache, weights):
+        """Set the hit counts to the per-node sums of weights and sort the
+        nodes by (-hit_count, generation), as E_step's new ranker does."""
+        count = len(self.nodes)
+        self.hit_count = np.bincount(
+                self.live_slot, weights=weights[self.live], minlength=count)
+        self.ranker_gen = cache.generation - np.arange(count)
+        cache.generation -= count
+        self.by_rank = np.lexsort((self.ranker_gen, -self.hit_count))
+        self.node_rank[self.by_rank] = np.arange(count)
+
+    def store(self, cache):
+        """Write the Z values and the final hit counts and ranker back to
+        cache."""
+        self.trace.Z[self.rows] = self.Z
+        for node, hit_count, gen in zip(self.nodes, self.hit_count.tolist(),
+                                        self.ranker_gen.tolist()):
+            node._hit_count = hit_count
+            node.ranker_key = (-hit_count, gen)
+        nodes = self.nodes
+        cache.ranker = type(cache.ranker).from_sorted_items(
+                (nodes[slot].ranker_key, nodes[slot])
+                for slot in self.by_rank.tolist())